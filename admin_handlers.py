@@ -0,0 +1,137 @@
+"""
+Команды администратора (рассылки, аналитика)
+
+Доступны только пользователям из ADMIN_TELEGRAM_IDS.
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+from telegram import Update
+from telegram.ext import ContextTypes
+from telegram.constants import ParseMode
+
+import messages
+from analytics import ALL_STATES, funnel_analytics, format_funnel_report
+from broadcast import broadcast_engine
+from config import ADMIN_TELEGRAM_IDS
+from database import Database
+from logger import bot_logger
+
+# Инициализация базы данных
+db = Database()
+
+# Все известные состояния пользователя
+KNOWN_STATES = set(ALL_STATES)
+
+
+def is_admin(telegram_id: int) -> bool:
+    return telegram_id in ADMIN_TELEGRAM_IDS
+
+
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    /broadcast СОСТОЯНИЕ ДНЕЙ ТЕКСТ - рассылка пользователям в состоянии без активности N дней
+    """
+    telegram_id = update.effective_user.id
+    if not is_admin(telegram_id):
+        return
+
+    # text_html сохраняет форматирование текста рассылки
+    parts = (update.message.text_html or '').split(maxsplit=3)
+    if len(parts) < 4 or not parts[2].isdigit():
+        await update.message.reply_text(messages.BROADCAST_USAGE, parse_mode=ParseMode.HTML)
+        return
+
+    _, state, days, text = parts
+    if state not in KNOWN_STATES:
+        await update.message.reply_text(
+            messages.BROADCAST_UNKNOWN_STATE.format(state=state),
+            parse_mode=ParseMode.HTML
+        )
+        return
+
+    inactive_days = int(days)
+    # Граница фиксируется при создании, чтобы после перезапуска выборка не менялась
+    updated_before = (datetime.utcnow() - timedelta(days=inactive_days)).isoformat() if inactive_days else None
+
+    progress_message = await update.message.reply_text(
+        messages.BROADCAST_STATUS_RUNNING,
+        parse_mode=ParseMode.HTML
+    )
+
+    broadcast = await asyncio.to_thread(db.create_broadcast, {
+        "admin_id": telegram_id,
+        "state": state,
+        "inactive_days": inactive_days,
+        "updated_before": updated_before,
+        "text": text,
+        "progress_chat_id": progress_message.chat_id,
+        "progress_message_id": progress_message.message_id,
+    })
+    if not broadcast:
+        await progress_message.edit_text(messages.BROADCAST_CREATE_ERROR, parse_mode=ParseMode.HTML)
+        return
+
+    bot_logger.info('SYSTEM', 'Запущена рассылка', telegram_id=telegram_id,
+                    broadcast_id=broadcast['id'], state=state, inactive_days=inactive_days)
+    broadcast_engine.start(context.bot, broadcast)
+
+
+async def broadcast_status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    /broadcast_status - список активных рассылок
+    """
+    if not is_admin(update.effective_user.id):
+        return
+
+    active = broadcast_engine.active()
+    if not active:
+        await update.message.reply_text(messages.BROADCAST_NONE_ACTIVE)
+        return
+
+    await update.message.reply_text(
+        "📣 Активные рассылки: " + ", ".join(f"#{broadcast_id}" for broadcast_id in active)
+    )
+
+
+async def broadcast_cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    /broadcast_cancel ID - остановка рассылки
+    """
+    telegram_id = update.effective_user.id
+    if not is_admin(telegram_id):
+        return
+
+    if not context.args or not context.args[0].isdigit():
+        await update.message.reply_text(messages.BROADCAST_CANCEL_USAGE, parse_mode=ParseMode.HTML)
+        return
+
+    broadcast_id = int(context.args[0])
+    if not broadcast_engine.cancel(broadcast_id):
+        await update.message.reply_text(
+            messages.BROADCAST_NOT_FOUND.format(broadcast_id=broadcast_id),
+            parse_mode=ParseMode.HTML
+        )
+        return
+
+    bot_logger.info('SYSTEM', 'Рассылка остановлена администратором',
+                    telegram_id=telegram_id, broadcast_id=broadcast_id)
+
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    /stats - воронка из последнего снимка, /stats refresh - пересчитать сейчас
+    """
+    if not is_admin(update.effective_user.id):
+        return
+
+    if context.args and context.args[0] == 'refresh':
+        snapshot = await funnel_analytics.refresh()
+    else:
+        snapshot = await funnel_analytics.latest()
+
+    if not snapshot:
+        await update.message.reply_text(messages.STATS_NOT_READY, parse_mode=ParseMode.HTML)
+        return
+
+    await update.message.reply_text(format_funnel_report(snapshot), parse_mode=ParseMode.HTML)
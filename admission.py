@@ -0,0 +1,302 @@
+"""
+Контроль допуска к регистрации при наплыве пользователей
+
+Когда открывается поток, тысячи учеников одновременно вводят email, и
+каждая регистрация - это запросы к базе, отправка видео и напоминания.
+Одновременно выполняется не больше max_active регистраций, остальные
+ждут в очереди в порядке прихода. Ожидающие получают сообщение с местом
+в очереди и примерным временем; оно редактируется не чаще раза в
+update_interval секунд на пользователя и с общим ограничением частоты.
+Если очередь заполнена, пользователь сразу получает просьбу повторить
+позже - задержка для уже допущенных не растет.
+
+Регистрация выполняется в отдельной задаче, а не в обработчике
+обновления: ожидание в очереди не задерживает обработку других
+обновлений. При остановке бота (drain) начатые регистрации
+дорабатывают, а ожидающие в очереди получают просьбу повторить позже.
+"""
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+
+from telegram import Bot
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, TelegramError
+
+import messages
+from config import (
+    ADMISSION_MAX_ACTIVE, ADMISSION_MAX_QUEUE, ADMISSION_UPDATE_INTERVAL,
+    ADMISSION_EDIT_RATE, ADMISSION_SESSION_ESTIMATE
+)
+from logger import bot_logger
+from metrics import metrics
+from rate_limit import TokenBucket
+
+# Сглаживание средней длительности регистрации для оценки ожидания
+DURATION_SMOOTHING = 0.2
+
+admission_active = metrics.gauge('admission_active', 'Выполняющиеся регистрации')
+admission_queued = metrics.gauge('admission_queued', 'Пользователи в очереди на регистрацию')
+admission_total = metrics.counter('admission_total', 'Решения контроля допуска (started, queued, shed, duplicate)')
+admission_wait_seconds = metrics.histogram(
+    'admission_wait_seconds', 'Ожидание в очереди на регистрацию',
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800)
+)
+
+Session = Callable[[], Awaitable[None]]
+
+
+class QueuedSession:
+    """Пользователь в очереди на регистрацию"""
+
+    def __init__(self, telegram_id: int, session: Session, bot: Bot):
+        self.telegram_id = telegram_id
+        self.session = session
+        self.bot = bot
+        self.enqueued_at = time.monotonic()
+        self.message_id: Optional[int] = None
+        self.last_text = ''
+        self.last_edit = 0.0
+
+
+def format_eta(seconds: float) -> str:
+    """Примерное время ожидания для сообщения пользователю"""
+    if seconds < 60:
+        return 'меньше минуты'
+    return f'~{math.ceil(seconds / 60)} мин'
+
+
+class AdmissionController:
+    """Ограничение одновременных регистраций с очередью FIFO"""
+
+    def __init__(
+        self,
+        max_active: int,
+        max_queue: int,
+        update_interval: float,
+        edit_limiter: TokenBucket,
+        session_estimate: float
+    ):
+        """
+        Args:
+            max_active: Одновременных регистраций (0 - без ограничения)
+            max_queue: Максимальная длина очереди, сверх нее - отказ с просьбой повторить
+            update_interval: Не чаще чем раз во столько секунд обновлять место в очереди у пользователя
+            edit_limiter: Общее ограничение частоты сообщений об очереди
+            session_estimate: Начальная оценка длительности регистрации (секунды)
+        """
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.update_interval = update_interval
+        self.edit_limiter = edit_limiter
+        self._avg_duration = session_estimate
+        self._active: Dict[int, asyncio.Task] = {}
+        self._queue: 'OrderedDict[int, QueuedSession]' = OrderedDict()
+        self._updater: Optional[asyncio.Task] = None
+        self._cleanup_tasks: set = set()
+        self.closed = False
+
+    @property
+    def active(self) -> int:
+        return len(self._active)
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+    def eta(self, position: int) -> float:
+        """Оценка ожидания для места position в очереди (секунды)"""
+        if not self.max_active:
+            return 0.0
+        return math.ceil(position / self.max_active) * self._avg_duration
+
+    async def submit(self, bot: Bot, telegram_id: int, session: Session) -> str:
+        """
+        Запускает регистрацию сразу или ставит пользователя в очередь
+
+        Args:
+            bot: Объект бота (для сообщений об очереди)
+            telegram_id: ID пользователя
+            session: Корутина-функция регистрации
+
+        Returns:
+            'started', 'queued', 'shed' (очередь заполнена) или 'duplicate' (уже в очереди или регистрируется;
+            в очереди сохраняется последний отправленный email)
+        """
+        if telegram_id in self._active:
+            admission_total.inc(result='duplicate')
+            await self._send(bot, telegram_id, messages.ADMISSION_IN_PROGRESS)
+            return 'duplicate'
+        
+        entry = self._queue.get(telegram_id)
+        if entry is not None:
+            # Повторный email мог быть отправлен из-за опечатки в первом - регистрируем последний
+            entry.session = session
+            admission_total.inc(result='duplicate')
+            position = list(self._queue).index(telegram_id) + 1
+            await self._send(bot, telegram_id, messages.ADMISSION_EMAIL_UPDATED.format(
+                position=position, eta=format_eta(self.eta(position))
+            ))
+            return 'duplicate'
+
+        if not self.closed and (not self.max_active or (len(self._active) < self.max_active and not self._queue)):
+            admission_total.inc(result='started')
+            self._start(telegram_id, session, waited=0.0)
+            return 'started'
+
+        if self.closed or len(self._queue) >= self.max_queue:
+            admission_total.inc(result='shed')
+            retry = format_eta(self.eta(len(self._queue)))
+            bot_logger.warning('SYSTEM', 'Очередь регистрации заполнена, пользователю предложено повторить',
+                               telegram_id=telegram_id, queued=len(self._queue))
+            await self._send(bot, telegram_id, messages.ADMISSION_OVERLOADED.format(retry=retry))
+            return 'shed'
+
+        entry = QueuedSession(telegram_id, session, bot)
+        self._queue[telegram_id] = entry
+        admission_queued.set(len(self._queue))
+        admission_total.inc(result='queued')
+
+        position = len(self._queue)
+        entry.last_text = self._queue_text(position)
+        entry.last_edit = time.monotonic()
+        message = await self._send(bot, telegram_id, entry.last_text)
+        if message is not None:
+            entry.message_id = message.message_id
+            if telegram_id not in self._queue:
+                # Место освободилось, пока отправлялось сообщение
+                await self._delete(entry)
+
+        if self._updater is None or self._updater.done():
+            self._updater = asyncio.create_task(self._update_positions())
+        return 'queued'
+
+    async def drain(self, timeout: float) -> Dict[str, int]:
+        """
+        Ждет начатые регистрации при остановке бота
+
+        Новые регистрации не допускаются, ожидающим в очереди предлагается
+        повторить позже. Не завершившиеся за timeout регистрации прерываются.
+
+        Args:
+            timeout: Сколько ждать начатые регистрации (секунды)
+
+        Returns:
+            completed (дождались), cancelled (прерваны), dropped (убраны из очереди)
+        """
+        self.closed = True
+        if self._updater is not None:
+            self._updater.cancel()
+        dropped = list(self._queue.values())
+        self._queue.clear()
+        admission_queued.set(0)
+        retry = format_eta(self._avg_duration)
+        notify = asyncio.gather(*(self._release(entry, retry) for entry in dropped))
+
+        tasks = list(self._active.values())
+        pending = set()
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        await notify
+
+        report = {'completed': len(tasks) - len(pending), 'cancelled': len(pending), 'dropped': len(dropped)}
+        if pending:
+            bot_logger.warning('SYSTEM', 'Остановка: регистрации прерваны по таймауту', **report)
+        return report
+
+    async def _release(self, entry: QueuedSession, retry: str) -> None:
+        """Убирает сообщение об очереди и просит повторить регистрацию после перезапуска"""
+        if entry.message_id:
+            await self._delete(entry)
+        await self._send(entry.bot, entry.telegram_id, messages.ADMISSION_OVERLOADED.format(retry=retry))
+
+    def _start(self, telegram_id: int, session: Session, waited: float) -> None:
+        admission_wait_seconds.observe(waited)
+        self._active[telegram_id] = asyncio.create_task(self._run(telegram_id, session))
+        admission_active.set(len(self._active))
+
+    async def _run(self, telegram_id: int, session: Session) -> None:
+        started = time.monotonic()
+        try:
+            await session()
+        except asyncio.CancelledError:
+            bot_logger.warning('SYSTEM', 'Регистрация прервана остановкой бота', telegram_id=telegram_id)
+            raise
+        except Exception as e:
+            bot_logger.error('SYSTEM', f'Ошибка регистрации: {str(e)}', telegram_id=telegram_id, error=e)
+        finally:
+            duration = time.monotonic() - started
+            self._avg_duration += DURATION_SMOOTHING * (duration - self._avg_duration)
+            self._active.pop(telegram_id, None)
+            self._admit_next()
+
+    def _admit_next(self) -> None:
+        """Допускает следующих из очереди на освободившиеся места"""
+        while self._queue and len(self._active) < self.max_active and not self.closed:
+            _, entry = self._queue.popitem(last=False)
+            self._start(entry.telegram_id, entry.session, waited=time.monotonic() - entry.enqueued_at)
+            if entry.message_id:
+                task = asyncio.create_task(self._delete(entry))
+                self._cleanup_tasks.add(task)
+                task.add_done_callback(self._cleanup_tasks.discard)
+        admission_queued.set(len(self._queue))
+        admission_active.set(len(self._active))
+
+    def _queue_text(self, position: int) -> str:
+        return messages.ADMISSION_QUEUED.format(position=position, eta=format_eta(self.eta(position)))
+
+    async def _update_positions(self) -> None:
+        """Обновляет место в очереди у ожидающих, пока очередь не опустеет"""
+        while self._queue:
+            await asyncio.sleep(self.update_interval)
+            now = time.monotonic()
+            for position, entry in enumerate(list(self._queue.values()), start=1):
+                if entry.telegram_id not in self._queue or not entry.message_id:
+                    continue
+                text = self._queue_text(position)
+                if text == entry.last_text or now - entry.last_edit < self.update_interval:
+                    continue
+                await self.edit_limiter.acquire()
+                if entry.telegram_id not in self._queue:
+                    continue
+                entry.last_text = text
+                entry.last_edit = time.monotonic()
+                try:
+                    await entry.bot.edit_message_text(chat_id=entry.telegram_id, message_id=entry.message_id,
+                                                      text=text, parse_mode=ParseMode.HTML)
+                except BadRequest:
+                    # Текст не изменился или сообщение удалено - место в очереди не критично
+                    pass
+                except TelegramError as e:
+                    bot_logger.warning('SYSTEM', f'Не удалось обновить место в очереди: {str(e)}',
+                                       telegram_id=entry.telegram_id)
+
+    async def _send(self, bot: Bot, telegram_id: int, text: str):
+        await self.edit_limiter.acquire()
+        try:
+            return await bot.send_message(chat_id=telegram_id, text=text, parse_mode=ParseMode.HTML)
+        except TelegramError as e:
+            bot_logger.warning('SYSTEM', f'Не удалось отправить сообщение об очереди: {str(e)}',
+                               telegram_id=telegram_id)
+            return None
+
+    async def _delete(self, entry: QueuedSession) -> None:
+        try:
+            await entry.bot.delete_message(chat_id=entry.telegram_id, message_id=entry.message_id)
+        except TelegramError:
+            pass
+
+
+# Глобальный контроль допуска к регистрации
+admission = AdmissionController(
+    max_active=ADMISSION_MAX_ACTIVE,
+    max_queue=ADMISSION_MAX_QUEUE,
+    update_interval=ADMISSION_UPDATE_INTERVAL,
+    edit_limiter=TokenBucket(ADMISSION_EDIT_RATE),
+    session_estimate=ADMISSION_SESSION_ESTIMATE,
+)
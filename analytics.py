@@ -0,0 +1,131 @@
+"""
+Аналитика воронки обучения
+
+Количество пользователей по состояниям, конверсия между этапами и медианное
+время в состоянии считаются SQL функцией funnel_stats на стороне базы
+(см. setup.sql). Результат периодически сохраняется снимком в funnel_snapshots,
+а /stats и GET /analytics/funnel читают только последний снимок - таблица
+users при просмотре отчета не сканируется.
+"""
+import asyncio
+from typing import Any, Dict, List, Optional
+
+from telegram.ext import ContextTypes
+
+from config import UserState
+from database import Database
+from logger import bot_logger
+
+# Инициализация базы данных
+db = Database()
+
+# Все состояния в порядке прохождения обучения (порядок объявления в UserState)
+ALL_STATES: List[str] = [
+    value for name, value in vars(UserState).items()
+    if not name.startswith('_') and isinstance(value, str)
+]
+
+# Ключевые этапы воронки (этап достигнут, если пользователь побывал в этом состоянии)
+FUNNEL_STAGES: List[str] = [
+    UserState.REGISTERED,
+    UserState.VIDEO_SENT,
+    UserState.VIDEO_WATCHED,
+    UserState.LEARN3_SENT,
+    UserState.LEARN4_SENT,
+    UserState.ALL_POSTS_COMPLETED,
+    UserState.LEARN5_SENT,
+    UserState.POST_PUBLISHED,
+    UserState.LEARN6_SENT,
+    UserState.LEARN7_SENT,
+    UserState.FINAL_STEP,
+    UserState.COMPLETED,
+]
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    """Человекочитаемая длительность: 45 сек, 12 мин, 3 ч 20 мин, 2 дн 5 ч"""
+    if seconds is None:
+        return '—'
+    seconds = int(seconds)
+    if seconds < 60:
+        return f'{seconds} сек'
+    if seconds < 3600:
+        return f'{seconds // 60} мин'
+    if seconds < 86400:
+        return f'{seconds // 3600} ч {seconds % 3600 // 60} мин'
+    return f'{seconds // 86400} дн {seconds % 86400 // 3600} ч'
+
+
+class FunnelAnalytics:
+    """Снимки аналитики воронки"""
+
+    def __init__(self):
+        self._snapshot: Optional[Dict[str, Any]] = None
+
+    async def refresh(self) -> Optional[Dict[str, Any]]:
+        """
+        Пересчитывает агрегаты в базе и сохраняет новый снимок
+
+        Returns:
+            Новый снимок или None при ошибке
+        """
+        snapshot = await asyncio.to_thread(db.refresh_funnel_snapshot, FUNNEL_STAGES)
+        if snapshot:
+            self._snapshot = snapshot
+            bot_logger.info('SYSTEM', 'Обновлен снимок аналитики воронки',
+                            total_users=snapshot.get('total_users'))
+        return snapshot
+
+    async def refresh_job(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Callback для job_queue: периодическое обновление снимка"""
+        await self.refresh()
+
+    async def latest(self) -> Optional[Dict[str, Any]]:
+        """
+        Последний снимок (из памяти, после перезапуска - из funnel_snapshots)
+
+        Returns:
+            Снимок или None, если снимков еще нет
+        """
+        if self._snapshot is None:
+            self._snapshot = await asyncio.to_thread(db.get_latest_funnel_snapshot)
+        return self._snapshot
+
+
+def format_funnel_report(snapshot: Dict[str, Any]) -> str:
+    """
+    Формирует отчет для команды /stats
+
+    Args:
+        snapshot: Снимок из funnel_stats
+
+    Returns:
+        Текст в HTML разметке
+    """
+    lines = [
+        '📊 <b>Воронка обучения</b>',
+        f'Пользователей: <b>{snapshot.get("total_users", 0)}</b>',
+        f'Снимок: {str(snapshot.get("generated_at", ""))[:16].replace("T", " ")} UTC',
+        '',
+        '<b>Этапы</b> (достигли / конверсия с предыдущего):',
+    ]
+    for stage in snapshot.get('stages', []):
+        conversion = stage.get('conversion')
+        conversion_text = f'{float(conversion) * 100:.0f}%' if conversion is not None else '—'
+        lines.append(f'• {stage["stage"]}: {stage["reached"]} / {conversion_text}')
+
+    time_in_state = snapshot.get('time_in_state', {})
+    lines.extend(['', '<b>Сейчас в состоянии</b> (медиана времени в состоянии):'])
+    states = snapshot.get('states', {})
+    for state in ALL_STATES:
+        count = states.get(state)
+        if not count:
+            continue
+        median = time_in_state.get(state, {}).get('median_seconds')
+        lines.append(f'• {state}: {count} ({format_duration(median)})')
+
+    return '\n'.join(lines)
+
+
+# Глобальный экземпляр аналитики
+funnel_analytics = FunnelAnalytics()
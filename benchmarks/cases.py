@@ -0,0 +1,275 @@
+"""
+Микробенчмарки горячих путей бота
+
+Каждый бенчмарк - функция подготовки, которая возвращает вызываемый
+без аргументов объект; замеряется только он. Сеть не используется:
+клиент Supabase заменяется таблицей в памяти, корутины выполняются
+синхронно (в замеряемом коде не должно быть реальных ожиданий).
+"""
+import asyncio
+import logging
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List
+
+from config import UserState
+from database import Database
+from handlers import button_callback, db as handlers_db, handle_text_message, is_valid_email, render_post_prompt
+from logger import bot_logger
+from publish_handlers import render_blue_button_prompt
+from webhook_server import handle_n8n_response, pending_responses
+
+# Реестр: имя бенчмарка -> функция подготовки
+BENCHMARKS: Dict[str, Callable[[], Callable[[], Any]]] = {}
+
+TELEGRAM_ID = 123456789
+
+# Типичные ответы учеников: пара предложений на русском
+ANSWER = ('Я помогаю экспертам запускать онлайн-курсы без выгорания и больших бюджетов. '
+          'За три года провела больше 40 запусков, средний чек вырос в 2,5 раза.')
+
+
+def benchmark(name: str):
+    """Регистрирует функцию подготовки бенчмарка под именем name"""
+    def decorator(setup: Callable[[], Callable[[], Any]]):
+        BENCHMARKS[name] = setup
+        return setup
+    return decorator
+
+
+def run_sync(coro) -> Any:
+    """
+    Выполняет корутину без event loop
+
+    Обработчики с подмененным вводом-выводом не приостанавливаются,
+    поэтому цикл событий только добавил бы свои накладные расходы в замер.
+    """
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coro.close()
+    raise RuntimeError('Корутина приостановилась: бенчмарк не должен ждать ввода-вывода')
+
+
+async def _noop(*args, **kwargs) -> None:
+    return None
+
+
+class _DiscardHandler(logging.Handler):
+    """Форматирует записи как настоящий обработчик, но никуда их не пишет"""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.format(record)
+
+
+def silence_bot_logger() -> None:
+    """Оставляет форматирование логов в замере, убирая запись в stdout и файл"""
+    handlers = bot_logger.logger.handlers
+    formatter = handlers[0].formatter if handlers else None
+    for handler in list(handlers):
+        bot_logger.logger.removeHandler(handler)
+        handler.close()
+    discard = _DiscardHandler()
+    discard.setFormatter(formatter)
+    bot_logger.logger.addHandler(discard)
+
+
+class _FakeQuery:
+    """Цепочка запроса supabase-py (table().select().eq()...execute()) над строками в памяти"""
+
+    def __init__(self, rows: List[Dict[str, Any]]):
+        self._rows = rows
+
+    def table(self, name: str) -> '_FakeQuery':
+        return self
+
+    def __getattr__(self, name: str) -> Callable[..., '_FakeQuery']:
+        return lambda *args, **kwargs: self
+
+    def execute(self) -> SimpleNamespace:
+        # Копии строк: методы Database изменяют полученные словари
+        return SimpleNamespace(data=[dict(row) for row in self._rows])
+
+
+def make_database(rows: List[Dict[str, Any]]) -> Database:
+    """Database без подключения к Supabase, отвечающий строками rows"""
+    database = Database()
+    database.client = _FakeQuery(rows)
+    return database
+
+
+# ============================================
+# ВАЛИДАЦИЯ И ПРОМПТЫ
+# ============================================
+
+@benchmark('is_valid_email')
+def bench_is_valid_email():
+    return lambda: is_valid_email('Student.Name+course@mail-server.example.ru')
+
+
+@benchmark('is_valid_email_invalid')
+def bench_is_valid_email_invalid():
+    return lambda: is_valid_email('student.name@@mail-server')
+
+
+@benchmark('render_post_prompt')
+def bench_render_post_prompt():
+    template = (
+        'Ты - опытный копирайтер. Напиши пост для телеграм канала эксперта.\n'
+        'Кто автор и чем он занимается: vopros_1\n'
+        'Какую проблему подписчика решает пост: vopros_2\n'
+        'Пример из практики автора: vopros_3\n'
+    ) + 'Требования к стилю: живой язык, без канцелярита, абзацы по 2-3 предложения.\n' * 20
+    answers = {f'answer_{i}': ANSWER for i in range(1, 4)}
+    return lambda: render_post_prompt(template, answers)
+
+
+@benchmark('render_blue_button_prompt')
+def bench_render_blue_button_prompt():
+    template = (
+        'Создай пост-знакомство. Ответы автора: blueotvet1, blueotvet2, blueotvet3, blueotvet4, '
+        'blueotvet5. Добавь ссылки на лучшие посты: link1, link2, link3, link4, link5.\n'
+    ) + 'Пост должен быть теплым и вызывать желание подписаться.\n' * 20
+    blue_answers = {f'blueotvet{i}': ANSWER for i in range(1, 6)}
+    best_links = {f'link{i}': f'https://t.me/expert_channel/{100 + i}' for i in range(1, 6)}
+    return lambda: render_blue_button_prompt(template, blue_answers, best_links)
+
+
+# ============================================
+# ЛОГИРОВАНИЕ
+# ============================================
+
+@benchmark('bot_logger_log')
+def bench_bot_logger_log():
+    return lambda: bot_logger._log(
+        'INFO', 'USER', '👤 Пользователь запустил бота',
+        telegram_id=TELEGRAM_ID, username='student', first_name='Анна', last_name=None
+    )
+
+
+# ============================================
+# ДИСПЕТЧЕРИЗАЦИЯ ОБНОВЛЕНИЙ
+# ============================================
+
+@benchmark('button_callback_dispatch')
+def bench_button_callback_dispatch():
+    # Неизвестная кнопка проходит всю цепочку сравнений - худший случай
+    update = SimpleNamespace(callback_query=SimpleNamespace(
+        data='unknown_button',
+        from_user=SimpleNamespace(id=TELEGRAM_ID),
+        answer=_noop,
+    ))
+    context = SimpleNamespace(user_data={}, job_queue=None)
+    return lambda: run_sync(button_callback(update, context))
+
+
+@benchmark('handle_text_message_dispatch')
+def bench_handle_text_message_dispatch():
+    # COMPLETED не обрабатывается ни одной веткой - худший случай
+    handlers_db.client = _FakeQuery([{'telegram_id': TELEGRAM_ID, 'state': UserState.COMPLETED}])
+    update = SimpleNamespace(
+        effective_user=SimpleNamespace(id=TELEGRAM_ID),
+        message=SimpleNamespace(text='Просто сообщение'),
+    )
+    # Состояние берется из user_data: Supabase читается только при первом вызове
+    context = SimpleNamespace(user_data={}, bot_data={})
+    return lambda: run_sync(handle_text_message(update, context))
+
+
+# ============================================
+# ОТВЕТЫ В DATABASE (JSONB)
+# ============================================
+
+POST_ANSWERS = {f'post_{p}': {f'answer_{q}': ANSWER for q in range(1, 4)} for p in range(1, 6)}
+BLUE_ANSWERS = {f'blueotvet{i}': ANSWER for i in range(1, 6)}
+BEST_LINKS = {f'link{i}': f'https://t.me/expert_channel/{100 + i}' for i in range(1, 6)}
+
+
+@benchmark('db_post_answers_encode')
+def bench_db_post_answers_encode():
+    database = make_database([])
+    return lambda: database.update_user_post_progress(TELEGRAM_ID, 5, 3, 1, POST_ANSWERS)
+
+
+@benchmark('db_post_answers_decode')
+def bench_db_post_answers_decode():
+    database = make_database([{
+        'current_post_number': 5,
+        'current_question_number': 3,
+        'post_attempt': 1,
+        'user_posts': {'post_answers': POST_ANSWERS},
+    }])
+    return lambda: database.get_user_post_progress(TELEGRAM_ID)
+
+
+@benchmark('db_post_answer_append')
+def bench_db_post_answer_append():
+    database = make_database([])
+    return lambda: database.save_post_answer(TELEGRAM_ID, ['post_5', 'answer_3'], ANSWER, 5, 3, 1)
+
+
+@benchmark('db_blue_button_encode')
+def bench_db_blue_button_encode():
+    database = make_database([])
+    return lambda: database.save_blue_button_data(TELEGRAM_ID, blue_answers=BLUE_ANSWERS, best_links=BEST_LINKS)
+
+
+@benchmark('db_blue_button_decode')
+def bench_db_blue_button_decode():
+    database = make_database([{
+        'blue_answers': BLUE_ANSWERS,
+        'best_links': BEST_LINKS,
+        'button_action': 'website',
+        'button_url': 'https://example.ru',
+        'button_text': 'Записаться',
+        'blue_post_text': None,
+    }])
+    return lambda: database.get_blue_button_data(TELEGRAM_ID)
+
+
+@benchmark('db_blue_answer_append')
+def bench_db_blue_answer_append():
+    database = make_database([])
+    return lambda: database.append_numbered_answer(TELEGRAM_ID, 'blue_answers', 'blueotvet', ANSWER)
+
+
+# ============================================
+# ОТВЕТЫ N8N
+# ============================================
+
+class _FakeRequest:
+    """Минимальный aiohttp request: заголовки и уже прочитанное JSON тело"""
+
+    def __init__(self, headers: Dict[str, str], body: Any = None):
+        self.headers = headers
+        self.can_read_body = body is not None
+        self._body = body
+
+    async def json(self) -> Any:
+        return self._body
+
+
+def _pending(request_id: str) -> None:
+    pending_responses[request_id] = {'event': asyncio.Event(), 'response': None}
+
+
+@benchmark('n8n_response_headers')
+def bench_n8n_response_headers():
+    _pending('bench-headers')
+    request = _FakeRequest({
+        'telegram-id': str(TELEGRAM_ID),
+        'request-id': 'bench-headers',
+        'response': ANSWER * 8,
+    })
+    return lambda: run_sync(handle_n8n_response(request, 'osebe'))
+
+
+@benchmark('n8n_response_batch')
+def bench_n8n_response_batch():
+    _pending('bench-batch')
+    request = _FakeRequest({}, {
+        'telegram_id': TELEGRAM_ID,
+        'request_id': 'bench-batch',
+        'responses': [{'post_number': i, 'response': ANSWER * 8} for i in range(1, 6)],
+    })
+    return lambda: run_sync(handle_n8n_response(request, 'post'))
@@ -1,19 +1,59 @@
 """
 Главный файл телеграм бота
 """
+import time
+
+# Отсчет времени запуска (отчет о запуске включает импорт модулей)
+STARTED_AT = time.perf_counter()
+
 import os
+import signal
 import asyncio
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters
+from telegram import Update
+from telegram.constants import ParseMode
+from telegram.ext import (
+    Application, CommandHandler, MessageHandler, CallbackQueryHandler, ChatMemberHandler,
+    ContextTypes, filters
+)
 
 from config import (
-    TELEGRAM_BOT_TOKEN, MEDIA_FOLDER, TEMP_FOLDER, WEBHOOK_PORT,
+    TELEGRAM_BOT_TOKEN, TELEGRAM_API_BASE_URL, TELEGRAM_LOCAL_MODE,
+    MEDIA_FOLDER, TEMP_FOLDER, WEBHOOK_PORT, PUBLISH_QUEUE_INTERVAL, ANALYTICS_SNAPSHOT_INTERVAL,
+    EMAIL_ALLOWLIST_REFRESH_INTERVAL, EVENT_LOOP_LAG_INTERVAL, CONCURRENT_UPDATES,
+    PERSISTENCE_FILE, PERSISTENCE_UPDATE_INTERVAL, PERSISTENCE_FLUSH_DELAY,
     SUPABASE_URL, SUPABASE_KEY, OPENAI_API_KEY,
     N8N_WEBHOOK_OSEBE, N8N_WEBHOOK_POST, N8N_WEBHOOK_BLUEBUTT,
     N8N_WEBHOOK_ANONS, N8N_WEBHOOK_PRODAJ
 )
-from handlers import start_command, button_callback, handle_text_message, handle_voice_message
+from handlers import (
+    start_command, button_callback, handle_text_message, handle_voice_message,
+    install_state_cache, mark_state_cache_clean
+)
+from publish_handlers import handle_my_chat_member
+from publish_queue import publish_queue
+from update_processor import PerUserUpdateProcessor
+from admin_handlers import (
+    broadcast_command, broadcast_status_command, broadcast_cancel_command, stats_command
+)
+from analytics import funnel_analytics
+from broadcast import broadcast_engine
+from email_allowlist import email_allowlist
+from prompt_templates import prompt_templates
+from persistence import SQLitePersistence
+from handoff import handoffs, HandedOff, format_drain_report
+from conflicts import VersionConflict
+import messages
 from logger import bot_logger
+from metrics import monitor_event_loop_lag
+from services import services, startup
 from webhook_server import start_webhook_server
+from media_transfer import media_lane
+from transcription import transcriber
+from telegram_transport import (
+    build_bot_request, build_updates_request, bot_api_server_kwargs, bot_api_health
+)
+
+startup.record('импорт модулей', time.perf_counter() - STARTED_AT)
 
 
 def check_environment():
@@ -49,6 +89,18 @@ def check_environment():
     return True
 
 
+async def handle_error(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Ошибки обработчиков; прерванные остановкой ожидания n8n ошибкой не считаются"""
+    if isinstance(context.error, HandedOff):
+        return
+    if isinstance(context.error, VersionConflict):
+        # Повторы шага не помогли (записано в лог при повторах) - просим отправить ответ еще раз
+        if isinstance(update, Update) and update.effective_message:
+            await update.effective_message.reply_text(messages.ANSWER_SAVE_ERROR, parse_mode=ParseMode.HTML)
+        return
+    bot_logger.error('SYSTEM', f'Ошибка обработки обновления: {str(context.error)}', error=context.error)
+
+
 def create_folders():
     """Создает необходимые папки если их нет"""
     # Создаем папку для логов
@@ -71,14 +123,53 @@ def create_folders():
 async def run_bot():
     """Запускает telegram бота"""
     # Создаем приложение
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .request(build_bot_request())
+        .get_updates_request(build_updates_request())
+    )
+    
+    # Собственный сервер telegram-bot-api (если задан)
+    server_kwargs = bot_api_server_kwargs()
+    if server_kwargs:
+        builder = (
+            builder
+            .base_url(server_kwargs['base_url'])
+            .base_file_url(server_kwargs['base_file_url'])
+            .local_mode(server_kwargs['local_mode'])
+        )
+    
+    # user_data сохраняется локально и переживает перезапуск
+    if PERSISTENCE_FILE:
+        builder = builder.persistence(SQLitePersistence(
+            PERSISTENCE_FILE,
+            update_interval=PERSISTENCE_UPDATE_INTERVAL,
+            flush_delay=PERSISTENCE_FLUSH_DELAY
+        ))
+    
+    # Параллельная обработка обновлений разных пользователей: обновления одного
+    # пользователя выполняются по очереди (см. update_processor.py)
+    if CONCURRENT_UPDATES > 1:
+        builder = builder.concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+    
+    application = builder.build()
     
     # Регистрируем обработчики команд
     application.add_handler(CommandHandler("start", start_command))
     
+    # Команды администратора (рассылки)
+    application.add_handler(CommandHandler("broadcast", broadcast_command))
+    application.add_handler(CommandHandler("broadcast_status", broadcast_status_command))
+    application.add_handler(CommandHandler("broadcast_cancel", broadcast_cancel_command))
+    application.add_handler(CommandHandler("stats", stats_command))
+    
     # Регистрируем обработчик callback кнопок
     application.add_handler(CallbackQueryHandler(button_callback))
     
+    # Изменения статуса бота в каналах (обновляют кеш проверок каналов)
+    application.add_handler(ChatMemberHandler(handle_my_chat_member, ChatMemberHandler.MY_CHAT_MEMBER))
+    
     # Регистрируем обработчик голосовых сообщений
     application.add_handler(MessageHandler(
         filters.VOICE,
@@ -91,21 +182,110 @@ async def run_bot():
         handle_text_message
     ))
     
+    application.add_error_handler(handle_error)
+    
+    # Клиент Supabase создается в потоке, пока бот подключается к Telegram
+    supabase_ready = asyncio.create_task(asyncio.to_thread(lambda: services.supabase))
+    
     # Инициализируем и запускаем бота
-    await application.initialize()
+    with startup.phase('telegram: initialize'):
+        await application.initialize()
+    await supabase_ready
+    # Состояние пользователей читается из user_data, Supabase - при промахе
+    install_state_cache(application)
+    
+    # Проверяем Bot API сервер (результат также отдается в /health)
+    bot_api_health.bot = application.bot
+    if TELEGRAM_API_BASE_URL:
+        health = await bot_api_health.check(force=True)
+        if health['status'] != 'ok':
+            raise RuntimeError(f"Сервер telegram-bot-api недоступен: {health.get('error')}")
+        mode = 'локальный режим' if TELEGRAM_LOCAL_MODE else 'без локального режима'
+        print(f"✅ Сервер telegram-bot-api {TELEGRAM_API_BASE_URL} доступен ({mode}, {health['latency_ms']} мс)")
+        bot_logger.info('SYSTEM', 'Используется собственный сервер telegram-bot-api',
+                        server=TELEGRAM_API_BASE_URL, local_mode=TELEGRAM_LOCAL_MODE)
+    # Компилируем шаблоны промптов (ошибки в плейсхолдерах видны сразу при запуске)
+    # и загружаем фильтр email для регистрации (без него email проверяются запросом к базе)
+    with startup.phase('промпты и фильтр email'):
+        template_warnings, allowlist_loaded = await asyncio.gather(
+            asyncio.to_thread(prompt_templates.preload),
+            email_allowlist.refresh()
+        )
+    for source, warnings in template_warnings.items():
+        print(f"⚠️ Шаблон {source}: {'; '.join(warnings)}")
+    if allowlist_loaded:
+        print("✅ Фильтр email загружен")
+    else:
+        print("⚠️ Не удалось загрузить фильтр email, регистрация идет через базу")
+    
     await application.start()
-    await application.updater.start_polling(allowed_updates=["message", "callback_query"])
     
-    bot_logger.info('SYSTEM', '🤖 Telegram бот запущен')
+    # Фоновая обработка очереди публикаций (подхватывает и задачи, оставшиеся с прошлого запуска)
+    application.job_queue.run_repeating(
+        publish_queue.process_due_jobs,
+        interval=PUBLISH_QUEUE_INTERVAL,
+        first=1,
+        name='publish_queue'
+    )
+    
+    # Периодические снимки аналитики воронки
+    application.job_queue.run_repeating(
+        funnel_analytics.refresh_job,
+        interval=ANALYTICS_SNAPSHOT_INTERVAL,
+        first=10,
+        name='funnel_snapshot'
+    )
+    
+    # Периодическое обновление фильтра email
+    application.job_queue.run_repeating(
+        email_allowlist.refresh_job,
+        interval=EMAIL_ALLOWLIST_REFRESH_INTERVAL,
+        first=EMAIL_ALLOWLIST_REFRESH_INTERVAL,
+        name='email_allowlist'
+    )
+    
+    # Продолжаем рассылки, прерванные перезапуском,
+    # и ожидания n8n, переданные прошлым запуском при остановке
+    with startup.phase('рассылки и ожидания n8n'):
+        resumed, handed_over = await asyncio.gather(
+            broadcast_engine.resume_all(application.bot),
+            handoffs.resume_all(application)
+        )
+    if resumed:
+        print(f"📣 Продолжено рассылок: {resumed}")
+    if handed_over:
+        print(f"🔁 Подхвачено ожиданий n8n прошлого запуска: {handed_over}")
+    with startup.phase('telegram: start_polling'):
+        await application.updater.start_polling(allowed_updates=["message", "callback_query", "my_chat_member"])
+    
+    started_in = time.perf_counter() - STARTED_AT
+    bot_logger.info('SYSTEM', '🤖 Telegram бот запущен', startup_ms=round(started_in * 1000))
     print("🤖 Telegram бот запущен и готов к работе!")
+    print(f"⏱️ Запуск:\n{startup.report(started_in)}")
     
-    # Ждем до остановки
+    # Ждем SIGTERM (docker stop, обновление) или Ctrl+C
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Windows: остается остановка по Ctrl+C (KeyboardInterrupt)
+            pass
     try:
-        await asyncio.Event().wait()
+        await stop_event.wait()
     finally:
-        await application.updater.stop()
+        # Новые обновления не принимаем, начатые ожидания n8n дожидаемся или передаем следующему запуску
+        print("⏳ Остановка: завершаем начатые шаги пользователей...")
+        report = await handoffs.drain(application)
+        print(f"⏹️ Остановка: {format_drain_report(report)}")
+        await broadcast_engine.shutdown()
+        mark_state_cache_clean(application)
         await application.stop()
         await application.shutdown()
+        await media_lane.shutdown()
+        transcriber.shutdown()
+        services.close()
 
 
 async def main_async():
@@ -120,6 +300,10 @@ async def main_async():
     # Запускаем веб-сервер для приема ответов от n8n
     webhook_runner = await start_webhook_server(WEBHOOK_PORT)
     
+    # Задержка event loop (отдается в /metrics)
+    lag_task = asyncio.create_task(monitor_event_loop_lag(EVENT_LOOP_LAG_INTERVAL)) \
+        if EVENT_LOOP_LAG_INTERVAL > 0 else None
+    
     print("Нажмите Ctrl+C для остановки")
     print("")
     
@@ -128,6 +312,8 @@ async def main_async():
         await run_bot()
     finally:
         # Останавливаем веб-сервер при завершении
+        if lag_task:
+            lag_task.cancel()
         await webhook_runner.cleanup()
 
 
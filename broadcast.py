@@ -0,0 +1,242 @@
+"""
+Рассылки по состояниям пользователей
+
+Пользователи выбираются страницами с keyset пагинацией по (state, id),
+сообщения отправляются с глобальным ограничением частоты и паузой между
+сообщениями в один чат. Прогресс (last_user_id и счетчики) сохраняется
+в таблице broadcasts, поэтому после перезапуска бота рассылка
+продолжается с места остановки. Пользователи, обработанные после
+последней контрольной точки, могут получить сообщение повторно.
+"""
+import asyncio
+import time
+from datetime import datetime
+from typing import Any, Dict, List
+
+from telegram import Bot
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+
+import messages
+from config import (
+    BROADCAST_RATE, BROADCAST_PER_CHAT_INTERVAL, BROADCAST_PAGE_SIZE,
+    BROADCAST_CHECKPOINT_EVERY, BROADCAST_PROGRESS_INTERVAL
+)
+from database import Database
+from logger import bot_logger
+from rate_limit import KeyedRateLimiter, TokenBucket
+
+# Инициализация базы данных
+db = Database()
+
+# Сколько раз повторять сообщение после флуд-контроля
+MAX_RETRY_AFTER = 3
+
+
+class BroadcastEngine:
+    """Выполнение рассылок в фоне с контрольными точками"""
+
+    def __init__(
+        self,
+        global_limiter: TokenBucket,
+        chat_limiter: KeyedRateLimiter,
+        page_size: int,
+        checkpoint_every: int,
+        progress_interval: float
+    ):
+        """
+        Args:
+            global_limiter: Ограничение сообщений в секунду на весь бот
+            chat_limiter: Пауза между сообщениями в один чат
+            page_size: Пользователей за один запрос к базе
+            checkpoint_every: Сохранять прогресс каждые N сообщений
+            progress_interval: Как часто обновлять сообщение с прогрессом (секунды)
+        """
+        self.global_limiter = global_limiter
+        self.chat_limiter = chat_limiter
+        self.page_size = page_size
+        self.checkpoint_every = checkpoint_every
+        self.progress_interval = progress_interval
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._cancel_requested: set = set()
+
+    def start(self, bot: Bot, broadcast: Dict[str, Any]) -> None:
+        """
+        Запускает (или продолжает) рассылку в фоне
+
+        Args:
+            bot: Объект бота
+            broadcast: Запись из таблицы broadcasts
+        """
+        broadcast_id = broadcast['id']
+        if broadcast_id in self._tasks:
+            return
+        self._tasks[broadcast_id] = asyncio.create_task(self._run(bot, broadcast))
+
+    async def resume_all(self, bot: Bot) -> int:
+        """
+        Продолжает рассылки, прерванные перезапуском бота
+
+        Returns:
+            Количество продолженных рассылок
+        """
+        broadcasts = await asyncio.to_thread(db.get_broadcasts_by_status, 'running')
+        for broadcast in broadcasts:
+            bot_logger.info('SYSTEM', 'Продолжаем рассылку после перезапуска',
+                            broadcast_id=broadcast['id'], last_user_id=broadcast['last_user_id'])
+            self.start(bot, broadcast)
+        return len(broadcasts)
+
+    def active(self) -> List[int]:
+        """Номера рассылок, выполняющихся сейчас"""
+        return sorted(self._tasks)
+
+    def cancel(self, broadcast_id: int) -> bool:
+        """
+        Останавливает рассылку по команде администратора
+
+        Returns:
+            True если рассылка была активна
+        """
+        task = self._tasks.get(broadcast_id)
+        if not task:
+            return False
+        self._cancel_requested.add(broadcast_id)
+        task.cancel()
+        return True
+
+    async def shutdown(self) -> None:
+        """Останавливает рассылки при выключении бота, сохраняя прогресс (они продолжатся при запуске)"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, bot: Bot, broadcast: Dict[str, Any]) -> None:
+        broadcast_id = broadcast['id']
+        progress = {
+            'last_user_id': broadcast.get('last_user_id') or 0,
+            'sent': broadcast.get('sent') or 0,
+            'failed': broadcast.get('failed') or 0,
+            'blocked': broadcast.get('blocked') or 0,
+        }
+        unsaved = 0
+        last_report = 0.0
+
+        try:
+            while True:
+                page = await asyncio.to_thread(
+                    db.get_users_page_by_state,
+                    broadcast['state'],
+                    progress['last_user_id'],
+                    broadcast.get('updated_before'),
+                    self.page_size
+                )
+                if not page:
+                    break
+
+                for user in page:
+                    result = await self._send_one(bot, user['telegram_id'], broadcast['text'])
+                    progress[result] += 1
+                    progress['last_user_id'] = user['id']
+                    unsaved += 1
+
+                    if unsaved >= self.checkpoint_every:
+                        await asyncio.to_thread(db.update_broadcast, broadcast_id, dict(progress))
+                        unsaved = 0
+
+                    if time.monotonic() - last_report >= self.progress_interval:
+                        last_report = time.monotonic()
+                        await self._report(bot, broadcast, progress, messages.BROADCAST_STATUS_RUNNING)
+
+            await asyncio.to_thread(db.update_broadcast, broadcast_id, {
+                **progress,
+                'status': 'done',
+                'finished_at': datetime.utcnow().isoformat(),
+            })
+            await self._report(bot, broadcast, progress, messages.BROADCAST_STATUS_DONE)
+            bot_logger.info('SYSTEM', 'Рассылка завершена', broadcast_id=broadcast_id,
+                            sent=progress['sent'], failed=progress['failed'], blocked=progress['blocked'])
+
+        except asyncio.CancelledError:
+            fields = dict(progress)
+            if broadcast_id in self._cancel_requested:
+                fields.update({'status': 'cancelled', 'finished_at': datetime.utcnow().isoformat()})
+            # Выключение бота: статус остается running, рассылка продолжится при запуске
+            await asyncio.to_thread(db.update_broadcast, broadcast_id, fields)
+            if broadcast_id in self._cancel_requested:
+                await self._report(bot, broadcast, progress, messages.BROADCAST_STATUS_CANCELLED)
+            raise
+
+        except Exception as e:
+            # Неожиданная ошибка - сохраняем прогресс, рассылка продолжится при следующем запуске
+            bot_logger.error('SYSTEM', f'Ошибка рассылки: {str(e)}', broadcast_id=broadcast_id)
+            await asyncio.to_thread(db.update_broadcast, broadcast_id, dict(progress))
+
+        finally:
+            self._tasks.pop(broadcast_id, None)
+            self._cancel_requested.discard(broadcast_id)
+
+    async def _send_one(self, bot: Bot, chat_id: int, text: str) -> str:
+        """
+        Отправляет сообщение одному пользователю с учетом лимитов
+
+        Returns:
+            'sent', 'blocked' или 'failed'
+        """
+        for _ in range(MAX_RETRY_AFTER):
+            await self.global_limiter.acquire()
+            wait = self.chat_limiter.try_acquire(chat_id)
+            while wait:
+                await asyncio.sleep(wait)
+                wait = self.chat_limiter.try_acquire(chat_id)
+
+            try:
+                await bot.send_message(chat_id=chat_id, text=text, parse_mode=ParseMode.HTML)
+                return 'sent'
+            except RetryAfter as e:
+                # Флуд-контроль действует на весь бот - ждем и повторяем этому же пользователю
+                retry_after = getattr(e.retry_after, 'total_seconds', lambda: e.retry_after)()
+                await asyncio.sleep(float(retry_after))
+            except Forbidden:
+                return 'blocked'
+            except TelegramError as e:
+                bot_logger.warning('SYSTEM', f'Ошибка отправки рассылки: {str(e)}', telegram_id=chat_id)
+                return 'failed'
+        return 'failed'
+
+    async def _report(self, bot: Bot, broadcast: Dict[str, Any], progress: Dict[str, int], status: str) -> None:
+        """Обновляет у администратора сообщение с прогрессом"""
+        chat_id = broadcast.get('progress_chat_id')
+        message_id = broadcast.get('progress_message_id')
+        if not chat_id or not message_id:
+            return
+
+        text = messages.BROADCAST_PROGRESS.format(
+            broadcast_id=broadcast['id'],
+            state=broadcast['state'],
+            inactive_days=broadcast.get('inactive_days') or 0,
+            status=status,
+            sent=progress['sent'],
+            blocked=progress['blocked'],
+            failed=progress['failed'],
+        )
+        try:
+            await bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text,
+                                        parse_mode=ParseMode.HTML)
+        except BadRequest:
+            # Текст не изменился или сообщение удалено - прогресс не критичен
+            pass
+        except TelegramError as e:
+            bot_logger.warning('SYSTEM', f'Не удалось обновить прогресс рассылки: {str(e)}',
+                               broadcast_id=broadcast['id'])
+
+
+# Глобальный исполнитель рассылок
+broadcast_engine = BroadcastEngine(
+    TokenBucket(BROADCAST_RATE),
+    KeyedRateLimiter(BROADCAST_PER_CHAT_INTERVAL),
+    page_size=BROADCAST_PAGE_SIZE,
+    checkpoint_every=BROADCAST_CHECKPOINT_EVERY,
+    progress_interval=BROADCAST_PROGRESS_INTERVAL,
+)
@@ -1,13 +1,94 @@
 """
 Модуль для работы с каналами Telegram
 Проверка и публикация постов
+
+Результаты проверок кешируются: данные канала по username/ID и права бота
+по ID канала. Неудачные проверки тоже кешируются (на меньший срок), а
+изменения прав бота приходят в update my_chat_member и сразу обновляют кеш.
 """
-from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.error import TelegramError
+import time
+from typing import Dict, Optional, Tuple
+
+from telegram import Bot, ChatMember, InlineKeyboardButton, InlineKeyboardMarkup, Message
+from telegram.error import BadRequest, Forbidden, TelegramError
 from telegram.constants import ParseMode
+from config import CHANNEL_CACHE_TTL, CHANNEL_NEGATIVE_CACHE_TTL
 from logger import bot_logger
 
 
+# Данные канала: (is_channel, username, channel_id)
+ChannelInfo = Tuple[bool, str, int]
+
+
+class ChannelCache:
+    """Кеш данных каналов и прав бота с TTL и негативным кешированием"""
+
+    def __init__(self, ttl: float, negative_ttl: float):
+        """
+        Args:
+            ttl: Время жизни успешного результата (секунды)
+            negative_ttl: Время жизни неудачного результата (секунды)
+        """
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # Ключ (@username в нижнем регистре или ID) -> (истекает, данные канала)
+        self._channels: Dict[str, Tuple[float, ChannelInfo]] = {}
+        # ID канала -> (истекает, может ли бот публиковать)
+        self._rights: Dict[int, Tuple[float, bool]] = {}
+
+    @staticmethod
+    def channel_key(username_or_id) -> str:
+        return str(username_or_id).lower()
+
+    def _expires(self, positive: bool) -> float:
+        return time.monotonic() + (self.ttl if positive else self.negative_ttl)
+
+    def get_channel(self, username_or_id) -> Optional[ChannelInfo]:
+        cached = self._channels.get(self.channel_key(username_or_id))
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        return None
+
+    def put_channel(self, username: str, info: ChannelInfo) -> None:
+        expires = self._expires(info[0])
+        self._channels[self.channel_key(username)] = (expires, info)
+        if info[2]:
+            self._channels[self.channel_key(info[2])] = (expires, info)
+
+    def get_rights(self, channel_id: int) -> Optional[bool]:
+        cached = self._rights.get(channel_id)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        return None
+
+    def put_rights(self, channel_id: int, can_post: bool) -> None:
+        self._rights[channel_id] = (self._expires(can_post), can_post)
+
+    def invalidate(self, channel_id: int, username: Optional[str] = None) -> None:
+        """
+        Удаляет все закешированное о канале
+
+        Args:
+            channel_id: ID канала
+            username: Username канала (если известен)
+        """
+        self._rights.pop(channel_id, None)
+        self._channels.pop(self.channel_key(channel_id), None)
+        if username:
+            self._channels.pop(self.channel_key(f'@{username.lstrip("@")}'), None)
+
+
+# Глобальный кеш каналов
+channel_cache = ChannelCache(CHANNEL_CACHE_TTL, CHANNEL_NEGATIVE_CACHE_TTL)
+
+
+def member_can_post(member: ChatMember) -> bool:
+    """Может ли участник канала публиковать сообщения"""
+    if member.status == ChatMember.OWNER:
+        return True
+    return member.status == ChatMember.ADMINISTRATOR and bool(getattr(member, 'can_post_messages', False))
+
+
 async def check_if_channel(bot: Bot, channel_link: str) -> tuple[bool, str, int]:
     """
     Проверяет, является ли ссылка каналом
@@ -32,14 +113,27 @@ async def check_if_channel(bot: Bot, channel_link: str) -> tuple[bool, str, int]
         if not username.startswith('@'):
             username = f'@{username}'
         
+        cached = channel_cache.get_channel(username)
+        if cached is not None:
+            return cached
+        
         # Пытаемся получить информацию о канале
-        chat = await bot.get_chat(username)
+        try:
+            chat = await bot.get_chat(username)
+        except (BadRequest, Forbidden) as e:
+            # Канал не существует или недоступен - кешируем отказ
+            bot_logger.warning('PUBLISH', f'Канал не найден: {str(e)}', channel=channel_link)
+            result = (False, "", 0)
+            channel_cache.put_channel(username, result)
+            return result
         
         # Проверяем, что это канал
         if chat.type == 'channel':
-            return True, username, chat.id
+            result = (True, username, chat.id)
         else:
-            return False, username, 0
+            result = (False, username, 0)
+        channel_cache.put_channel(username, result)
+        return result
             
     except TelegramError as e:
         bot_logger.error('PUBLISH', f'Ошибка проверки канала: {str(e)}', channel=channel_link)
@@ -58,17 +152,21 @@ async def check_bot_admin(bot: Bot, channel_id: int, bot_id: int) -> bool:
     Returns:
         True если бот админ, False если нет
     """
+    cached = channel_cache.get_rights(channel_id)
+    if cached is not None:
+        return cached
+    
     try:
-        # Получаем список администраторов
-        admins = await bot.get_chat_administrators(channel_id)
-        
-        # Проверяем, есть ли бот в списке
-        for admin in admins:
-            if admin.user.id == bot_id:
-                # Проверяем права на публикацию
-                if admin.can_post_messages or admin.status == 'creator':
-                    return True
+        # Запрашиваем только статус самого бота, а не весь список администраторов
+        member = await bot.get_chat_member(channel_id, bot_id)
+        can_post = member_can_post(member)
+        channel_cache.put_rights(channel_id, can_post)
+        return can_post
         
+    except (BadRequest, Forbidden) as e:
+        # Бот не добавлен в канал - до my_chat_member или истечения TTL считаем, что прав нет
+        bot_logger.warning('PUBLISH', f'Бот не является участником канала: {str(e)}', channel_id=channel_id)
+        channel_cache.put_rights(channel_id, False)
         return False
         
     except TelegramError as e:
@@ -76,15 +174,15 @@ async def check_bot_admin(bot: Bot, channel_id: int, bot_id: int) -> bool:
         return False
 
 
-async def publish_post_to_channel(
+async def send_channel_post(
     bot: Bot,
     channel_id: int,
     post_text: str,
     button_text: str,
     button_url: str
-) -> tuple[bool, int]:
+) -> Message:
     """
-    Публикует пост на канале с кнопкой
+    Отправляет пост с кнопкой в канал (без закрепления)
     
     Args:
         bot: Объект бота
@@ -94,32 +192,56 @@ async def publish_post_to_channel(
         button_url: URL кнопки
         
     Returns:
-        (success, message_id)
-    """
-    try:
-        # Создаем кнопку
-        keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton(button_text, url=button_url)]
-        ])
-        
-        # Публикуем пост
-        message = await bot.send_message(
-            chat_id=channel_id,
-            text=post_text,
-            reply_markup=keyboard,
-            parse_mode=ParseMode.HTML
-        )
+        Отправленное сообщение
         
-        # Закрепляем пост
-        await bot.pin_chat_message(
-            chat_id=channel_id,
-            message_id=message.message_id,
-            disable_notification=True
-        )
-        
-        return True, message.message_id
+    Raises:
+        TelegramError: При ошибке отправки
+    """
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton(button_text, url=button_url)]
+    ])
+    
+    return await bot.send_message(
+        chat_id=channel_id,
+        text=post_text,
+        reply_markup=keyboard,
+        parse_mode=ParseMode.HTML
+    )
+
+
+async def pin_channel_post(bot: Bot, channel_id: int, message_id: int) -> None:
+    """
+    Закрепляет сообщение в канале без уведомления
+    
+    Args:
+        bot: Объект бота
+        channel_id: ID канала
+        message_id: ID сообщения
         
-    except TelegramError as e:
-        bot_logger.error('PUBLISH', f'Ошибка публикации поста: {str(e)}', channel_id=channel_id)
-        return False, 0
+    Raises:
+        TelegramError: При ошибке закрепления
+    """
+    await bot.pin_chat_message(
+        chat_id=channel_id,
+        message_id=message_id,
+        disable_notification=True
+    )
+
 
+def update_channel_cache_from_member(chat, member: ChatMember) -> bool:
+    """
+    Обновляет кеш по update my_chat_member (бота добавили, удалили или изменили права)
+
+    Args:
+        chat: Чат из update.my_chat_member.chat
+        member: Новый статус бота (new_chat_member)
+
+    Returns:
+        Может ли бот теперь публиковать в канале
+    """
+    channel_cache.invalidate(chat.id, chat.username)
+    can_post = member_can_post(member)
+    channel_cache.put_rights(chat.id, can_post)
+    if chat.username and chat.type == 'channel':
+        channel_cache.put_channel(f'@{chat.username}', (True, f'@{chat.username}', chat.id))
+    return can_post
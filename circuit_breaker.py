@@ -0,0 +1,224 @@
+"""
+Предохранитель и адаптивные таймауты для запросов в n8n
+
+Когда n8n недоступен, каждый пользователь раньше ждал полные 180 секунд
+до сообщения об ошибке. Для каждого типа webhook ведется предохранитель:
+после N неудач подряд (ошибка отправки или таймаут ответа) он
+размыкается, и запросы этого типа сразу завершаются ошибкой. Через
+reset_timeout секунд пропускается один пробный запрос: ответ замыкает
+предохранитель, неудача снова размыкает его.
+
+Таймаут ожидания ответа считается по наблюдаемым задержкам: p99 последних
+ответов, умноженный на factor, в пределах [min_timeout, max_timeout].
+Пока ответов мало, используется max_timeout. Истекший таймаут тоже идет
+в расчет: ответ пришел бы не раньше, поэтому прошедшее время добавляется
+как задержка, а таймаут сразу отодвигается к max_timeout - при замедлении
+n8n таймаут растет, а не остается по старым быстрым ответам. Пробный
+запрос разомкнутого предохранителя всегда ждет max_timeout.
+"""
+import math
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from config import (
+    N8N_BREAKER_FAILURES, N8N_BREAKER_RESET, N8N_TIMEOUT_FACTOR,
+    N8N_TIMEOUT_MIN, N8N_TIMEOUT_MAX, N8N_TIMEOUT_MIN_SAMPLES
+)
+from logger import bot_logger
+from metrics import metrics
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Значения n8n_breaker_state по состояниям
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+breaker_state = metrics.gauge('n8n_breaker_state', 'Предохранитель n8n по типам webhook (0 - замкнут, 1 - проба, 2 - разомкнут)')
+breaker_rejected_total = metrics.counter('n8n_breaker_rejected_total', 'Запросы в n8n, отклоненные разомкнутым предохранителем')
+response_seconds = metrics.histogram(
+    'n8n_response_seconds', 'Задержка ответа n8n от отправки до callback',
+    buckets=(1, 2.5, 5, 10, 20, 30, 45, 60, 90, 120, 180, 300)
+)
+timeout_seconds = metrics.gauge('n8n_timeout_seconds', 'Текущий таймаут ожидания ответа n8n')
+
+
+class CircuitBreaker:
+    """Предохранитель одного типа запросов: замкнут, разомкнут или пробный запрос"""
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        """
+        Args:
+            name: Тип webhook (для логов и метрик)
+            failure_threshold: Неудач подряд до размыкания (0 - предохранитель выключен)
+            reset_timeout: Через сколько секунд пробовать снова (и интервал между пробами)
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._next_probe_at = 0.0
+        # send_to_n8n вызывается и из потоков
+        self._lock = threading.Lock()
+        breaker_state.set(0, webhook=name)
+
+    def allow(self) -> bool:
+        """
+        Можно ли отправить запрос
+
+        Returns:
+            True - запрос разрешен (в пробном режиме - это проба), False - отказать сразу
+        """
+        if not self.failure_threshold:
+            return True
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            now = time.monotonic()
+            if self.state == OPEN and now - self._opened_at >= self.reset_timeout:
+                self._set_state(HALF_OPEN)
+                self._next_probe_at = now
+            if self.state == HALF_OPEN and now >= self._next_probe_at:
+                # Одна проба за интервал: потерянная проба (остановка бота) не блокирует следующую
+                self._next_probe_at = now + self.reset_timeout
+                return True
+        breaker_rejected_total.inc(webhook=self.name)
+        return False
+
+    def record_success(self) -> None:
+        """Запрос завершился ответом"""
+        with self._lock:
+            self._failures = 0
+            if self.state != CLOSED:
+                self._set_state(CLOSED)
+                bot_logger.info('N8N', f'Предохранитель {self.name} замкнут: n8n отвечает')
+
+    def record_failure(self) -> None:
+        """Ошибка отправки или таймаут ответа"""
+        if not self.failure_threshold:
+            return
+        with self._lock:
+            self._failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self._set_state(OPEN)
+                bot_logger.warning('N8N', f'Предохранитель {self.name} разомкнут: запросы отклоняются',
+                                   failures=self._failures, retry_in=f'{self.reset_timeout:.0f}с')
+
+    def _set_state(self, state: str) -> None:
+        self.state = state
+        breaker_state.set(STATE_VALUES[state], webhook=self.name)
+
+
+class AdaptiveTimeout:
+    """Таймаут ожидания по последним задержкам: p99 × factor в заданных пределах"""
+
+    def __init__(self, name: str, factor: float, min_timeout: float, max_timeout: float,
+                 min_samples: int, window: int = 200):
+        """
+        Args:
+            name: Тип webhook (для метрик)
+            factor: Множитель p99
+            min_timeout: Нижняя граница таймаута (секунды)
+            max_timeout: Верхняя граница и таймаут, пока ответов меньше min_samples
+            min_samples: Сколько ответов нужно для расчета
+            window: Сколько последних задержек учитывать
+        """
+        self.name = name
+        self.factor = factor
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.min_samples = min_samples
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._timeout = max_timeout
+        self._median: Optional[float] = None
+        timeout_seconds.set(max_timeout, webhook=name)
+
+    @property
+    def timeout(self) -> float:
+        return self._timeout
+
+    @property
+    def typical(self) -> Optional[float]:
+        """Медиана последних задержек (None, пока ответов меньше min_samples)"""
+        return self._median
+
+    def observe(self, seconds: float) -> None:
+        """Добавляет задержку ответа и пересчитывает таймаут"""
+        response_seconds.observe(seconds, webhook=self.name)
+        self._samples.append(seconds)
+        self._recalculate()
+
+    def observe_timeout(self, seconds: float) -> None:
+        """
+        Учитывает ожидание, истекшее без ответа
+
+        Args:
+            seconds: Сколько прошло от отправки до таймаута (задержка не меньше этой)
+        """
+        self._samples.append(seconds)
+        self._recalculate()
+        self._timeout = min(self.max_timeout, max(self._timeout, seconds * self.factor))
+        timeout_seconds.set(round(self._timeout, 1), webhook=self.name)
+
+    def _recalculate(self) -> None:
+        if len(self._samples) < self.min_samples:
+            return
+        ordered = sorted(self._samples)
+        p99 = ordered[min(len(ordered) - 1, math.ceil(len(ordered) * 0.99) - 1)]
+        self._median = ordered[len(ordered) // 2]
+        self._timeout = min(self.max_timeout, max(self.min_timeout, p99 * self.factor))
+        timeout_seconds.set(round(self._timeout, 1), webhook=self.name)
+
+
+class N8NGuard:
+    """Предохранители и таймауты по типам webhook"""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float, factor: float,
+                 min_timeout: float, max_timeout: float, min_samples: int):
+        self._settings = (failure_threshold, reset_timeout, factor, min_timeout, max_timeout, min_samples)
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._timeouts: Dict[str, AdaptiveTimeout] = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, webhook_type: str) -> CircuitBreaker:
+        """Предохранитель типа webhook"""
+        self._ensure(webhook_type)
+        return self._breakers[webhook_type]
+
+    def latency(self, webhook_type: str) -> AdaptiveTimeout:
+        """Таймаут типа webhook"""
+        self._ensure(webhook_type)
+        return self._timeouts[webhook_type]
+
+    def timeout(self, webhook_type: Optional[str]) -> float:
+        """Текущий таймаут ожидания ответа (без типа и для пробного запроса - максимальный)"""
+        if webhook_type is None or self.breaker(webhook_type).state != CLOSED:
+            return self._settings[4]
+        return self.latency(webhook_type).timeout
+
+    def _ensure(self, webhook_type: str) -> None:
+        if webhook_type in self._breakers:
+            return
+        failure_threshold, reset_timeout, factor, min_timeout, max_timeout, min_samples = self._settings
+        with self._lock:
+            if webhook_type not in self._breakers:
+                self._timeouts[webhook_type] = AdaptiveTimeout(
+                    webhook_type, factor, min_timeout, max_timeout, min_samples
+                )
+                self._breakers[webhook_type] = CircuitBreaker(webhook_type, failure_threshold, reset_timeout)
+
+
+# Глобальные предохранители и таймауты n8n
+n8n_guard = N8NGuard(
+    failure_threshold=N8N_BREAKER_FAILURES,
+    reset_timeout=N8N_BREAKER_RESET,
+    factor=N8N_TIMEOUT_FACTOR,
+    min_timeout=N8N_TIMEOUT_MIN,
+    max_timeout=N8N_TIMEOUT_MAX,
+    min_samples=N8N_TIMEOUT_MIN_SAMPLES,
+)
@@ -9,6 +9,30 @@ load_dotenv()
 # Telegram настройки
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 
+# Собственный сервер telegram-bot-api (пусто = облачный Bot API)
+# Пример: http://telegram-bot-api:8081
+TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL', '').rstrip('/')
+TELEGRAM_LOCAL_MODE = bool(TELEGRAM_API_BASE_URL) and os.getenv('TELEGRAM_LOCAL_MODE', 'true').lower() == 'true'
+# Лимит на отправку файла: 50 МБ у облачного API, 2000 МБ у локального сервера
+TELEGRAM_MAX_UPLOAD_MB = 2000 if TELEGRAM_LOCAL_MODE else 50
+
+# HTTP транспорт Telegram (см. telegram_transport.py)
+TELEGRAM_POOL_SIZE = int(os.getenv('TELEGRAM_POOL_SIZE', '32'))  # Соединений для вызовов бота
+TELEGRAM_MAX_CONCURRENT_REQUESTS = int(os.getenv('TELEGRAM_MAX_CONCURRENT_REQUESTS', '0')) or None  # 0 = размер пула
+TELEGRAM_HTTP_VERSION = os.getenv('TELEGRAM_HTTP_VERSION', '1.1')  # '1.1' или '2'
+TELEGRAM_KEEPALIVE_CONNECTIONS = int(os.getenv('TELEGRAM_KEEPALIVE_CONNECTIONS', '0')) or None  # 0 = размер пула
+TELEGRAM_KEEPALIVE_EXPIRY = float(os.getenv('TELEGRAM_KEEPALIVE_EXPIRY', '30'))
+TELEGRAM_CONNECT_TIMEOUT = float(os.getenv('TELEGRAM_CONNECT_TIMEOUT', '5'))
+TELEGRAM_READ_TIMEOUT = float(os.getenv('TELEGRAM_READ_TIMEOUT', '10'))
+TELEGRAM_WRITE_TIMEOUT = float(os.getenv('TELEGRAM_WRITE_TIMEOUT', '10'))
+TELEGRAM_POOL_TIMEOUT = float(os.getenv('TELEGRAM_POOL_TIMEOUT', '5'))
+TELEGRAM_MEDIA_WRITE_TIMEOUT = float(os.getenv('TELEGRAM_MEDIA_WRITE_TIMEOUT', '60'))
+# Таймауты чтения/записи по методам Bot API: "sendVideo=120,getFile=30"
+TELEGRAM_METHOD_TIMEOUTS = os.getenv('TELEGRAM_METHOD_TIMEOUTS', 'sendVideo=120,sendDocument=120,getFile=30')
+# Отдельный клиент для get_updates (long polling)
+TELEGRAM_UPDATES_POOL_SIZE = int(os.getenv('TELEGRAM_UPDATES_POOL_SIZE', '1'))
+TELEGRAM_UPDATES_READ_TIMEOUT = float(os.getenv('TELEGRAM_UPDATES_READ_TIMEOUT', '30'))
+
 # Supabase настройки
 SUPABASE_URL = os.getenv('SUPABASE_URL')
 SUPABASE_KEY = os.getenv('SUPABASE_KEY')
@@ -16,10 +40,29 @@ SUPABASE_TABLE = os.getenv('SUPABASE_TABLE', 'users')
 SUPABASE_PROMPTS_TABLE = os.getenv('SUPABASE_PROMPTS_TABLE', 'prompts')
 SUPABASE_N8N_RESPONSES_TABLE = os.getenv('SUPABASE_N8N_RESPONSES_TABLE', 'n8n_responses')
 SUPABASE_POSTS_TABLE = os.getenv('SUPABASE_POSTS_TABLE', 'posts')
+SUPABASE_PUBLISH_JOBS_TABLE = os.getenv('SUPABASE_PUBLISH_JOBS_TABLE', 'publish_jobs')
+SUPABASE_BROADCASTS_TABLE = os.getenv('SUPABASE_BROADCASTS_TABLE', 'broadcasts')
+SUPABASE_HANDOFFS_TABLE = os.getenv('SUPABASE_HANDOFFS_TABLE', 'handoffs')
+# Ответы и готовые тексты этапов хранятся отдельно от узкой таблицы users
+SUPABASE_USER_POSTS_TABLE = os.getenv('SUPABASE_USER_POSTS_TABLE', 'user_posts')
+SUPABASE_USER_INTRO_POSTS_TABLE = os.getenv('SUPABASE_USER_INTRO_POSTS_TABLE', 'user_intro_posts')
+SUPABASE_USER_ANONS_TABLE = os.getenv('SUPABASE_USER_ANONS_TABLE', 'user_anons')
+SUPABASE_USER_SALES_TABLE = os.getenv('SUPABASE_USER_SALES_TABLE', 'user_sales')
 
 # OpenAI настройки
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
+# Транскрибация голосовых (см. transcription.py): маршрут "бэкенд<макс. секунд" через запятую,
+# следующий подходящий бэкенд - запасной при ошибке
+TRANSCRIPTION_ROUTES = os.getenv('TRANSCRIPTION_ROUTES', 'local<30,openai')
+TRANSCRIPTION_OPENAI_MODEL = os.getenv('TRANSCRIPTION_OPENAI_MODEL', 'whisper-1')
+TRANSCRIPTION_LOCAL_MODEL = os.getenv('TRANSCRIPTION_LOCAL_MODEL', 'small')  # Модель faster-whisper
+TRANSCRIPTION_LOCAL_COMPUTE = os.getenv('TRANSCRIPTION_LOCAL_COMPUTE', 'int8')  # Квантование на CPU
+TRANSCRIPTION_LOCAL_WORKERS = int(os.getenv('TRANSCRIPTION_LOCAL_WORKERS', '1'))  # Процессов с моделью
+TRANSCRIPTION_LOCAL_THREADS = int(os.getenv('TRANSCRIPTION_LOCAL_THREADS', '2'))  # Потоков CPU на процесс
+TRANSCRIPTION_SAMPLE_RATE = float(os.getenv('TRANSCRIPTION_SAMPLE_RATE', '0.05'))  # Доля сверок с эталоном
+TRANSCRIPTION_REFERENCE = os.getenv('TRANSCRIPTION_REFERENCE', 'openai')  # Эталонный бэкенд для сверки
+
 # n8n настройки - отдельный webhook для каждого типа запроса
 N8N_WEBHOOK_OSEBE = os.getenv('N8N_WEBHOOK_OSEBE')  # Для prompt_osebe (рассказ о себе)
 N8N_WEBHOOK_POST = os.getenv('N8N_WEBHOOK_POST')  # Для prompt_post (создание постов)
@@ -29,6 +72,9 @@ N8N_WEBHOOK_PRODAJ = os.getenv('N8N_WEBHOOK_PRODAJ')  # Для prompt_prodaj (п
 
 # Папка для медиафайлов
 MEDIA_FOLDER = 'media'
+# Путь к папке media/, как его видит локальный сервер telegram-bot-api
+# (по умолчанию совпадает с путем у бота - общий том или один хост)
+TELEGRAM_LOCAL_MEDIA_ROOT = os.getenv('TELEGRAM_LOCAL_MEDIA_ROOT', os.path.abspath(MEDIA_FOLDER))
 
 # Пути к видеофайлам (fallback — загрузка с диска)
 VIDEO_LEARN1 = os.path.join(MEDIA_FOLDER, 'learn1.mp4')
@@ -49,9 +95,96 @@ VIDEO_LEARN5_FILE_ID = os.getenv('VIDEO_LEARN5_FILE_ID')
 VIDEO_LEARN6_FILE_ID = os.getenv('VIDEO_LEARN6_FILE_ID')
 VIDEO_LEARN7_FILE_ID = os.getenv('VIDEO_LEARN7_FILE_ID')
 
+# Реестр file_id, заполняемый автоматически при первой загрузке видео с диска
+VIDEO_REGISTRY_FILE = os.getenv('VIDEO_REGISTRY_FILE', os.path.join(MEDIA_FOLDER, 'file_ids.json'))
+
+# Отдельный пул соединений для отправки видео (не мешает текстовым ответам)
+MEDIA_POOL_SIZE = int(os.getenv('MEDIA_POOL_SIZE', '4'))
+MEDIA_MAX_CONCURRENT_UPLOADS = int(os.getenv('MEDIA_MAX_CONCURRENT_UPLOADS', '2'))  # Одновременных загрузок с диска
+MEDIA_WRITE_TIMEOUT = float(os.getenv('MEDIA_WRITE_TIMEOUT', '300'))  # Секунды на передачу файла
+MEDIA_READ_TIMEOUT = float(os.getenv('MEDIA_READ_TIMEOUT', '60'))
+MEDIA_CONNECT_TIMEOUT = float(os.getenv('MEDIA_CONNECT_TIMEOUT', '10'))
+MEDIA_POOL_TIMEOUT = float(os.getenv('MEDIA_POOL_TIMEOUT', '30'))
+MEDIA_MAX_RETRIES = int(os.getenv('MEDIA_MAX_RETRIES', '3'))
+MEDIA_RETRY_BACKOFF = float(os.getenv('MEDIA_RETRY_BACKOFF', '2'))  # Базовая пауза между повторами (секунды)
+
 # Папка для временных файлов (голосовые сообщения)
 TEMP_FOLDER = 'temp'
 
+# Кеш проверок каналов (секунды): успешные результаты и отказы (канал не найден, бот не админ)
+CHANNEL_CACHE_TTL = int(os.getenv('CHANNEL_CACHE_TTL', '600'))
+CHANNEL_NEGATIVE_CACHE_TTL = int(os.getenv('CHANNEL_NEGATIVE_CACHE_TTL', '30'))
+
+# Очередь публикаций в каналы (см. publish_queue.py)
+PUBLISH_QUEUE_INTERVAL = int(os.getenv('PUBLISH_QUEUE_INTERVAL', '5'))  # Как часто проверять очередь (секунды)
+PUBLISH_CHANNEL_MIN_INTERVAL = float(os.getenv('PUBLISH_CHANNEL_MIN_INTERVAL', '3'))  # Пауза между сообщениями в один канал
+PUBLISH_MAX_ATTEMPTS = int(os.getenv('PUBLISH_MAX_ATTEMPTS', '5'))
+PUBLISH_RETRY_BASE_DELAY = int(os.getenv('PUBLISH_RETRY_BASE_DELAY', '10'))  # Пауза перед 1-м повтором, далее x2
+
+# Администраторы бота (telegram_id через запятую) - доступ к /broadcast
+ADMIN_TELEGRAM_IDS = {
+    int(admin_id) for admin_id in os.getenv('ADMIN_TELEGRAM_IDS', '').split(',') if admin_id.strip()
+}
+
+# Рассылки (см. broadcast.py)
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '25'))  # Сообщений в секунду на весь бот (лимит Telegram ~30)
+BROADCAST_PER_CHAT_INTERVAL = float(os.getenv('BROADCAST_PER_CHAT_INTERVAL', '1'))  # Пауза между сообщениями в один чат
+BROADCAST_PAGE_SIZE = int(os.getenv('BROADCAST_PAGE_SIZE', '200'))  # Пользователей за один запрос к базе
+BROADCAST_CHECKPOINT_EVERY = int(os.getenv('BROADCAST_CHECKPOINT_EVERY', '20'))  # Сохранять прогресс каждые N сообщений
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv('BROADCAST_PROGRESS_INTERVAL', '3'))  # Обновление прогресса у админа (секунды)
+
+# Аналитика воронки (см. analytics.py)
+ANALYTICS_SNAPSHOT_INTERVAL = int(os.getenv('ANALYTICS_SNAPSHOT_INTERVAL', '900'))  # Как часто обновлять снимок (секунды)
+ANALYTICS_TOKEN = os.getenv('ANALYTICS_TOKEN')  # Нужен для GET /analytics/funnel (не задан - endpoint выключен)
+
+# Фильтр email при регистрации (см. email_allowlist.py)
+EMAIL_ALLOWLIST_REFRESH_INTERVAL = int(os.getenv('EMAIL_ALLOWLIST_REFRESH_INTERVAL', '300'))  # Полное обновление (секунды)
+EMAIL_ALLOWLIST_MISS_REFRESH = int(os.getenv('EMAIL_ALLOWLIST_MISS_REFRESH', '30'))  # Не чаще при неизвестном email (секунды)
+
+# Контроль допуска к регистрации при наплыве (см. admission.py)
+ADMISSION_MAX_ACTIVE = int(os.getenv('ADMISSION_MAX_ACTIVE', '20'))  # Одновременных регистраций (0 = без ограничения)
+ADMISSION_MAX_QUEUE = int(os.getenv('ADMISSION_MAX_QUEUE', '2000'))  # Сверх этого - просьба повторить позже
+ADMISSION_UPDATE_INTERVAL = float(os.getenv('ADMISSION_UPDATE_INTERVAL', '15'))  # Обновление места в очереди (секунды)
+ADMISSION_EDIT_RATE = float(os.getenv('ADMISSION_EDIT_RATE', '10'))  # Сообщений об очереди в секунду на весь бот
+ADMISSION_SESSION_ESTIMATE = float(os.getenv('ADMISSION_SESSION_ESTIMATE', '8'))  # Начальная оценка регистрации (секунды)
+
+# Локальное хранилище user_data между перезапусками (см. persistence.py)
+PERSISTENCE_FILE = os.getenv('PERSISTENCE_FILE', 'data/bot_state.sqlite3')  # Пусто = не сохранять
+PERSISTENCE_UPDATE_INTERVAL = float(os.getenv('PERSISTENCE_UPDATE_INTERVAL', '5'))  # Как часто собирать изменения (секунды)
+PERSISTENCE_FLUSH_DELAY = float(os.getenv('PERSISTENCE_FLUSH_DELAY', '1'))  # Ожидание перед записью пакета (секунды)
+
+# Предохранитель и адаптивный таймаут n8n (см. circuit_breaker.py)
+N8N_BREAKER_FAILURES = int(os.getenv('N8N_BREAKER_FAILURES', '5'))  # Неудач подряд до отказа без запроса (0 = выключено)
+N8N_BREAKER_RESET = float(os.getenv('N8N_BREAKER_RESET', '60'))  # Через сколько секунд пробный запрос
+N8N_TIMEOUT_FACTOR = float(os.getenv('N8N_TIMEOUT_FACTOR', '2'))  # Таймаут ответа = p99 задержки × множитель
+N8N_TIMEOUT_MIN = float(os.getenv('N8N_TIMEOUT_MIN', '30'))  # Нижняя граница таймаута (секунды)
+N8N_TIMEOUT_MAX = float(os.getenv('N8N_TIMEOUT_MAX', '180'))  # Верхняя граница и таймаут до накопления статистики
+N8N_TIMEOUT_MIN_SAMPLES = int(os.getenv('N8N_TIMEOUT_MIN_SAMPLES', '20'))  # Ответов для расчета таймаута
+
+# Очередь генерации (см. generation_queue.py): одновременных запросов в n8n всего и по типам webhook,
+# приоритет типов (меньше - раньше, короткие генерации впереди длинных)
+GENERATION_MAX_ACTIVE = int(os.getenv('GENERATION_MAX_ACTIVE', '20'))  # 0 = без общего ограничения
+GENERATION_LIMITS = os.getenv('GENERATION_LIMITS', 'osebe=5,post=8,bluebutt=4,anons=4,prodaj=4')
+GENERATION_PRIORITIES = os.getenv('GENERATION_PRIORITIES', 'anons=0,osebe=1,bluebutt=2,prodaj=2,post=3')
+GENERATION_UPDATE_INTERVAL = float(os.getenv('GENERATION_UPDATE_INTERVAL', '10'))  # Обновление места в очереди (секунды)
+GENERATION_EDIT_RATE = float(os.getenv('GENERATION_EDIT_RATE', '10'))  # Сообщений об очереди в секунду на весь бот
+GENERATION_ESTIMATE = float(os.getenv('GENERATION_ESTIMATE', '30'))  # Оценка генерации, пока нет статистики (секунды)
+
+# Параллельная обработка обновлений и оптимистичные блокировки строк users (см. conflicts.py)
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '0'))  # Обновлений одновременно (0 или 1 = по очереди)
+CONFLICT_RETRY_ATTEMPTS = int(os.getenv('CONFLICT_RETRY_ATTEMPTS', '3'))  # Попыток шага при конфликте версий
+CONFLICT_RETRY_DELAY = float(os.getenv('CONFLICT_RETRY_DELAY', '0.05'))  # Базовая пауза перед повтором (секунды)
+
+# Остановка по SIGTERM (см. handoff.py): сколько ждать завершения ожиданий n8n,
+# прежде чем передать их следующему запуску (меньше stop_grace_period в docker-compose.yml)
+DRAIN_TIMEOUT = float(os.getenv('DRAIN_TIMEOUT', '20'))
+
+# Токен для GET /metrics (не задан - endpoint выключен)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# Замер задержки event loop для /metrics (секунды, 0 = выключено)
+EVENT_LOOP_LAG_INTERVAL = float(os.getenv('EVENT_LOOP_LAG_INTERVAL', '0.5'))
+
 # Порт для webhook сервера (прием ответов от n8n)
 WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
 
@@ -80,6 +213,8 @@ class UserState:
     PROCESSING_POST = 'processing_post'  # Обработка поста через n8n
     POST_RESULT_SHOWN = 'post_result_shown'  # Показан результат поста
     ALL_POSTS_COMPLETED = 'all_posts_completed'  # Все 5 постов созданы
+    ANSWERING_EXPRESS_QUESTIONS = 'answering_express_questions'  # Экспресс: отвечает сразу на все вопросы
+    PROCESSING_EXPRESS_POSTS = 'processing_express_posts'  # Экспресс: пакетная генерация всех постов
     # Состояния для публикации поста-знакомства
     LEARN5_SENT = 'learn5_sent'  # Видео learn5 отправлено
     PUBLISH_MYSELF = 'publish_myself'  # Выбрал "Опубликую сам"
@@ -94,6 +229,7 @@ class UserState:
     CHOOSING_BUTTON_TEXT = 'choosing_button_text'  # Выбирает текст кнопки
     WAITING_CUSTOM_BUTTON_TEXT = 'waiting_custom_button_text'  # Ожидает свой текст кнопки
     PREVIEW_POST = 'preview_post'  # Предпросмотр поста
+    PUBLISHING_POST = 'publishing_post'  # Пост в очереди на публикацию
     POST_PUBLISHED = 'post_published'  # Пост опубликован
     # Состояния для создания анонсов
     LEARN6_SENT = 'learn6_sent'  # Видео learn6 отправлено
@@ -123,6 +259,13 @@ TOTAL_POSTS = 5  # Всего постов для создания
 QUESTIONS_PER_POST = 3  # Вопросов на каждый пост
 MAX_POST_ATTEMPTS = 2  # Максимум попыток переписать пост
 
+# Конвейерный режим: пост N генерируется в фоне, пока пользователь отвечает на вопросы поста N+1
+POSTS_PIPELINE_MODE = os.getenv('POSTS_PIPELINE_MODE', 'false').lower() in ('1', 'true', 'yes')
+POSTS_PIPELINE_MAX_TRIES = 2  # Попыток генерации одного поста в конвейерном режиме
+
+# Экспресс-режим: все 5 постов генерируются одним пакетным запросом в n8n
+N8N_BATCH_TIMEOUT = int(os.getenv('N8N_BATCH_TIMEOUT', '300'))  # Ожидание пакетного ответа (секунды)
+
 # Константы для публикации поста с кнопкой
 BLUE_BUTTON_QUESTIONS = 5  # Количество вопросов для поста с кнопкой
 BEST_LINKS_COUNT = 5  # Количество ссылок на лучшие посты
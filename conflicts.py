@@ -0,0 +1,78 @@
+"""
+Оптимистичные блокировки строк users
+
+Каждое изменение строки users увеличивает ее version (триггер в setup.sql).
+Шаг обработчика читает строку вместе с версией и пишет с условием "версия не
+изменилась". Если между чтением и записью строку изменил параллельный апдейт
+того же пользователя (двойное нажатие, голосовое и текст подряд), запись
+отклоняется с VersionConflict, и шаг выполняется заново по свежим данным -
+не больше CONFLICT_RETRY_ATTEMPTS раз.
+
+Повторять можно только шаги, которые до записи с проверкой версии ничего не
+отправляют пользователю: повтор начинается с чтения.
+"""
+import asyncio
+import functools
+import random
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+from config import CONFLICT_RETRY_ATTEMPTS, CONFLICT_RETRY_DELAY
+from logger import bot_logger
+from metrics import metrics
+
+version_conflicts_total = metrics.counter('version_conflicts_total', 'Конфликты версий строк users по шагам')
+versioned_steps_total = metrics.counter(
+    'versioned_steps_total', 'Шаги с проверкой версии (ok, retried - успех после повтора, failed)'
+)
+
+T = TypeVar('T')
+
+
+class VersionConflict(Exception):
+    """Строку изменили между чтением и записью с проверкой версии"""
+
+    def __init__(self, table: str, telegram_id: int, expected_version: Optional[int]):
+        super().__init__(
+            f'Конфликт версий {table}: telegram_id={telegram_id}, ожидалась версия {expected_version}'
+        )
+        self.table = table
+        self.telegram_id = telegram_id
+        self.expected_version = expected_version
+
+
+def retry_on_conflict(step: str, attempts: int = CONFLICT_RETRY_ATTEMPTS,
+                      delay: float = CONFLICT_RETRY_DELAY):
+    """
+    Повторяет шаг обработчика при конфликте версий
+
+    Args:
+        step: Имя шага (метка в метриках и логах)
+        attempts: Сколько раз выполнить шаг всего
+        delay: Базовая пауза перед повтором (секунды, растет с номером попытки, со случайным разбросом)
+
+    Returns:
+        Декоратор async функции; после последней неудачной попытки VersionConflict пробрасывается
+    """
+    def decorator(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> T:
+            attempt = 1
+            while True:
+                try:
+                    result = await func(*args, **kwargs)
+                except VersionConflict as conflict:
+                    version_conflicts_total.inc(step=step)
+                    if attempt >= attempts:
+                        versioned_steps_total.inc(step=step, result='failed')
+                        bot_logger.error('DATABASE', f'Конфликт версий не разрешился за {attempts} попыток',
+                                         step=step, telegram_id=conflict.telegram_id)
+                        raise
+                    bot_logger.warning('DATABASE', 'Конфликт версий, шаг выполняется заново',
+                                       step=step, telegram_id=conflict.telegram_id, attempt=attempt)
+                    await asyncio.sleep(delay * attempt * random.uniform(0.5, 1.5))
+                    attempt += 1
+                    continue
+                versioned_steps_total.inc(step=step, result='ok' if attempt == 1 else 'retried')
+                return result
+        return wrapper
+    return decorator
@@ -1,27 +1,89 @@
 """
 Модуль для работы с базой данных Supabase
 """
-from supabase import create_client, Client
+import json
 from config import (
-    SUPABASE_URL, SUPABASE_KEY, SUPABASE_TABLE, 
+    SUPABASE_TABLE, 
     SUPABASE_PROMPTS_TABLE, SUPABASE_N8N_RESPONSES_TABLE,
-    SUPABASE_POSTS_TABLE, UserState
+    SUPABASE_POSTS_TABLE, SUPABASE_PUBLISH_JOBS_TABLE, SUPABASE_BROADCASTS_TABLE,
+    SUPABASE_HANDOFFS_TABLE, SUPABASE_USER_POSTS_TABLE, SUPABASE_USER_INTRO_POSTS_TABLE,
+    SUPABASE_USER_ANONS_TABLE, SUPABASE_USER_SALES_TABLE, UserState
 )
-from typing import Optional, Dict, Any
+from typing import TYPE_CHECKING, Callable, Optional, Dict, Any, List
 from datetime import datetime
+from conflicts import VersionConflict
 from logger import bot_logger
+from services import services
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+
+def decode_json_field(value: Any) -> Dict[str, Any]:
+    """
+    JSONB поле ответов как словарь
+
+    Args:
+        value: Значение из базы: объект, строка JSON (записи до перехода на JSONB-объекты) или None
+
+    Returns:
+        Словарь (пустой, если значения нет)
+    """
+    if not value:
+        return {}
+    if isinstance(value, str):
+        return json.loads(value)
+    return value
+
+
+# Код ошибки, которым функции записи сообщают об устаревшей версии строки users (setup.sql, раздел 11)
+VERSION_CONFLICT_CODE = '40001'
+
+
+def is_version_conflict(error: Exception) -> bool:
+    """Отклонена ли запись из-за изменения строки после чтения"""
+    return getattr(error, 'code', None) == VERSION_CONFLICT_CODE
+
+
+# Получатель изменений состояния пользователя (кеш состояния в user_data, см. handlers.py):
+# (telegram_id, новое состояние или None - сбросить кеш, версия строки users)
+StateListener = Callable[[int, Optional[str], Optional[int]], None]
 
 
 class Database:
     """Класс для работы с базой данных Supabase"""
     
+    # Общий для всех экземпляров: состояние пишут обработчики, задачи и webhook сервер
+    state_listener: Optional[StateListener] = None
+    
     def __init__(self):
-        """Инициализация подключения к Supabase"""
-        self.client: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+        """Инициализация (клиент Supabase общий и создается при первом запросе)"""
+        self._client: Optional['Client'] = None
         self.table_name = SUPABASE_TABLE
         self.prompts_table = SUPABASE_PROMPTS_TABLE
         self.n8n_responses_table = SUPABASE_N8N_RESPONSES_TABLE
         self.posts_table = SUPABASE_POSTS_TABLE
+        self.publish_jobs_table = SUPABASE_PUBLISH_JOBS_TABLE
+        self.broadcasts_table = SUPABASE_BROADCASTS_TABLE
+        self.handoffs_table = SUPABASE_HANDOFFS_TABLE
+        # Данные этапов: читаются только обработчиками своего этапа
+        self.user_posts_table = SUPABASE_USER_POSTS_TABLE
+        self.user_intro_posts_table = SUPABASE_USER_INTRO_POSTS_TABLE
+        self.user_anons_table = SUPABASE_USER_ANONS_TABLE
+        self.user_sales_table = SUPABASE_USER_SALES_TABLE
+
+    def _notify_state(self, telegram_id: int, state: Optional[str], version: Optional[int]) -> None:
+        if Database.state_listener is not None:
+            Database.state_listener(telegram_id, state, version)
+
+    @property
+    def client(self) -> 'Client':
+        """Клиент Supabase: общий для всех экземпляров Database, если не задан свой"""
+        return self._client or services.supabase
+
+    @client.setter
+    def client(self, client: 'Client') -> None:
+        self._client = client
     
     def check_email_exists(self, email: str) -> bool:
         """
@@ -45,6 +107,63 @@ class Database:
             bot_logger.db_error(str(e), 'users')
             return False
     
+    def get_all_emails(self, page_size: int = 1000) -> Optional[List[str]]:
+        """
+        Получает все email из таблицы users (для фильтра email_allowlist)
+        
+        Args:
+            page_size: Строк за один запрос (keyset пагинация по id)
+            
+        Returns:
+            Список email в нижнем регистре или None при ошибке
+        """
+        emails: List[str] = []
+        after_id = 0
+        try:
+            while True:
+                response = self.client.table(self.table_name)\
+                    .select("id, email")\
+                    .gt("id", after_id)\
+                    .order("id")\
+                    .limit(page_size)\
+                    .execute()
+                rows = response.data or []
+                emails.extend(row['email'].lower() for row in rows if row.get('email'))
+                if len(rows) < page_size:
+                    return emails
+                after_id = rows[-1]['id']
+        except Exception as e:
+            bot_logger.db_error(str(e), 'users')
+            return None
+    
+    def claim_registration(self, email: str, telegram_id: int, state: str) -> Optional[Dict[str, Any]]:
+        """
+        Регистрирует пользователя одним запросом (RPC claim_registration):
+        находит email, записывает telegram_id и состояние
+        
+        Args:
+            email: Email адрес (будет преобразован в нижний регистр)
+            telegram_id: ID пользователя в Telegram
+            state: Состояние после регистрации
+            
+        Returns:
+            Строка пользователя или None, если email не найден (или при ошибке)
+        """
+        email = email.lower()
+        try:
+            response = self.client.rpc("claim_registration", {
+                "p_email": email,
+                "p_telegram_id": telegram_id,
+                "p_state": state
+            }).execute()
+            if not response.data:
+                return None
+            self._notify_state(telegram_id, state, response.data.get('version'))
+            return response.data
+        except Exception as e:
+            bot_logger.db_error(str(e), 'users', telegram_id=telegram_id)
+            return None
+    
     def get_user_by_telegram_id(self, telegram_id: int) -> Optional[Dict[str, Any]]:
         """
         Получает пользователя по Telegram ID
@@ -126,13 +245,15 @@ class Database:
             True если обновление успешно, False если нет
         """
         try:
-            self.client.table(self.table_name)\
+            response = self.client.table(self.table_name)\
                 .update({
                     "state": state,
                     "updated_at": datetime.utcnow().isoformat()
                 })\
                 .eq("telegram_id", telegram_id)\
                 .execute()
+            if response.data:
+                self._notify_state(telegram_id, state, response.data[0].get('version'))
             return True
         except Exception as e:
             bot_logger.db_error(str(e), "users")
@@ -175,6 +296,56 @@ class Database:
         if user:
             return user.get('state', UserState.NEW)
         return None
+
+    def _save_stage_data(self, table: str, telegram_id: int, fields: Dict[str, Any]) -> bool:
+        """
+        Записывает поля в таблицу данных этапа (строка создается при первой записи)
+
+        Args:
+            table: Таблица этапа
+            telegram_id: ID пользователя в Telegram
+            fields: Изменяемые поля (остальные поля строки не затрагиваются)
+
+        Returns:
+            True если запись успешна, False если нет
+        """
+        try:
+            self.client.table(table)\
+                .upsert({
+                    "telegram_id": telegram_id,
+                    **fields,
+                    "updated_at": datetime.utcnow().isoformat()
+                }, on_conflict="telegram_id")\
+                .execute()
+            return True
+        except Exception as e:
+            bot_logger.db_error(str(e), table, telegram_id=telegram_id)
+            return False
+
+    def _get_stage_data(self, table: str, telegram_id: int, columns: str) -> Optional[Dict[str, Any]]:
+        """
+        Читает данные этапа пользователя
+
+        Args:
+            table: Таблица этапа
+            telegram_id: ID пользователя в Telegram
+            columns: Колонки через запятую
+
+        Returns:
+            Словарь с данными или None (этап не начат или ошибка)
+        """
+        try:
+            response = self.client.table(table)\
+                .select(columns)\
+                .eq("telegram_id", telegram_id)\
+                .execute()
+
+            if response.data and len(response.data) > 0:
+                return response.data[0]
+            return None
+        except Exception as e:
+            bot_logger.db_error(str(e), table, telegram_id=telegram_id)
+            return None
     
     def get_prompt(self, prompt_name: str) -> Optional[str]:
         """
@@ -199,6 +370,23 @@ class Database:
             bot_logger.db_error(str(e), "prompts")
             return None
     
+    def get_all_prompts(self) -> List[Dict[str, Any]]:
+        """
+        Получает все промпты из таблицы prompts одним запросом
+        
+        Returns:
+            Список промптов (prompt_name, prompt_text), пустой при ошибке
+        """
+        try:
+            response = self.client.table(self.prompts_table)\
+                .select("prompt_name, prompt_text")\
+                .execute()
+            
+            return response.data or []
+        except Exception as e:
+            bot_logger.db_error(str(e), "prompts")
+            return []
+    
     def save_n8n_request(self, telegram_id: int, request_id: str, user_answer: str) -> bool:
         """
         Сохраняет запрос к n8n в базе данных
@@ -303,13 +491,32 @@ class Database:
             bot_logger.db_error(str(e), "posts")
             return None
     
+    def get_all_posts(self) -> list[Dict[str, Any]]:
+        """
+        Получает данные всех постов одним запросом
+        
+        Returns:
+            Список постов, отсортированный по номеру (пустой при ошибке)
+        """
+        try:
+            response = self.client.table(self.posts_table)\
+                .select("*")\
+                .order("post_number")\
+                .execute()
+            
+            return response.data or []
+        except Exception as e:
+            bot_logger.db_error(str(e), "posts")
+            return []
+    
     def update_user_post_progress(
         self,
         telegram_id: int,
         current_post: int,
         current_question: int,
         attempt: int,
-        answers: Optional[Dict] = None
+        answers: Optional[Dict] = None,
+        expected_version: Optional[int] = None
     ) -> bool:
         """
         Обновляет прогресс создания постов пользователя
@@ -319,62 +526,160 @@ class Database:
             current_post: Текущий номер поста (1-5)
             current_question: Текущий номер вопроса (1-3)
             attempt: Номер попытки (1-2)
-            answers: Словарь с ответами на вопросы
+            answers: Словарь с ответами на вопросы (заменяет сохраненные; None - не изменять)
+            expected_version: Версия строки users при чтении (None - без проверки)
             
         Returns:
             True если обновление успешно, False если нет
+            
+        Raises:
+            VersionConflict: строку изменили после чтения
         """
         try:
-            update_data = {
-                "current_post_number": current_post,
-                "current_question_number": current_question,
-                "post_attempt": attempt,
-                "updated_at": datetime.utcnow().isoformat()
-            }
-            
-            if answers is not None:
-                import json
-                update_data["post_answers"] = json.dumps(answers)
-            
-            self.client.table(self.table_name)\
-                .update(update_data)\
-                .eq("telegram_id", telegram_id)\
-                .execute()
+            self.client.rpc("save_post_progress", {
+                "p_telegram_id": telegram_id,
+                "p_post": current_post,
+                "p_question": current_question,
+                "p_attempt": attempt,
+                "p_answers": answers,
+                "p_version": expected_version
+            }).execute()
             return True
         except Exception as e:
+            if is_version_conflict(e):
+                # Строку изменили не через этот запуск - кешированному состоянию нельзя доверять
+                self._notify_state(telegram_id, None, None)
+                raise VersionConflict(self.table_name, telegram_id, expected_version) from e
             bot_logger.db_error(str(e), "users")
             return False
     
-    def get_user_post_progress(self, telegram_id: int) -> Optional[Dict[str, Any]]:
+    def get_user_post_progress(self, telegram_id: int, with_answers: bool = True) -> Optional[Dict[str, Any]]:
         """
         Получает прогресс создания постов пользователя
         
         Args:
             telegram_id: ID пользователя в Telegram
+            with_answers: Загрузить и ответы (тем же запросом из таблицы ответов постов)
             
         Returns:
-            Словарь с прогрессом или None
+            Словарь с прогрессом (и версией строки для записи с проверкой) или None
         """
+        columns = "state, current_post_number, current_question_number, post_attempt, version"
+        if with_answers:
+            columns += f", {self.user_posts_table}(post_answers)"
         try:
             response = self.client.table(self.table_name)\
-                .select("current_post_number, current_question_number, post_attempt, post_answers")\
+                .select(columns)\
                 .eq("telegram_id", telegram_id)\
                 .execute()
             
             if response.data and len(response.data) > 0:
                 data = response.data[0]
-                # Парсим JSON с ответами
-                if data.get('post_answers'):
-                    import json
-                    data['post_answers'] = json.loads(data['post_answers'])
-                else:
-                    data['post_answers'] = {}
+                if with_answers:
+                    # PostgREST отдает связанную строку объектом (связь один к одному) или списком
+                    posts = data.pop(self.user_posts_table, None)
+                    if isinstance(posts, list):
+                        posts = posts[0] if posts else None
+                    data['post_answers'] = decode_json_field((posts or {}).get('post_answers'))
                 return data
             return None
         except Exception as e:
             bot_logger.db_error(str(e), "users")
             return None
     
+    def get_post_answers(self, telegram_id: int) -> Dict[str, Any]:
+        """
+        Получает ответы на вопросы постов (нужны только для генерации поста)
+        
+        Args:
+            telegram_id: ID пользователя в Telegram
+            
+        Returns:
+            Словарь ответов (пустой, если ответов нет или при ошибке)
+        """
+        data = self._get_stage_data(self.user_posts_table, telegram_id, "post_answers")
+        return decode_json_field((data or {}).get('post_answers'))
+    
+    def save_post_answer(
+        self,
+        telegram_id: int,
+        path: List[str],
+        answer: str,
+        current_post: int,
+        current_question: int,
+        attempt: int,
+        expected_version: Optional[int] = None,
+        state: Optional[str] = None
+    ) -> Optional[int]:
+        """
+        Добавляет ответ в post_answers на сервере (без чтения и перезаписи всей карты)
+        и обновляет прогресс создания постов
+        
+        Args:
+            telegram_id: ID пользователя в Telegram
+            path: Путь ответа: ['answer_1'] или ['post_2', 'answer_1'] в экспресс-режиме
+            answer: Текст ответа
+            current_post: Текущий номер поста (1-5)
+            current_question: Текущий номер вопроса (1-3)
+            attempt: Номер попытки (1-2)
+            expected_version: Версия строки users при чтении прогресса (None - без проверки)
+            state: Новое состояние тем же обновлением (None - не менять)
+            
+        Returns:
+            Количество ответов в объекте, куда записан ответ, или None при ошибке
+            
+        Raises:
+            VersionConflict: прогресс изменили после чтения (ответ не записан)
+        """
+        try:
+            response = self.client.rpc("save_post_answer", {
+                "p_telegram_id": telegram_id,
+                "p_path": path,
+                "p_value": answer,
+                "p_post": current_post,
+                "p_question": current_question,
+                "p_attempt": attempt,
+                "p_version": expected_version,
+                "p_state": state
+            }).execute()
+            if state is not None:
+                # Обновление строки users увеличило версию на единицу
+                self._notify_state(telegram_id, state,
+                                   expected_version + 1 if expected_version is not None else None)
+            return response.data
+        except Exception as e:
+            if is_version_conflict(e):
+                # Строку изменили не через этот запуск - кешированному состоянию нельзя доверять
+                self._notify_state(telegram_id, None, None)
+                raise VersionConflict(self.table_name, telegram_id, expected_version) from e
+            bot_logger.db_error(str(e), "users")
+            return None
+    
+    def append_numbered_answer(self, telegram_id: int, column: str, prefix: str, value: str) -> Optional[int]:
+        """
+        Добавляет следующий по номеру ответ (prefix1, prefix2, ...) на сервере
+        
+        Args:
+            telegram_id: ID пользователя в Telegram
+            column: Колонка ответов ('blue_answers' или 'best_links')
+            prefix: Префикс ключа ('blueotvet', 'link')
+            value: Ответ
+            
+        Returns:
+            Номер добавленного ответа (= количество ответов) или None при ошибке
+        """
+        try:
+            response = self.client.rpc("append_numbered_answer", {
+                "p_telegram_id": telegram_id,
+                "p_column": column,
+                "p_prefix": prefix,
+                "p_value": value
+            }).execute()
+            return response.data
+        except Exception as e:
+            bot_logger.db_error(str(e), self.user_intro_posts_table)
+            return None
+    
     def save_channel_data(self, telegram_id: int, channel_username: str, channel_id: int) -> bool:
         """
         Сохраняет данные канала пользователя
@@ -426,31 +731,22 @@ class Database:
         Returns:
             True если успешно, False если нет
         """
-        try:
-            import json
-            update_data = {"updated_at": datetime.utcnow().isoformat()}
-            
-            if blue_answers is not None:
-                update_data["blue_answers"] = json.dumps(blue_answers)
-            if best_links is not None:
-                update_data["best_links"] = json.dumps(best_links)
-            if button_action is not None:
-                update_data["button_action"] = button_action
-            if button_url is not None:
-                update_data["button_url"] = button_url
-            if button_text is not None:
-                update_data["button_text"] = button_text
-            if post_text is not None:
-                update_data["blue_post_text"] = post_text
-            
-            self.client.table(self.table_name)\
-                .update(update_data)\
-                .eq("telegram_id", telegram_id)\
-                .execute()
-            return True
-        except Exception as e:
-            bot_logger.db_error(str(e), "users")
-            return False
+        update_data = {}
+        
+        if blue_answers is not None:
+            update_data["blue_answers"] = blue_answers
+        if best_links is not None:
+            update_data["best_links"] = best_links
+        if button_action is not None:
+            update_data["button_action"] = button_action
+        if button_url is not None:
+            update_data["button_url"] = button_url
+        if button_text is not None:
+            update_data["button_text"] = button_text
+        if post_text is not None:
+            update_data["blue_post_text"] = post_text
+        
+        return self._save_stage_data(self.user_intro_posts_table, telegram_id, update_data)
     
     def get_blue_button_data(self, telegram_id: int) -> Optional[Dict[str, Any]]:
         """
@@ -462,31 +758,14 @@ class Database:
         Returns:
             Словарь с данными или None
         """
-        try:
-            response = self.client.table(self.table_name)\
-                .select("blue_answers, best_links, button_action, button_url, button_text, blue_post_text")\
-                .eq("telegram_id", telegram_id)\
-                .execute()
-            
-            if response.data and len(response.data) > 0:
-                data = response.data[0]
-                import json
-                # Парсим JSON поля
-                if data.get('blue_answers'):
-                    data['blue_answers'] = json.loads(data['blue_answers'])
-                else:
-                    data['blue_answers'] = {}
-                
-                if data.get('best_links'):
-                    data['best_links'] = json.loads(data['best_links'])
-                else:
-                    data['best_links'] = {}
-                
-                return data
-            return None
-        except Exception as e:
-            bot_logger.db_error(str(e), "users")
-            return None
+        data = self._get_stage_data(
+            self.user_intro_posts_table, telegram_id,
+            "blue_answers, best_links, button_action, button_url, button_text, blue_post_text"
+        )
+        if data is not None:
+            data['blue_answers'] = decode_json_field(data.get('blue_answers'))
+            data['best_links'] = decode_json_field(data.get('best_links'))
+        return data
     
     def save_anons_data(
         self,
@@ -507,24 +786,16 @@ class Database:
         Returns:
             True если успешно, False если нет
         """
-        try:
-            update_data = {"updated_at": datetime.utcnow().isoformat()}
-            
-            if anons1 is not None:
-                update_data["anons1"] = anons1
-            if anons2 is not None:
-                update_data["anons2"] = anons2
-            if anons_text is not None:
-                update_data["anons_text"] = anons_text
-            
-            self.client.table(self.table_name)\
-                .update(update_data)\
-                .eq("telegram_id", telegram_id)\
-                .execute()
-            return True
-        except Exception as e:
-            bot_logger.db_error(str(e), "users")
-            return False
+        update_data = {}
+        
+        if anons1 is not None:
+            update_data["anons1"] = anons1
+        if anons2 is not None:
+            update_data["anons2"] = anons2
+        if anons_text is not None:
+            update_data["anons_text"] = anons_text
+        
+        return self._save_stage_data(self.user_anons_table, telegram_id, update_data)
     
     def get_anons_data(self, telegram_id: int) -> Optional[Dict[str, Any]]:
         """
@@ -536,18 +807,7 @@ class Database:
         Returns:
             Словарь с данными или None
         """
-        try:
-            response = self.client.table(self.table_name)\
-                .select("anons1, anons2, anons_text")\
-                .eq("telegram_id", telegram_id)\
-                .execute()
-            
-            if response.data and len(response.data) > 0:
-                return response.data[0]
-            return None
-        except Exception as e:
-            bot_logger.db_error(str(e), "users")
-            return None
+        return self._get_stage_data(self.user_anons_table, telegram_id, "anons1, anons2, anons_text")
     
     def save_sales_data(
         self,
@@ -572,49 +832,357 @@ class Database:
         Returns:
             True если успешно, False если нет
         """
+        update_data = {}
+        
+        if prodaj1 is not None:
+            update_data["prodaj1"] = prodaj1
+        if prodaj2 is not None:
+            update_data["prodaj2"] = prodaj2
+        if prodaj3 is not None:
+            update_data["prodaj3"] = prodaj3
+        if sales_text is not None:
+            update_data["sales_text"] = sales_text
+        if rewrite_count is not None:
+            update_data["rewrite_count"] = rewrite_count
+        
+        return self._save_stage_data(self.user_sales_table, telegram_id, update_data)
+    
+    def get_sales_data(self, telegram_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Получает данные продающего поста
+        
+        Args:
+            telegram_id: ID пользователя
+            
+        Returns:
+            Словарь с данными или None
+        """
+        return self._get_stage_data(
+            self.user_sales_table, telegram_id, "prodaj1, prodaj2, prodaj3, sales_text, rewrite_count"
+        )
+    
+    def create_publish_job(self, job: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Создает задачу публикации, если задачи с таким dedup_key еще нет
+        
+        Args:
+            job: Поля задачи (telegram_id, channel_id, dedup_key, post_text,
+                 button_text, button_url, scheduled_at)
+            
+        Returns:
+            Задача с этим dedup_key (новая или уже существующая) или None при ошибке
+        """
         try:
-            update_data = {"updated_at": datetime.utcnow().isoformat()}
+            now = datetime.utcnow().isoformat()
+            row = {
+                **job,
+                "status": "pending",
+                "attempts": 0,
+                "next_attempt_at": job.get("scheduled_at") or now,
+                "created_at": now,
+                "updated_at": now
+            }
+            self.client.table(self.publish_jobs_table)\
+                .upsert(row, on_conflict="dedup_key", ignore_duplicates=True)\
+                .execute()
+            return self.get_publish_job(job["dedup_key"])
+        except Exception as e:
+            bot_logger.db_error(str(e), "publish_jobs")
+            return None
+    
+    def get_publish_job(self, dedup_key: str) -> Optional[Dict[str, Any]]:
+        """
+        Получает задачу публикации по ключу дедупликации
+        
+        Args:
+            dedup_key: Ключ дедупликации
             
-            if prodaj1 is not None:
-                update_data["prodaj1"] = prodaj1
-            if prodaj2 is not None:
-                update_data["prodaj2"] = prodaj2
-            if prodaj3 is not None:
-                update_data["prodaj3"] = prodaj3
-            if sales_text is not None:
-                update_data["sales_text"] = sales_text
-            if rewrite_count is not None:
-                update_data["rewrite_count"] = rewrite_count
+        Returns:
+            Словарь задачи или None
+        """
+        try:
+            response = self.client.table(self.publish_jobs_table)\
+                .select("*")\
+                .eq("dedup_key", dedup_key)\
+                .execute()
             
-            self.client.table(self.table_name)\
-                .update(update_data)\
-                .eq("telegram_id", telegram_id)\
+            if response.data and len(response.data) > 0:
+                return response.data[0]
+            return None
+        except Exception as e:
+            bot_logger.db_error(str(e), "publish_jobs")
+            return None
+    
+    def get_due_publish_jobs(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        Получает задачи публикации, которые пора выполнить
+        
+        Args:
+            limit: Максимум задач
+            
+        Returns:
+            Список задач в статусах pending/sent, отсортированный по времени попытки
+        """
+        try:
+            response = self.client.table(self.publish_jobs_table)\
+                .select("*")\
+                .in_("status", ["pending", "sent"])\
+                .lte("next_attempt_at", datetime.utcnow().isoformat())\
+                .order("next_attempt_at")\
+                .limit(limit)\
+                .execute()
+            return response.data or []
+        except Exception as e:
+            bot_logger.db_error(str(e), "publish_jobs")
+            return []
+    
+    def update_publish_job(self, job_id: int, fields: Dict[str, Any]) -> bool:
+        """
+        Обновляет задачу публикации
+        
+        Args:
+            job_id: ID задачи
+            fields: Обновляемые поля
+            
+        Returns:
+            True если обновление успешно, False если нет
+        """
+        try:
+            self.client.table(self.publish_jobs_table)\
+                .update({**fields, "updated_at": datetime.utcnow().isoformat()})\
+                .eq("id", job_id)\
                 .execute()
             return True
         except Exception as e:
-            bot_logger.db_error(str(e), "users")
+            bot_logger.db_error(str(e), "publish_jobs")
             return False
     
-    def get_sales_data(self, telegram_id: int) -> Optional[Dict[str, Any]]:
+    def get_users_page_by_state(
+        self,
+        state: str,
+        after_id: int,
+        updated_before: Optional[str] = None,
+        limit: int = 200
+    ) -> List[Dict[str, Any]]:
         """
-        Получает данные продающего поста
+        Получает следующую страницу пользователей в состоянии (keyset пагинация по (state, id))
         
         Args:
-            telegram_id: ID пользователя
+            state: Состояние пользователя
+            after_id: id последнего обработанного пользователя (0 - с начала)
+            updated_before: Только пользователи без активности с этого момента (ISO, UTC)
+            limit: Размер страницы
             
         Returns:
-            Словарь с данными или None
+            Список {id, telegram_id}, отсортированный по id
         """
         try:
-            response = self.client.table(self.table_name)\
-                .select("prodaj1, prodaj2, prodaj3, sales_text, rewrite_count")\
-                .eq("telegram_id", telegram_id)\
+            query = self.client.table(self.table_name)\
+                .select("id, telegram_id")\
+                .eq("state", state)\
+                .gt("id", after_id)\
+                .not_.is_("telegram_id", "null")
+            if updated_before:
+                query = query.lte("updated_at", updated_before)
+            response = query.order("id").limit(limit).execute()
+            return response.data or []
+        except Exception as e:
+            bot_logger.db_error(str(e), "users")
+            return []
+    
+    def create_broadcast(self, broadcast: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Создает рассылку
+        
+        Args:
+            broadcast: Поля рассылки (admin_id, state, inactive_days, updated_before, text)
+            
+        Returns:
+            Созданная рассылка или None
+        """
+        try:
+            now = datetime.utcnow().isoformat()
+            response = self.client.table(self.broadcasts_table)\
+                .insert({
+                    **broadcast,
+                    "status": "running",
+                    "last_user_id": 0,
+                    "sent": 0,
+                    "failed": 0,
+                    "blocked": 0,
+                    "created_at": now,
+                    "updated_at": now
+                })\
                 .execute()
             
             if response.data and len(response.data) > 0:
                 return response.data[0]
             return None
         except Exception as e:
-            bot_logger.db_error(str(e), "users")
+            bot_logger.db_error(str(e), "broadcasts")
             return None
-
+    
+    def get_broadcasts_by_status(self, status: str) -> List[Dict[str, Any]]:
+        """
+        Получает рассылки в статусе
+        
+        Args:
+            status: running | done | cancelled
+            
+        Returns:
+            Список рассылок
+        """
+        try:
+            response = self.client.table(self.broadcasts_table)\
+                .select("*")\
+                .eq("status", status)\
+                .order("id")\
+                .execute()
+            return response.data or []
+        except Exception as e:
+            bot_logger.db_error(str(e), "broadcasts")
+            return []
+    
+    def update_broadcast(self, broadcast_id: int, fields: Dict[str, Any]) -> bool:
+        """
+        Обновляет рассылку (прогресс, статус)
+        
+        Args:
+            broadcast_id: ID рассылки
+            fields: Обновляемые поля
+            
+        Returns:
+            True если обновление успешно, False если нет
+        """
+        try:
+            self.client.table(self.broadcasts_table)\
+                .update({**fields, "updated_at": datetime.utcnow().isoformat()})\
+                .eq("id", broadcast_id)\
+                .execute()
+            return True
+        except Exception as e:
+            bot_logger.db_error(str(e), "broadcasts")
+            return False
+    
+    def refresh_funnel_snapshot(self, stages: List[str]) -> Optional[Dict[str, Any]]:
+        """
+        Считает агрегаты воронки на стороне базы и сохраняет снимок (RPC refresh_funnel_snapshot)
+        
+        Args:
+            stages: Этапы воронки в порядке прохождения
+            
+        Returns:
+            Данные снимка или None
+        """
+        try:
+            response = self.client.rpc("refresh_funnel_snapshot", {
+                "p_stages": stages
+            }).execute()
+            return response.data
+        except Exception as e:
+            bot_logger.db_error(str(e), "funnel_snapshots")
+            return None
+    
+    def get_latest_funnel_snapshot(self) -> Optional[Dict[str, Any]]:
+        """
+        Получает последний снимок воронки
+        
+        Returns:
+            Данные снимка или None
+        """
+        try:
+            response = self.client.table("funnel_snapshots")\
+                .select("data, created_at")\
+                .order("created_at", desc=True)\
+                .limit(1)\
+                .execute()
+            
+            if response.data and len(response.data) > 0:
+                return response.data[0]["data"]
+            return None
+        except Exception as e:
+            bot_logger.db_error(str(e), "funnel_snapshots")
+            return None
+    
+    def create_handoffs(self, handoffs: List[Dict[str, Any]]) -> bool:
+        """
+        Сохраняет ожидания, передаваемые следующему запуску бота (одним запросом)
+        
+        Args:
+            handoffs: Записи (request_id, telegram_id, resume, message, params,
+                      expires_at, handed_off_by)
+            
+        Returns:
+            True если сохранено, False если нет
+        """
+        try:
+            now = datetime.utcnow().isoformat()
+            rows = [{**handoff, "status": "pending", "created_at": now, "updated_at": now} for handoff in handoffs]
+            self.client.table(self.handoffs_table)\
+                .upsert(rows, on_conflict="request_id")\
+                .execute()
+            return True
+        except Exception as e:
+            bot_logger.db_error(str(e), "handoffs")
+            return False
+    
+    def get_pending_handoffs(self) -> Optional[List[Dict[str, Any]]]:
+        """
+        Получает ожидания, переданные прошлым запуском и еще не подхваченные
+        
+        Returns:
+            Список записей (по времени создания) или None при ошибке
+        """
+        try:
+            response = self.client.table(self.handoffs_table)\
+                .select("*")\
+                .eq("status", "pending")\
+                .order("created_at")\
+                .execute()
+            return response.data or []
+        except Exception as e:
+            bot_logger.db_error(str(e), "handoffs")
+            return None
+    
+    def update_handoffs(self, handoff_ids: List[int], fields: Dict[str, Any]) -> bool:
+        """
+        Обновляет переданные ожидания (статус)
+        
+        Args:
+            handoff_ids: ID записей
+            fields: Обновляемые поля
+            
+        Returns:
+            True если обновление успешно, False если нет
+        """
+        try:
+            self.client.table(self.handoffs_table)\
+                .update({**fields, "updated_at": datetime.utcnow().isoformat()})\
+                .in_("id", handoff_ids)\
+                .execute()
+            return True
+        except Exception as e:
+            bot_logger.db_error(str(e), "handoffs")
+            return False
+    
+    def save_handoff_response(self, request_id: str, response: Any) -> bool:
+        """
+        Сохраняет ответ n8n, пришедший после передачи ожидания следующему запуску
+        
+        Args:
+            request_id: ID запроса n8n
+            response: Текст ответа или словарь частей пакетного ответа
+            
+        Returns:
+            True если ожидание с таким request_id есть и ответ сохранен
+        """
+        try:
+            result = self.client.table(self.handoffs_table)\
+                .update({"response": response, "updated_at": datetime.utcnow().isoformat()})\
+                .eq("request_id", request_id)\
+                .neq("status", "done")\
+                .execute()
+            return bool(result.data)
+        except Exception as e:
+            bot_logger.db_error(str(e), "handoffs")
+            return False
@@ -0,0 +1,95 @@
+"""
+Фильтр email при регистрации
+
+Множество разрешенных email (колонка email таблицы users) хранится в памяти
+и периодически обновляется целиком, поэтому опечатки и чужие адреса
+отклоняются без запроса к базе. Если адреса нет в множестве, а оно старше
+EMAIL_ALLOWLIST_MISS_REFRESH секунд, множество перечитывается: только что
+добавленный в базу email не отклоняется дольше этого интервала, а поток
+неизвестных адресов дает не больше одного запроса за интервал.
+"""
+import asyncio
+import time
+from typing import FrozenSet, Optional
+
+from telegram.ext import ContextTypes
+
+from config import EMAIL_ALLOWLIST_MISS_REFRESH
+from database import Database
+from logger import bot_logger
+from metrics import metrics
+
+# Инициализация базы данных
+db = Database()
+
+allowlist_checks_total = metrics.counter(
+    'email_allowlist_checks_total', 'Проверки email по фильтру (hit, miss, unloaded)'
+)
+allowlist_size = metrics.gauge('email_allowlist_size', 'Email в фильтре регистрации')
+
+
+class EmailAllowlist:
+    """Множество email, которым разрешена регистрация"""
+
+    def __init__(self):
+        self._emails: Optional[FrozenSet[str]] = None
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._emails is not None
+
+    async def refresh(self) -> bool:
+        """
+        Перечитывает все email из базы
+
+        Returns:
+            True если множество обновлено, False при ошибке (остается прежнее)
+        """
+        async with self._lock:
+            return await self._refresh_locked()
+
+    async def _refresh_locked(self) -> bool:
+        emails = await asyncio.to_thread(db.get_all_emails)
+        if emails is None:
+            return False
+        self._emails = frozenset(emails)
+        self._loaded_at = time.monotonic()
+        allowlist_size.set(len(self._emails))
+        return True
+
+    async def refresh_job(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Callback для job_queue: периодическое обновление фильтра"""
+        if await self.refresh():
+            bot_logger.info('SYSTEM', 'Обновлен фильтр email', emails=len(self._emails))
+
+    async def contains(self, email: str) -> bool:
+        """
+        Проверяет, может ли email быть в базе
+
+        Args:
+            email: Email в нижнем регистре
+
+        Returns:
+            False - email точно не найден (запрос к базе не нужен);
+            True - email есть в фильтре или фильтр не загружен
+        """
+        if self._emails is None:
+            allowlist_checks_total.inc(result='unloaded')
+            return True
+        if email in self._emails:
+            allowlist_checks_total.inc(result='hit')
+            return True
+
+        # Email могли добавить после последнего обновления
+        async with self._lock:
+            # Пока ждали блокировку, множество мог обновить другой обработчик
+            if email not in self._emails and time.monotonic() - self._loaded_at >= EMAIL_ALLOWLIST_MISS_REFRESH:
+                await self._refresh_locked()
+        found = email in self._emails
+        allowlist_checks_total.inc(result='hit' if found else 'miss')
+        return found
+
+
+email_allowlist = EmailAllowlist()
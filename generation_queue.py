@@ -0,0 +1,269 @@
+"""
+Очередь генераций между обработчиками и n8n
+
+Обработчики раньше отправляли запросы в n8n сразу, как только
+пользователь заканчивал отвечать: при наплыве LLM получала все запросы
+одновременно и замедлялся каждый. Теперь запрос (отправка и ожидание
+ответа) занимает слот: одновременно выполняется не больше max_active
+генераций всего и не больше limits[тип] для каждого типа webhook.
+
+Когда слот освобождается, первой запускается генерация с меньшим
+приоритетом (короткие анонсы раньше длинных постов), при равном - та,
+что ждет дольше. Пока запрос ждет, сообщение "обрабатываю" заменяется
+местом в очереди и примерным временем; после допуска возвращается
+исходный текст.
+"""
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+from itertools import count
+from typing import AsyncIterator, Dict, List, Optional
+
+from telegram import Message
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, TelegramError
+
+import messages
+from admission import format_eta
+from circuit_breaker import n8n_guard
+from config import (
+    GENERATION_MAX_ACTIVE, GENERATION_LIMITS, GENERATION_PRIORITIES,
+    GENERATION_UPDATE_INTERVAL, GENERATION_EDIT_RATE, GENERATION_ESTIMATE
+)
+from logger import bot_logger
+from metrics import metrics
+from rate_limit import TokenBucket
+
+generation_active = metrics.gauge('generation_active', 'Выполняющиеся генерации по типам webhook')
+generation_queued = metrics.gauge('generation_queued', 'Генерации в очереди по типам webhook')
+generation_jobs_total = metrics.counter('generation_jobs_total', 'Генерации по типам webhook (started, queued)')
+generation_wait_seconds = metrics.histogram(
+    'generation_wait_seconds', 'Ожидание генерации в очереди',
+    buckets=(0.1, 1, 5, 15, 30, 60, 120, 300, 600)
+)
+
+
+def parse_type_values(raw: str) -> Dict[str, int]:
+    """
+    Разбирает строку значений по типам webhook
+
+    Args:
+        raw: Строка вида "osebe=5,post=8"
+
+    Returns:
+        Словарь {тип: число}
+    """
+    result = {}
+    for item in raw.split(','):
+        if '=' not in item:
+            continue
+        webhook_type, value = item.split('=', 1)
+        try:
+            result[webhook_type.strip()] = int(value)
+        except ValueError:
+            bot_logger.warning('SYSTEM', f'Некорректное значение для {webhook_type.strip()}: {value}')
+    return result
+
+
+class GenerationJob:
+    """Генерация, ожидающая слота"""
+
+    def __init__(self, sequence: int, telegram_id: int, webhook_type: str, priority: int,
+                 message: Optional[Message]):
+        self.sequence = sequence
+        self.telegram_id = telegram_id
+        self.webhook_type = webhook_type
+        self.priority = priority
+        self.message = message
+        self.enqueued_at = time.monotonic()
+        self.admitted = asyncio.Event()
+        self.shown = False
+        self.last_text = ''
+        self.last_edit = 0.0
+
+
+class GenerationQueue:
+    """Ограничение одновременных генераций с приоритетами типов webhook"""
+
+    def __init__(
+        self,
+        max_active: int,
+        limits: Dict[str, int],
+        priorities: Dict[str, int],
+        update_interval: float,
+        edit_limiter: TokenBucket,
+        default_estimate: float
+    ):
+        """
+        Args:
+            max_active: Одновременных генераций всего (0 - без общего ограничения)
+            limits: Одновременных генераций по типам webhook (нет типа - без ограничения)
+            priorities: Приоритет типов (меньше - раньше; нет типа - после всех)
+            update_interval: Не чаще чем раз во столько секунд обновлять место в очереди у пользователя
+            edit_limiter: Общее ограничение частоты сообщений об очереди
+            default_estimate: Оценка длительности генерации, пока нет статистики ответов (секунды)
+        """
+        self.max_active = max_active
+        self.limits = limits
+        self.priorities = priorities
+        self.update_interval = update_interval
+        self.edit_limiter = edit_limiter
+        self.default_estimate = default_estimate
+        self._active: Dict[str, int] = {}
+        self._waiting: List[GenerationJob] = []
+        self._sequence = count()
+        self._updater: Optional[asyncio.Task] = None
+
+    @property
+    def active(self) -> int:
+        return sum(self._active.values())
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiting)
+
+    @asynccontextmanager
+    async def slot(self, telegram_id: int, webhook_type: str,
+                   message: Optional[Message] = None) -> AsyncIterator[None]:
+        """
+        Занимает слот генерации на время отправки в n8n и ожидания ответа
+
+        Args:
+            telegram_id: ID пользователя
+            webhook_type: Тип webhook ('osebe', 'post', 'bluebutt', 'anons', 'prodaj')
+            message: Сообщение "обрабатываю" - на время ожидания в нем показывается место в очереди
+        """
+        job = GenerationJob(next(self._sequence), telegram_id, webhook_type,
+                            self.priorities.get(webhook_type, max(self.priorities.values(), default=0) + 1),
+                            message)
+        self._waiting.append(job)
+        self._waiting.sort(key=lambda item: (item.priority, item.sequence))
+        self._admit()
+
+        if job.admitted.is_set():
+            generation_jobs_total.inc(webhook=webhook_type, result='started')
+        else:
+            generation_jobs_total.inc(webhook=webhook_type, result='queued')
+            try:
+                await self._show_position(job)
+                if self._updater is None or self._updater.done():
+                    self._updater = asyncio.create_task(self._update_positions())
+                await job.admitted.wait()
+            except BaseException:
+                if not job.admitted.is_set():
+                    self._waiting.remove(job)
+                    self._update_queued_metrics()
+                    raise
+                # Слот успели выдать - освобождаем его ниже
+                self._release(webhook_type)
+                raise
+            if job.shown:
+                await self._restore(job)
+
+        generation_wait_seconds.observe(time.monotonic() - job.enqueued_at, webhook=webhook_type)
+        try:
+            yield
+        finally:
+            self._release(webhook_type)
+
+    def _has_capacity(self, webhook_type: str) -> bool:
+        limit = self.limits.get(webhook_type)
+        return not limit or self._active.get(webhook_type, 0) < limit
+
+    def _admit(self) -> None:
+        """Запускает ожидающие генерации по приоритету, пока есть слоты"""
+        for job in list(self._waiting):
+            if self.max_active and self.active >= self.max_active:
+                break
+            if not self._has_capacity(job.webhook_type):
+                # Тип занят - следующие по приоритету типы могут идти
+                continue
+            self._waiting.remove(job)
+            self._active[job.webhook_type] = self._active.get(job.webhook_type, 0) + 1
+            generation_active.set(self._active[job.webhook_type], webhook=job.webhook_type)
+            job.admitted.set()
+        self._update_queued_metrics()
+
+    def _release(self, webhook_type: str) -> None:
+        self._active[webhook_type] -= 1
+        generation_active.set(self._active[webhook_type], webhook=webhook_type)
+        self._admit()
+
+    def _update_queued_metrics(self) -> None:
+        counts = {webhook_type: 0 for webhook_type in self._active}
+        for job in self._waiting:
+            counts[job.webhook_type] = counts.get(job.webhook_type, 0) + 1
+        for webhook_type, queued in counts.items():
+            generation_queued.set(queued, webhook=webhook_type)
+
+    def eta(self, job: GenerationJob) -> float:
+        """Оценка ожидания генерации (секунды): очередь того же типа по его слотам и типичной длительности"""
+        ahead = 1
+        for other in self._waiting:
+            if other is job:
+                break
+            if other.webhook_type == job.webhook_type:
+                ahead += 1
+        slots = self.limits.get(job.webhook_type) or self.max_active or 1
+        typical = n8n_guard.latency(job.webhook_type).typical or self.default_estimate
+        return math.ceil(ahead / slots) * typical
+
+    def _queue_text(self, job: GenerationJob) -> str:
+        position = self._waiting.index(job) + 1
+        return messages.GENERATION_QUEUED.format(position=position, eta=format_eta(self.eta(job)))
+
+    async def _show_position(self, job: GenerationJob) -> None:
+        if job.message is None or job.admitted.is_set():
+            return
+        text = self._queue_text(job)
+        if text == job.last_text:
+            return
+        await self.edit_limiter.acquire()
+        if job.admitted.is_set():
+            return
+        job.last_text = text
+        job.last_edit = time.monotonic()
+        if await self._edit(job, text):
+            job.shown = True
+
+    async def _restore(self, job: GenerationJob) -> None:
+        """Возвращает сообщению "обрабатываю" исходный текст"""
+        await self.edit_limiter.acquire()
+        await self._edit(job, job.message.text_html)
+
+    async def _update_positions(self) -> None:
+        """Обновляет место в очереди у ожидающих, пока очередь не опустеет"""
+        while self._waiting:
+            await asyncio.sleep(self.update_interval)
+            now = time.monotonic()
+            for job in list(self._waiting):
+                if job.admitted.is_set() or now - job.last_edit < self.update_interval:
+                    continue
+                await self._show_position(job)
+
+    async def _edit(self, job: GenerationJob, text: str) -> bool:
+        try:
+            await job.message.get_bot().edit_message_text(
+                chat_id=job.message.chat_id, message_id=job.message.message_id,
+                text=text, parse_mode=ParseMode.HTML
+            )
+            return True
+        except BadRequest:
+            # Текст не изменился или сообщение удалено - место в очереди не критично
+            return False
+        except TelegramError as e:
+            bot_logger.warning('SYSTEM', f'Не удалось обновить место в очереди генерации: {str(e)}',
+                               telegram_id=job.telegram_id)
+            return False
+
+
+# Глобальная очередь генераций
+generation_queue = GenerationQueue(
+    max_active=GENERATION_MAX_ACTIVE,
+    limits=parse_type_values(GENERATION_LIMITS),
+    priorities=parse_type_values(GENERATION_PRIORITIES),
+    update_interval=GENERATION_UPDATE_INTERVAL,
+    edit_limiter=TokenBucket(GENERATION_EDIT_RATE),
+    default_estimate=GENERATION_ESTIMATE,
+)
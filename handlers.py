@@ -3,21 +3,33 @@
 """
 import re
 import os
+import time
+from typing import Optional
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ContextTypes
+from telegram.ext import Application, ContextTypes
 from telegram.constants import ParseMode
 
 from database import Database
 from config import (
     UserState, VIDEO_LEARN1, VIDEO_LEARN2, VIDEO_LEARN3, VIDEO_LEARN4, TEMP_FOLDER,
     TOTAL_POSTS, QUESTIONS_PER_POST, MAX_POST_ATTEMPTS,
+    POSTS_PIPELINE_MODE, POSTS_PIPELINE_MAX_TRIES, N8N_BATCH_TIMEOUT,
     VIDEO_LEARN1_FILE_ID, VIDEO_LEARN2_FILE_ID, VIDEO_LEARN3_FILE_ID, VIDEO_LEARN4_FILE_ID,
 )
 from video_helper import send_video_safe
 import messages
 from reminders import schedule_reminders, cancel_reminders
-from openai_helper import transcribe_voice
-from n8n_helper import generate_request_id, send_to_n8n, wait_for_n8n_response
+from transcription import transcriber
+from n8n_helper import (
+    generate_request_id, send_to_n8n, wait_for_n8n_response, wait_for_n8n_batch_response, normalize_batch_response
+)
+from generation_queue import generation_queue
+from conflicts import retry_on_conflict
+from handoff import handoffs, HandedOff, Resume
+from post_pipeline import post_pipeline
+from email_allowlist import email_allowlist
+from admission import admission
+from prompt_templates import prompt_templates
 from publish_handlers import (
     handle_publish_myself, handle_help_publish, process_channel_link,
     check_bot_admin_status, process_blue_answer, process_best_link,
@@ -31,11 +43,16 @@ from publish_handlers import (
 )
 import asyncio
 from logger import bot_logger
+from metrics import metrics
 
 
 # Инициализация базы данных
 db = Database()
 
+state_cache_total = metrics.counter(
+    'user_state_cache_total', 'Чтения состояния пользователя (hit - из user_data, miss - из Supabase)'
+)
+
 
 def sync_user_state(context: ContextTypes.DEFAULT_TYPE, telegram_id: int, state: str) -> None:
     """
@@ -50,6 +67,91 @@ def sync_user_state(context: ContextTypes.DEFAULT_TYPE, telegram_id: int, state:
     context.user_data['state'] = state
 
 
+def cached_user_state(context: ContextTypes.DEFAULT_TYPE, telegram_id: int) -> str:
+    """
+    Возвращает состояние пользователя из user_data, при промахе - из Supabase
+    
+    user_data хранится локально (persistence.py), а каждое изменение состояния
+    через Database попадает в него вместе с версией строки users
+    (install_state_cache). Supabase читается, если состояния с версией нет
+    (первое сообщение пользователя, кеш сброшен конфликтом версий) или оно
+    записано до аварийной остановки - последние изменения могли не сохраниться.
+    
+    Args:
+        context: Контекст бота
+        telegram_id: ID пользователя
+        
+    Returns:
+        Состояние пользователя (UserState.NEW, если его нет в базе)
+    """
+    epoch = context.bot_data.get('state_epoch')
+    if (context.user_data.get('state_version') is not None and context.user_data.get('state')
+            and context.user_data.get('state_epoch') == epoch):
+        state_cache_total.inc(result='hit')
+        return context.user_data['state']
+    
+    state_cache_total.inc(result='miss')
+    user_data = db.get_user_by_telegram_id(telegram_id)
+    if not user_data:
+        context.user_data['state'] = UserState.NEW
+        return UserState.NEW
+    
+    state = user_data.get('state', UserState.NEW)
+    context.user_data['state'] = state
+    context.user_data['state_version'] = user_data.get('version', 0)
+    context.user_data['state_epoch'] = epoch
+    return state
+
+
+def install_state_cache(application: Application) -> None:
+    """
+    Подключает кеш состояния: изменения состояния через Database записываются в user_data
+    
+    Вызывается после application.initialize() (bot_data уже загружен) в
+    event loop бота. Если прошлый запуск не остановился штатно
+    (mark_state_cache_clean), начинается новая эпоха и все сохраненные
+    состояния перечитываются из Supabase. Изменения из рабочих потоков
+    (запросы Database через asyncio.to_thread) переносятся в event loop:
+    user_data и очередь сохранения меняются только из него.
+    
+    Args:
+        application: Приложение бота
+    """
+    if not application.bot_data.pop('state_cache_clean', False) or 'state_epoch' not in application.bot_data:
+        application.bot_data['state_epoch'] = int(time.time())
+    epoch = application.bot_data['state_epoch']
+    loop = asyncio.get_running_loop()
+    
+    def apply_state(telegram_id: int, state: Optional[str], version: Optional[int]) -> None:
+        user_data = application.user_data[telegram_id]
+        if state is None:
+            user_data.pop('state_version', None)
+        else:
+            user_data['state'] = state
+            user_data['state_version'] = version
+            user_data['state_epoch'] = epoch
+        # Изменение может прийти не из обработчика обновления этого пользователя (задачи, webhook)
+        application.mark_data_for_update_persistence(user_ids=telegram_id)
+    
+    def remember_state(telegram_id: int, state: Optional[str], version: Optional[int]) -> None:
+        try:
+            on_loop = asyncio.get_running_loop() is loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            apply_state(telegram_id, state, version)
+        else:
+            # Выполнится раньше, чем ожидающий asyncio.to_thread получит результат
+            loop.call_soon_threadsafe(apply_state, telegram_id, state, version)
+    
+    Database.state_listener = remember_state
+
+
+def mark_state_cache_clean(application: Application) -> None:
+    """Отмечает штатную остановку: сохраненные состояния остаются действительными (до application.stop())"""
+    application.bot_data['state_cache_clean'] = True
+
+
 async def delete_message_safe(context: ContextTypes.DEFAULT_TYPE, chat_id: int, message_id: int) -> bool:
     """
     Безопасно удаляет сообщение (не падает при ошибке)
@@ -161,17 +263,40 @@ async def handle_email(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     # Преобразуем email в нижний регистр
     email = email_input.lower()
     
-    # Проверяем наличие email в базе данных
-    if not db.check_email_exists(email):
+    # Неизвестные email отсекаются фильтром в памяти без запроса к базе
+    if not await email_allowlist.contains(email):
         await update.message.reply_text(
             messages.EMAIL_NOT_FOUND,
             parse_mode=ParseMode.HTML
         )
         return
     
-    # Email найден - регистрируем пользователя
-    db.update_user_telegram_id(email, telegram_id)
-    db.update_user_state(telegram_id, UserState.REGISTERED)
+    # Регистрация идет через контроль допуска: при наплыве пользователь ждет в очереди
+    await admission.submit(
+        context.bot,
+        telegram_id,
+        lambda: register_user(update, context, telegram_id, email)
+    )
+
+
+async def register_user(update: Update, context: ContextTypes.DEFAULT_TYPE, telegram_id: int, email: str) -> None:
+    """
+    Регистрирует пользователя и отправляет первое видео
+    Выполняется после допуска (admission), вне обработчика обновления
+    
+    Args:
+        update: Объект Update с сообщением, содержащим email
+        context: Контекст бота
+        telegram_id: ID пользователя в Telegram
+        email: Email в нижнем регистре
+    """
+    # Находим email и записываем telegram_id и состояние одним запросом
+    if await asyncio.to_thread(db.claim_registration, email, telegram_id, UserState.REGISTERED) is None:
+        await update.message.reply_text(
+            messages.EMAIL_NOT_FOUND,
+            parse_mode=ParseMode.HTML
+        )
+        return
     
     # Отправляем сообщение об успешной регистрации
     success_msg = await update.message.reply_text(
@@ -182,10 +307,21 @@ async def handle_email(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     # Отправляем видео
     await send_video_and_button(update, context, telegram_id)
     
-    # Удаляем временные сообщения (приветствие с запросом email, ответ пользователя, сообщение об успехе)
-    await asyncio.sleep(2)  # Даем пользователю прочитать
-    await delete_message_safe(context, telegram_id, update.message.message_id)  # Сообщение с email
-    await delete_message_safe(context, telegram_id, success_msg.message_id)  # Сообщение об успехе
+    # Удаляем временные сообщения (сообщение с email и об успехе) через 2 секунды, чтобы пользователь
+    # успел прочитать; удаление идет отдельной задачей и не занимает место регистрации
+    context.job_queue.run_once(
+        delete_registration_messages,
+        2,
+        data=[update.message.message_id, success_msg.message_id],
+        chat_id=telegram_id,
+        name=f'registration_cleanup_{telegram_id}'
+    )
+
+
+async def delete_registration_messages(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Удаляет временные сообщения регистрации (callback для job_queue)"""
+    for message_id in context.job.data:
+        await delete_message_safe(context, context.job.chat_id, message_id)
 
 
 async def send_video_and_button(update: Update, context: ContextTypes.DEFAULT_TYPE, telegram_id: int) -> None:
@@ -279,6 +415,14 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         db.update_user_state(telegram_id, UserState.CREATING_POSTS)
         await start_creating_posts(query, context, telegram_id)
     
+    # Обработка кнопки "Ответить на все вопросы сразу"
+    elif query.data == 'write_posts_express':
+        db.update_user_state(telegram_id, UserState.CREATING_POSTS)
+        await start_express_posts(query, context, telegram_id)
+    
+    elif query.data == 'retry_express':
+        await handle_retry_express(query, context, telegram_id)
+    
     # Обработка кнопки "Переписать"
     elif query.data == 'rewrite_post':
         await handle_rewrite_post(query, context, telegram_id)
@@ -287,6 +431,10 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     elif query.data == 'next_post':
         await handle_next_post(query, context, telegram_id)
     
+    # Кнопки "Переписать" и "Попробовать еще раз" у постов из конвейера
+    elif query.data.startswith('pipeline_rewrite_'):
+        await handle_pipeline_rewrite(query, context, telegram_id, int(query.data.rsplit('_', 1)[1]))
+    
     # Обработка кнопок для публикации
     elif query.data == 'publish_myself':
         db.update_user_state(telegram_id, UserState.PUBLISH_MYSELF)
@@ -525,30 +673,53 @@ async def process_help_answer(update: Update, context: ContextTypes.DEFAULT_TYPE
         prompt_template = f"Пользователь рассказал о себе: otvet_osebe\n\nПомоги подобрать для него оптимальные варианты."
     
     # Подставляем ответ пользователя в промпт
-    prompt_text = prompt_template.replace('otvet_osebe', user_answer)
+    prompt_text = prompt_templates.render('prompt_osebe', prompt_template, {'otvet_osebe': user_answer})
     
     # Генерируем уникальный request_id
     request_id = generate_request_id()
     
-    # Отправляем в n8n (prompt_osebe - рассказ о себе)
-    success = send_to_n8n(telegram_id, prompt_text, request_id, 'osebe')
-    
-    if not success:
-        await processing_msg.edit_text(
-            messages.HELP_ERROR_MESSAGE,
-            parse_mode=ParseMode.HTML
+    user_message_id = update.message.message_id
+    async with generation_queue.slot(telegram_id, 'osebe', processing_msg):
+        # Отправляем в n8n (prompt_osebe - рассказ о себе)
+        success = await asyncio.to_thread(send_to_n8n, telegram_id, prompt_text, request_id, 'osebe')
+        
+        if not success:
+            await processing_msg.edit_text(
+                messages.HELP_ERROR_MESSAGE,
+                parse_mode=ParseMode.HTML
+            )
+            # Возвращаем в состояние WAITING_HELP
+            db.update_user_state(telegram_id, UserState.WAITING_HELP)
+            return
+        
+        # Ждем ответ от n8n через webhook
+        n8n_response = await wait_for_n8n_response(
+            telegram_id,
+            request_id,
+            resume=Resume('osebe', processing_msg, user_message_id=user_message_id)
         )
-        # Возвращаем в состояние WAITING_HELP
-        db.update_user_state(telegram_id, UserState.WAITING_HELP)
-        return
     
-    # Ждем ответ от n8n через webhook
-    n8n_response = await wait_for_n8n_response(
-        telegram_id,
-        request_id,
-        180  # 3 минуты
-    )
+    await finish_help_answer(context, telegram_id, n8n_response, processing_msg, user_message_id)
+
+
+@handoffs.resumer('osebe')
+async def finish_help_answer(
+    context: ContextTypes.DEFAULT_TYPE,
+    telegram_id: int,
+    n8n_response: str | None,
+    processing_msg,
+    user_message_id: int
+) -> None:
+    """
+    Показывает варианты помощи по ответу n8n (или ошибку при таймауте)
     
+    Args:
+        context: Контекст бота
+        telegram_id: ID пользователя в Telegram
+        n8n_response: Ответ n8n или None
+        processing_msg: Сообщение "обрабатываю", которое заменяется результатом
+        user_message_id: Сообщение пользователя с рассказом о себе
+    """
     if n8n_response:
         # Получили ответ от n8n
         db.update_user_state(telegram_id, UserState.HELP_COMPLETED)
@@ -560,7 +731,7 @@ async def process_help_answer(update: Update, context: ContextTypes.DEFAULT_TYPE
         )
         
         # Удаляем ответ пользователя (не нужен больше)
-        await delete_message_safe(context, telegram_id, update.message.message_id)
+        await delete_message_safe(context, telegram_id, user_message_id)
         
         # Переходим к следующему этапу
         await send_fill_channel_step(context, telegram_id)
@@ -600,6 +771,10 @@ async def send_fill_channel_step(context: ContextTypes.DEFAULT_TYPE, telegram_id
             messages.BUTTON_WRITE_POSTS,
             callback_data='write_posts'
         )],
+        [InlineKeyboardButton(
+            messages.BUTTON_WRITE_POSTS_EXPRESS,
+            callback_data='write_posts_express'
+        )],
         [InlineKeyboardButton(
             messages.BUTTON_WRITE_MYSELF,
             callback_data='write_myself'
@@ -618,18 +793,19 @@ async def send_fill_channel_step(context: ContextTypes.DEFAULT_TYPE, telegram_id
 async def handle_voice_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Обработчик голосовых сообщений
-    Транскрибирует голос с помощью OpenAI Whisper
+    Транскрибирует голос (бэкенд выбирается по длительности, см. transcription.py)
     """
     user = update.effective_user
     telegram_id = user.id
     
     # Проверяем состояние пользователя
-    user_state = db.get_user_state(telegram_id)
+    user_state = cached_user_state(context, telegram_id)
     
     # Обрабатываем голос только если ждем ответ
     valid_states = [
         UserState.WAITING_HELP_ANSWER,
         UserState.ANSWERING_POST_QUESTIONS,
+        UserState.ANSWERING_EXPRESS_QUESTIONS,
         UserState.ANSWERING_BLUE_QUESTIONS
     ]
     if user_state not in valid_states:
@@ -654,7 +830,7 @@ async def handle_voice_message(update: Update, context: ContextTypes.DEFAULT_TYP
     )
     
     # Транскрибируем голос
-    transcribed_text = transcribe_voice(voice_path)
+    transcribed_text = await transcriber.transcribe(voice_path, voice.duration)
     
     # Удаляем временный файл
     try:
@@ -671,13 +847,10 @@ async def handle_voice_message(update: Update, context: ContextTypes.DEFAULT_TYP
             await process_help_answer(update, context, transcribed_text)
         elif user_state == UserState.ANSWERING_POST_QUESTIONS:
             await process_post_question_answer(update, context, telegram_id, transcribed_text)
+        elif user_state == UserState.ANSWERING_EXPRESS_QUESTIONS:
+            await process_express_answer(update, context, telegram_id, transcribed_text)
         elif user_state == UserState.ANSWERING_BLUE_QUESTIONS:
-            blue_data = db.get_blue_button_data(telegram_id)
-            if blue_data:
-                question_num = len(blue_data.get('blue_answers', {})) + 1
-            else:
-                question_num = 1
-            await process_blue_answer(update, context, telegram_id, transcribed_text, question_num)
+            await process_blue_answer(update, context, telegram_id, transcribed_text)
     else:
         await transcribing_msg.edit_text(
             "❌ Не удалось распознать голосовое сообщение. Попробуйте еще раз или отправьте текстом.",
@@ -693,15 +866,8 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
     user = update.effective_user
     telegram_id = user.id
     
-    # ВСЕГДА загружаем актуальное состояние из БД
-    user_data = db.get_user_by_telegram_id(telegram_id)
-    if user_data:
-        user_state = user_data.get('state', UserState.NEW)
-        # Синхронизируем состояние в контексте
-        context.user_data['state'] = user_state
-    else:
-        user_state = UserState.NEW
-        context.user_data['state'] = user_state
+    # Состояние из локального кеша, Supabase - только при промахе
+    user_state = cached_user_state(context, telegram_id)
     
     # В зависимости от состояния вызываем нужный обработчик
     if user_state in [UserState.NEW, UserState.WAITING_EMAIL]:
@@ -714,6 +880,10 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         # Обрабатываем ответ на вопрос по посту
         user_answer = update.message.text.strip()
         await process_post_question_answer(update, context, telegram_id, user_answer)
+    elif user_state == UserState.ANSWERING_EXPRESS_QUESTIONS:
+        # Обрабатываем ответ в экспресс-режиме
+        user_answer = update.message.text.strip()
+        await process_express_answer(update, context, telegram_id, user_answer)
     elif user_state == UserState.WAITING_CHANNEL_LINK:
         # Обрабатываем ссылку на канал
         channel_link = update.message.text.strip()
@@ -721,22 +891,11 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
     elif user_state == UserState.ANSWERING_BLUE_QUESTIONS:
         # Обрабатываем ответ на вопрос для поста с кнопкой
         user_answer = update.message.text.strip()
-        # Определяем номер вопроса
-        blue_data = db.get_blue_button_data(telegram_id)
-        if blue_data:
-            question_num = len(blue_data.get('blue_answers', {})) + 1
-        else:
-            question_num = 1
-        await process_blue_answer(update, context, telegram_id, user_answer, question_num)
+        await process_blue_answer(update, context, telegram_id, user_answer)
     elif user_state == UserState.REQUESTING_BEST_LINKS:
         # Обрабатываем ссылку на лучший пост
         link = update.message.text.strip()
-        blue_data = db.get_blue_button_data(telegram_id)
-        if blue_data:
-            link_num = len(blue_data.get('best_links', {})) + 1
-        else:
-            link_num = 1
-        await process_best_link(update, context, telegram_id, link, link_num)
+        await process_best_link(update, context, telegram_id, link)
     elif user_state == UserState.WAITING_WEBSITE_LINK:
         # Обрабатываем ссылку на сайт
         link = update.message.text.strip()
@@ -800,6 +959,10 @@ async def start_creating_posts(query, context: ContextTypes.DEFAULT_TYPE, telegr
     """
     Начинает процесс создания 5 постов
     """
+    # Сбрасываем незавершенные фоновые генерации (если пользователь начал заново)
+    post_pipeline.cancel(telegram_id)
+    reset_pipeline(context)
+    
     # Инициализируем прогресс: пост 1, вопрос 1, попытка 1
     db.update_user_post_progress(telegram_id, 1, 1, 1, {})
     
@@ -813,7 +976,13 @@ async def start_creating_posts(query, context: ContextTypes.DEFAULT_TYPE, telegr
     await ask_post_question(context, telegram_id, 1, 1)
 
 
-async def ask_post_question(context: ContextTypes.DEFAULT_TYPE, telegram_id: int, post_num: int, question_num: int) -> None:
+async def ask_post_question(
+    context: ContextTypes.DEFAULT_TYPE,
+    telegram_id: int,
+    post_num: int,
+    question_num: int,
+    state: str = UserState.ANSWERING_POST_QUESTIONS
+) -> None:
     """
     Задает вопрос по посту
     
@@ -822,6 +991,7 @@ async def ask_post_question(context: ContextTypes.DEFAULT_TYPE, telegram_id: int
         telegram_id: ID пользователя
         post_num: Номер поста (1-5)
         question_num: Номер вопроса (1-3)
+        state: Состояние, в котором ожидается ответ
     """
     # Получаем данные поста из БД
     post_data = db.get_post_data(post_num)
@@ -856,7 +1026,7 @@ async def ask_post_question(context: ContextTypes.DEFAULT_TYPE, telegram_id: int
         return
     
     # Обновляем состояние
-    db.update_user_state(telegram_id, UserState.ANSWERING_POST_QUESTIONS)
+    db.update_user_state(telegram_id, state)
     
     # Задаем вопрос
     await context.bot.send_message(
@@ -869,12 +1039,18 @@ async def ask_post_question(context: ContextTypes.DEFAULT_TYPE, telegram_id: int
     )
 
 
+@retry_on_conflict('post_answer')
 async def process_post_question_answer(update: Update, context: ContextTypes.DEFAULT_TYPE, telegram_id: int, answer: str) -> None:
     """
     Обрабатывает ответ на вопрос по посту
+    
+    Ответ записывается с проверкой версии прогресса: если параллельно сохранен
+    другой ответ, шаг повторяется и ответ уходит на следующий вопрос. Последний
+    ответ тем же обновлением переводит пользователя в генерацию поста, поэтому
+    повтор после него не запускает вторую генерацию.
     """
-    # Получаем текущий прогресс
-    progress = db.get_user_post_progress(telegram_id)
+    # Получаем текущий прогресс (ответы нужны только для генерации поста)
+    progress = db.get_user_post_progress(telegram_id, with_answers=False)
     
     if not progress:
         await update.message.reply_text(
@@ -883,30 +1059,299 @@ async def process_post_question_answer(update: Update, context: ContextTypes.DEF
         )
         return
     
+    if progress.get('state') != UserState.ANSWERING_POST_QUESTIONS:
+        # Параллельный апдейт уже записал последний ответ и запустил генерацию
+        bot_logger.info('POSTS', 'Ответ пришел после последнего вопроса, пост уже генерируется',
+                        telegram_id=telegram_id, state=progress.get('state'))
+        return
+    
     current_post = progress['current_post_number']
     current_question = progress['current_question_number']
     attempt = progress['post_attempt']
-    answers = progress['post_answers']
+    version = progress['version']
     
-    # Сохраняем ответ
+    # Сохраняем ответ (добавляется на сервере, карта ответов не перезаписывается)
     answer_key = f'answer_{current_question}'
-    answers[answer_key] = answer
     
     # Если это был последний вопрос - генерируем пост
     if current_question >= QUESTIONS_PER_POST:
         # Обновляем прогресс перед генерацией
-        db.update_user_post_progress(telegram_id, current_post, current_question, attempt, answers)
+        db.save_post_answer(telegram_id, [answer_key], answer, current_post, current_question, attempt, version,
+                            state=UserState.PROCESSING_POST)
+        answers = db.get_post_answers(telegram_id)
+        answers[answer_key] = answer
         
-        # Генерируем пост
-        await generate_post_with_n8n(update, context, telegram_id, current_post, attempt, answers)
+        # Генерируем пост (в конвейерном режиме - в фоне, не дожидаясь ответа)
+        if POSTS_PIPELINE_MODE:
+            await submit_post_to_pipeline(update, context, telegram_id, current_post, answers)
+        else:
+            await generate_post_with_n8n(update, context, telegram_id, current_post, attempt, answers)
     else:
         # Переходим к следующему вопросу
         next_question = current_question + 1
-        db.update_user_post_progress(telegram_id, current_post, next_question, attempt, answers)
+        db.save_post_answer(telegram_id, [answer_key], answer, current_post, next_question, attempt, version)
         
         await ask_post_question(context, telegram_id, current_post, next_question)
 
 
+def render_post_prompt(prompt_template: str, answers: dict) -> str:
+    """
+    Подставляет ответы пользователя в промпт поста
+    
+    Args:
+        prompt_template: Промпт из таблицы posts (с плейсхолдерами vopros_1..3 или {{vopros_1}}..)
+        answers: Ответы пользователя (answer_1..3)
+        
+    Returns:
+        Готовый текст промпта
+    """
+    values = {f'vopros_{i}': answers.get(f'answer_{i}', '') for i in range(1, QUESTIONS_PER_POST + 1)}
+    return prompt_templates.render('prompt_post', prompt_template, values)
+
+
+async def request_post_generation(telegram_id: int, prompt_text: str, resume: Resume | None = None) -> str | None:
+    """
+    Отправляет промпт поста в n8n и ждет ответ, не блокируя event loop
+    
+    Args:
+        telegram_id: ID пользователя
+        prompt_text: Готовый промпт
+        resume: Продолжение, если бот остановится раньше ответа
+        
+    Returns:
+        Текст поста или None при ошибке/таймауте
+    """
+    for _ in range(POSTS_PIPELINE_MAX_TRIES):
+        request_id = generate_request_id()
+        # Место в очереди не показываем: пользователь в это время отвечает на вопросы следующего поста
+        async with generation_queue.slot(telegram_id, 'post'):
+            success = await asyncio.to_thread(send_to_n8n, telegram_id, prompt_text, request_id, 'post')
+            if not success:
+                continue
+            
+            n8n_response = await wait_for_n8n_response(telegram_id, request_id, resume=resume)
+        if n8n_response:
+            return n8n_response
+    
+    return None
+
+
+async def submit_post_to_pipeline(update: Update, context: ContextTypes.DEFAULT_TYPE, telegram_id: int, post_num: int, answers: dict) -> None:
+    """
+    Ставит пост в фоновую генерацию и сразу переходит к вопросам следующего поста
+    """
+    post_data = db.get_post_data(post_num)
+    
+    if not post_data:
+        await update.message.reply_text(
+            messages.POST_ERROR_MESSAGE,
+            parse_mode=ParseMode.HTML
+        )
+        # Возвращаемся к первому вопросу
+        db.update_user_post_progress(telegram_id, post_num, 1, 1, {})
+        await ask_post_question(context, telegram_id, post_num, 1)
+        return
+    
+    prompt_text = render_post_prompt(post_data.get('prompt_post', ''), answers)
+    # Ответы в базе сбрасываются при переходе к следующему посту - для кнопки
+    # "Переписать" сохраняем готовый промпт
+    context.user_data.setdefault('pipeline_prompts', {})[str(post_num)] = prompt_text
+    context.user_data.setdefault('pipeline_attempts', {})[str(post_num)] = 1
+    context.user_data.setdefault('pipeline_results', {})[str(post_num)] = 'pending'
+    
+    # Это сообщение будет заменено готовым постом
+    status_msg = await update.message.reply_text(
+        messages.POST_PIPELINE_QUEUED_MESSAGE.format(post_number=post_num),
+        parse_mode=ParseMode.HTML
+    )
+    
+    async def generate() -> str | None:
+        return await request_post_generation(
+            telegram_id, prompt_text, Resume('pipeline_post', status_msg, post_num=post_num)
+        )
+    
+    async def deliver(number: int, post_text: str | None) -> None:
+        await deliver_pipelined_post(context, telegram_id, number, post_text, status_msg)
+    
+    post_pipeline.submit(telegram_id, post_num, generate, deliver)
+    
+    if post_num < TOTAL_POSTS:
+        # Не дожидаясь генерации, задаем вопросы следующего поста
+        next_post = post_num + 1
+        db.update_user_post_progress(telegram_id, next_post, 1, 1, {})
+        await ask_post_question(context, telegram_id, next_post, 1)
+    else:
+        # Ответы на все посты собраны - ждем оставшиеся генерации
+        db.update_user_state(telegram_id, UserState.PROCESSING_POST)
+        await context.bot.send_message(
+            chat_id=telegram_id,
+            text=messages.POST_PIPELINE_WAITING_MESSAGE,
+            parse_mode=ParseMode.HTML
+        )
+
+
+@handoffs.resumer('pipeline_post')
+async def resume_pipelined_post(context: ContextTypes.DEFAULT_TYPE, telegram_id: int, post_text: str | None, status_msg, post_num: int) -> None:
+    """
+    Показывает пост из конвейера, ожидание которого передано при перезапуске
+    (посты, готовые до остановки, прошлый запуск доставил сам)
+    """
+    await deliver_pipelined_post(context, telegram_id, post_num, post_text, status_msg)
+
+
+async def deliver_pipelined_post(context: ContextTypes.DEFAULT_TYPE, telegram_id: int, post_num: int, post_text: str | None, status_msg) -> None:
+    """
+    Показывает пост из конвейера (вызывается строго по порядку номеров)
+    """
+    await show_pipelined_post(context, telegram_id, post_num, post_text, status_msg, attempt=1)
+
+
+def reset_pipeline(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Забывает промпты, попытки и результаты постов конвейера (блок завершен или начат заново)"""
+    for key in ('pipeline_prompts', 'pipeline_attempts', 'pipeline_results'):
+        context.user_data.pop(key, None)
+
+
+async def finish_pipeline_block(context: ContextTypes.DEFAULT_TYPE, telegram_id: int) -> None:
+    """
+    Завершает блок из 5 постов, когда все посты конвейера готовы
+    
+    Пока собраны не все ответы или какой-то пост генерируется (в том числе
+    переписывается), ничего не делает. Если остались неудачные посты с
+    попытками, просит повторить их. Пост, не созданный и после
+    MAX_POST_ATTEMPTS попыток, блок не задерживает.
+    """
+    results = context.user_data.get('pipeline_results', {})
+    if len(results) < TOTAL_POSTS or 'pending' in results.values():
+        return
+    
+    attempts = context.user_data.get('pipeline_attempts', {})
+    retryable = sorted(
+        int(number) for number, result in results.items()
+        if result == 'failed' and attempts.get(number, 1) < MAX_POST_ATTEMPTS
+    )
+    if retryable:
+        await context.bot.send_message(
+            chat_id=telegram_id,
+            text=messages.POST_PIPELINE_RETRY_FAILED_MESSAGE.format(
+                post_numbers=', '.join(f'#{number}' for number in retryable)
+            ),
+            parse_mode=ParseMode.HTML
+        )
+        return
+    
+    # Сбрасываем до первого await: второй вызов (доставка и переписывание одновременно) блок не завершит
+    reset_pipeline(context)
+    db.update_user_state(telegram_id, UserState.ALL_POSTS_COMPLETED)
+    bot_logger.all_posts_completed(telegram_id)
+    await context.bot.send_message(
+        chat_id=telegram_id,
+        text=messages.ALL_POSTS_COMPLETED_MESSAGE,
+        parse_mode=ParseMode.HTML
+    )
+    await start_publish_intro_post(context, telegram_id)
+
+
+async def show_pipelined_post(
+    context: ContextTypes.DEFAULT_TYPE,
+    telegram_id: int,
+    post_num: int,
+    post_text: str | None,
+    status_msg,
+    attempt: int
+) -> None:
+    """
+    Показывает результат генерации поста из конвейера с кнопкой переписать или повторить
+    
+    Результат запоминается в user_data; когда готовы все посты, блок завершается.
+    
+    Args:
+        context: Контекст бота
+        telegram_id: ID пользователя в Telegram
+        post_num: Номер поста
+        post_text: Текст поста или None при ошибке
+        status_msg: Сообщение поста, которое заменяется результатом
+        attempt: Номер попытки (после MAX_POST_ATTEMPTS пост не переписывается и не повторяется)
+    """
+    callback_data = f'pipeline_rewrite_{post_num}'
+    keyboard = InlineKeyboardMarkup([[
+        InlineKeyboardButton(messages.BUTTON_REWRITE_POST if post_text else messages.BUTTON_RETRY_POST,
+                             callback_data=callback_data)
+    ]]) if attempt < MAX_POST_ATTEMPTS else None
+    # Блок уже завершен (или начат заново) - результат только показываем
+    results = context.user_data.get('pipeline_results')
+    if results is not None and str(post_num) in results:
+        results[str(post_num)] = 'ready' if post_text else 'failed'
+    
+    if post_text:
+        bot_logger.post_generated(telegram_id, post_num, len(post_text))
+        await status_msg.edit_text(
+            messages.POST_PIPELINE_RESULT_MESSAGE.format(post_number=post_num, post_text=post_text),
+            reply_markup=keyboard,
+            parse_mode=ParseMode.HTML
+        )
+    else:
+        await status_msg.edit_text(
+            (messages.POST_PIPELINE_ERROR_MESSAGE if keyboard else messages.POST_PIPELINE_FAILED_MESSAGE).format(
+                post_number=post_num
+            ),
+            reply_markup=keyboard,
+            parse_mode=ParseMode.HTML
+        )
+    
+    await finish_pipeline_block(context, telegram_id)
+
+
+async def handle_pipeline_rewrite(query, context: ContextTypes.DEFAULT_TYPE, telegram_id: int, post_num: int) -> None:
+    """
+    Переписывает пост из конвейера по тем же ответам (или повторяет неудачную генерацию)
+    
+    Генерация идет в фоне: пользователь в это время может отвечать на вопросы
+    следующих постов, состояние не меняется.
+    """
+    prompt_text = context.user_data.get('pipeline_prompts', {}).get(str(post_num))
+    if not prompt_text:
+        await query.edit_message_reply_markup(reply_markup=None)
+        await context.bot.send_message(chat_id=telegram_id, text=messages.POST_PIPELINE_REWRITE_UNAVAILABLE)
+        return
+    
+    attempts = context.user_data.setdefault('pipeline_attempts', {})
+    attempt = attempts.get(str(post_num), 1) + 1
+    if attempt > MAX_POST_ATTEMPTS:
+        await query.edit_message_reply_markup(reply_markup=None)
+        await context.bot.send_message(chat_id=telegram_id, text=messages.POST_PIPELINE_REWRITE_UNAVAILABLE)
+        return
+    attempts[str(post_num)] = attempt
+    context.user_data.setdefault('pipeline_results', {})[str(post_num)] = 'pending'
+    
+    status_msg = query.message
+    await query.edit_message_text(
+        messages.POST_PIPELINE_REWRITING_MESSAGE.format(post_number=post_num),
+        parse_mode=ParseMode.HTML
+    )
+    bot_logger.info('POSTS', f'Пост {post_num} из конвейера переписывается', telegram_id=telegram_id, attempt=attempt)
+    
+    async def rewrite() -> None:
+        try:
+            post_text = await request_post_generation(
+                telegram_id, prompt_text,
+                Resume('pipeline_rewrite', status_msg, post_num=post_num, attempt=attempt)
+            )
+        except HandedOff:
+            # Результат покажет следующий запуск
+            return
+        await show_pipelined_post(context, telegram_id, post_num, post_text, status_msg, attempt)
+    
+    # Задачи application.create_task дожидаются при остановке бота
+    context.application.create_task(rewrite(), update=query)
+
+
+@handoffs.resumer('pipeline_rewrite')
+async def resume_pipeline_rewrite(context: ContextTypes.DEFAULT_TYPE, telegram_id: int, post_text: str | None, status_msg, post_num: int, attempt: int) -> None:
+    """Показывает переписанный пост из конвейера, ожидание которого передано при перезапуске"""
+    await show_pipelined_post(context, telegram_id, post_num, post_text, status_msg, attempt)
+
+
 async def generate_post_with_n8n(update: Update, context: ContextTypes.DEFAULT_TYPE, telegram_id: int, post_num: int, attempt: int, answers: dict) -> None:
     """
     Генерирует пост через n8n на основе ответов
@@ -936,38 +1381,52 @@ async def generate_post_with_n8n(update: Update, context: ContextTypes.DEFAULT_T
     prompt_template = post_data.get('prompt_post', '')
     
     # Подставляем ответы в промпт
-    prompt_text = prompt_template
-    for i in range(1, QUESTIONS_PER_POST + 1):
-        answer_key = f'answer_{i}'
-        answer_value = answers.get(answer_key, '')
-        prompt_text = prompt_text.replace(f'vopros_{i}', answer_value)
+    prompt_text = render_post_prompt(prompt_template, answers)
     
     # Генерируем уникальный request_id
     request_id = generate_request_id()
     
-    # Отправляем в n8n (prompt_post - создание постов)
-    success = send_to_n8n(telegram_id, prompt_text, request_id, 'post')
-    
-    if not success:
-        await processing_msg.edit_text(
-            messages.POST_ERROR_MESSAGE,
-            parse_mode=ParseMode.HTML
+    user_message_id = update.message.message_id
+    async with generation_queue.slot(telegram_id, 'post', processing_msg):
+        # Отправляем в n8n (prompt_post - создание постов)
+        success = await asyncio.to_thread(send_to_n8n, telegram_id, prompt_text, request_id, 'post')
+        
+        if not success:
+            await processing_msg.edit_text(
+                messages.POST_ERROR_MESSAGE,
+                parse_mode=ParseMode.HTML
+            )
+            # Возвращаемся к первому вопросу
+            db.update_user_post_progress(telegram_id, post_num, 1, attempt, {})
+            await ask_post_question(context, telegram_id, post_num, 1)
+            return
+        
+        # Ждем ответ от n8n через webhook
+        n8n_response = await wait_for_n8n_response(
+            telegram_id,
+            request_id,
+            resume=Resume('post', processing_msg, post_num=post_num, attempt=attempt, user_message_id=user_message_id)
         )
-        # Возвращаемся к первому вопросу
-        db.update_user_post_progress(telegram_id, post_num, 1, attempt, {})
-        await ask_post_question(context, telegram_id, post_num, 1)
-        return
-    
-    # Ждем ответ от n8n через webhook
-    n8n_response = await wait_for_n8n_response(
-        telegram_id,
-        request_id,
-        180  # 3 минуты
-    )
     
+    await finish_post_generation(context, telegram_id, n8n_response, processing_msg, post_num, attempt, user_message_id)
+
+
+@handoffs.resumer('post')
+async def finish_post_generation(
+    context: ContextTypes.DEFAULT_TYPE,
+    telegram_id: int,
+    n8n_response: str | None,
+    processing_msg,
+    post_num: int,
+    attempt: int,
+    user_message_id: int
+) -> None:
+    """
+    Показывает сгенерированный пост или возвращает к вопросам при таймауте
+    """
     if n8n_response:
         # Удаляем ответ пользователя (не нужен больше)
-        await delete_message_safe(context, telegram_id, update.message.message_id)
+        await delete_message_safe(context, telegram_id, user_message_id)
         
         # Показываем результат
         await show_post_result(context, telegram_id, post_num, attempt, n8n_response, processing_msg)
@@ -1033,7 +1492,7 @@ async def handle_rewrite_post(query, context: ContextTypes.DEFAULT_TYPE, telegra
     Обрабатывает переписывание поста
     """
     # Получаем прогресс
-    progress = db.get_user_post_progress(telegram_id)
+    progress = db.get_user_post_progress(telegram_id, with_answers=False)
     
     if not progress:
         await query.edit_message_text(
@@ -1065,7 +1524,7 @@ async def handle_next_post(query, context: ContextTypes.DEFAULT_TYPE, telegram_i
     Обрабатывает переход к следующему посту
     """
     # Получаем прогресс
-    progress = db.get_user_post_progress(telegram_id)
+    progress = db.get_user_post_progress(telegram_id, with_answers=False)
     
     if not progress:
         await query.edit_message_text(
@@ -1101,6 +1560,210 @@ async def handle_next_post(query, context: ContextTypes.DEFAULT_TYPE, telegram_i
         await ask_post_question(context, telegram_id, next_post, 1)
 
 
+# ============================================
+# ЭКСПРЕСС-РЕЖИМ: ВСЕ 5 ПОСТОВ ОДНИМ ЗАПРОСОМ
+# ============================================
+
+async def start_express_posts(query, context: ContextTypes.DEFAULT_TYPE, telegram_id: int) -> None:
+    """
+    Начинает экспресс-режим: сначала все вопросы, затем один пакетный запрос в n8n
+    """
+    post_pipeline.cancel(telegram_id)
+    reset_pipeline(context)
+    
+    # Ответы хранятся по постам: {"post_1": {"answer_1": ...}, ...}
+    db.update_user_post_progress(telegram_id, 1, 1, 1, {})
+    
+    await query.edit_message_text(
+        messages.START_EXPRESS_POSTS_MESSAGE,
+        parse_mode=ParseMode.HTML
+    )
+    
+    await ask_post_question(context, telegram_id, 1, 1, UserState.ANSWERING_EXPRESS_QUESTIONS)
+
+
+@retry_on_conflict('express_answer')
+async def process_express_answer(update: Update, context: ContextTypes.DEFAULT_TYPE, telegram_id: int, answer: str) -> None:
+    """
+    Обрабатывает ответ в экспресс-режиме и задает следующий вопрос
+    (последний ответ тем же обновлением переводит пользователя в генерацию)
+    """
+    progress = db.get_user_post_progress(telegram_id, with_answers=False)
+    
+    if not progress:
+        await update.message.reply_text(
+            "❌ Ошибка: прогресс не найден",
+            parse_mode=ParseMode.HTML
+        )
+        return
+    
+    if progress.get('state') != UserState.ANSWERING_EXPRESS_QUESTIONS:
+        # Параллельный апдейт уже записал последний ответ и запустил генерацию
+        bot_logger.info('POSTS', 'Ответ пришел после последнего вопроса, посты уже генерируются',
+                        telegram_id=telegram_id, state=progress.get('state'))
+        return
+    
+    current_post = progress['current_post_number']
+    current_question = progress['current_question_number']
+    version = progress['version']
+    
+    # Сохраняем ответ в блок текущего поста
+    path = [f'post_{current_post}', f'answer_{current_question}']
+    
+    if current_question < QUESTIONS_PER_POST:
+        next_post, next_question = current_post, current_question + 1
+    else:
+        next_post, next_question = current_post + 1, 1
+    
+    if next_post > TOTAL_POSTS:
+        # Все 15 ответов собраны - генерируем посты одним запросом
+        db.save_post_answer(telegram_id, path, answer, current_post, current_question, 1, version,
+                            state=UserState.PROCESSING_EXPRESS_POSTS)
+        # Ответы загружаются один раз - для генерации
+        answers = db.get_post_answers(telegram_id)
+        answers.setdefault(path[0], {})[path[1]] = answer
+        await generate_express_posts(context, telegram_id, answers)
+    else:
+        db.save_post_answer(telegram_id, path, answer, next_post, next_question, 1, version)
+        await ask_post_question(context, telegram_id, next_post, next_question, UserState.ANSWERING_EXPRESS_QUESTIONS)
+
+
+async def generate_express_posts(context: ContextTypes.DEFAULT_TYPE, telegram_id: int, answers: dict) -> None:
+    """
+    Отправляет промпты всех постов в n8n одним пакетным запросом и показывает результаты
+    """
+    db.update_user_state(telegram_id, UserState.PROCESSING_EXPRESS_POSTS)
+    
+    processing_msg = await context.bot.send_message(
+        chat_id=telegram_id,
+        text=messages.PROCESSING_EXPRESS_POSTS_MESSAGE,
+        parse_mode=ParseMode.HTML
+    )
+    
+    retry_keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton(messages.BUTTON_RETRY_EXPRESS, callback_data='retry_express')]
+    ])
+    
+    # Рендерим промпты всех постов (данные постов - одним запросом к БД)
+    posts = {post['post_number']: post for post in db.get_all_posts()}
+    batch = []
+    for post_num in range(1, TOTAL_POSTS + 1):
+        post_data = posts.get(post_num)
+        if not post_data:
+            continue
+        prompt_text = render_post_prompt(post_data.get('prompt_post', ''), answers.get(f'post_{post_num}', {}))
+        batch.append({"post_number": post_num, "text": prompt_text})
+    
+    if not batch:
+        await processing_msg.edit_text(
+            messages.EXPRESS_POSTS_ERROR_MESSAGE,
+            reply_markup=retry_keyboard,
+            parse_mode=ParseMode.HTML
+        )
+        return
+    
+    request_id = generate_request_id()
+    
+    # Один запрос вместо пяти: n8n может генерировать посты параллельно
+    combined_text = '\n\n'.join(item['text'] for item in batch)
+    post_numbers = [item['post_number'] for item in batch]
+    results = None
+    async with generation_queue.slot(telegram_id, 'post', processing_msg):
+        success = await asyncio.to_thread(
+            send_to_n8n, telegram_id, combined_text, request_id, 'post',
+            {"batch": batch, "batch_size": len(batch)}
+        )
+        
+        if success:
+            results = await wait_for_n8n_batch_response(
+                telegram_id, request_id, N8N_BATCH_TIMEOUT,
+                resume=Resume('express_posts', processing_msg, post_numbers=post_numbers)
+            )
+    
+    await finish_express_posts(context, telegram_id, results, processing_msg, post_numbers)
+
+
+@handoffs.resumer('express_posts')
+async def resume_express_posts(context: ContextTypes.DEFAULT_TYPE, telegram_id: int, results, processing_msg, post_numbers: list) -> None:
+    """
+    Показывает пакет постов, ожидание которого передано при перезапуске
+    (ключи частей после JSON - строки)
+    """
+    parts = normalize_batch_response(results) if results else None
+    await finish_express_posts(context, telegram_id, parts, processing_msg, post_numbers)
+
+
+async def finish_express_posts(
+    context: ContextTypes.DEFAULT_TYPE,
+    telegram_id: int,
+    results: dict | None,
+    processing_msg,
+    post_numbers: list
+) -> None:
+    """
+    Показывает посты из пакетного ответа n8n или кнопку повтора при ошибке
+    
+    Args:
+        context: Контекст бота
+        telegram_id: ID пользователя в Telegram
+        results: Словарь {номер поста: текст} или None
+        processing_msg: Сообщение "генерирую", которое заменяется результатом
+        post_numbers: Номера постов в пакете
+    """
+    if not results:
+        retry_keyboard = InlineKeyboardMarkup([
+            [InlineKeyboardButton(messages.BUTTON_RETRY_EXPRESS, callback_data='retry_express')]
+        ])
+        await processing_msg.edit_text(
+            messages.EXPRESS_POSTS_ERROR_MESSAGE,
+            reply_markup=retry_keyboard,
+            parse_mode=ParseMode.HTML
+        )
+        return
+    
+    await delete_message_safe(context, telegram_id, processing_msg.message_id)
+    
+    # Показываем посты по порядку (отсутствующие части - как ошибку)
+    for post_num in post_numbers:
+        post_text = results.get(post_num)
+        if post_text:
+            bot_logger.post_generated(telegram_id, post_num, len(post_text))
+            text = messages.POST_PIPELINE_RESULT_MESSAGE.format(post_number=post_num, post_text=post_text)
+        else:
+            text = messages.POST_PIPELINE_ERROR_MESSAGE.format(post_number=post_num)
+        await context.bot.send_message(
+            chat_id=telegram_id,
+            text=text,
+            parse_mode=ParseMode.HTML
+        )
+    
+    db.update_user_state(telegram_id, UserState.ALL_POSTS_COMPLETED)
+    bot_logger.all_posts_completed(telegram_id)
+    await context.bot.send_message(
+        chat_id=telegram_id,
+        text=messages.ALL_POSTS_COMPLETED_MESSAGE,
+        parse_mode=ParseMode.HTML
+    )
+    await start_publish_intro_post(context, telegram_id)
+
+
+async def handle_retry_express(query, context: ContextTypes.DEFAULT_TYPE, telegram_id: int) -> None:
+    """
+    Повторяет пакетную генерацию по сохраненным ответам
+    """
+    progress = db.get_user_post_progress(telegram_id)
+    
+    if not progress or not progress.get('post_answers'):
+        await query.edit_message_text(
+            "❌ Ошибка: прогресс не найден",
+            parse_mode=ParseMode.HTML
+        )
+        return
+    
+    await delete_message_safe(context, telegram_id, query.message.message_id)
+    await generate_express_posts(context, telegram_id, progress['post_answers'])
+
+
 # ============================================
 # ФУНКЦИИ ДЛЯ ПУБЛИКАЦИИ ПОСТА-ЗНАКОМСТВА
 # ============================================
@@ -0,0 +1,340 @@
+"""
+Остановка без потери шагов пользователей (SIGTERM) и передача ожиданий следующему запуску
+
+При обновлении бота контейнер получает SIGTERM. Вместо немедленной
+остановки бот:
+  1. перестает получать новые обновления (они остаются в Telegram и
+     достанутся следующему запуску);
+  2. до DRAIN_TIMEOUT секунд ждет, пока завершатся начатые ожидания
+     ответов n8n и начатые регистрации (admission); короткие обработчики
+     (отправка сообщений, видео, паузы финального шага) дорабатывают при
+     остановке приложения;
+  3. оставшиеся ожидания n8n сохраняет в таблицу handoffs: request_id,
+     пользователь, сообщение "обрабатываю" и что сделать с ответом;
+  4. пишет отчет: сколько ожиданий завершилось, сколько передано и каких.
+
+Следующий запуск (resume_all) подхватывает записи: ответ n8n, пришедший
+на любой из запусков после передачи, доставляется пользователю так же,
+как без перезапуска, а по истечении исходного таймаута срабатывает
+обычная ветка таймаута.
+"""
+import asyncio
+import socket
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from telegram import Message
+from telegram.ext import Application
+
+from admission import admission
+from config import DRAIN_TIMEOUT
+from database import Database
+from logger import bot_logger
+from metrics import metrics
+
+# Инициализация базы данных
+db = Database()
+
+# Имя запуска (в Docker - ID контейнера) для записей handoffs
+INSTANCE = socket.gethostname()
+
+handoffs_total = metrics.counter(
+    'handoffs_total', 'Ожидания n8n при остановке и перезапуске (completed, handed_off, lost, resumed, expired)'
+)
+
+# Продолжение шага: (контекст, telegram_id, ответ n8n или None при таймауте, сообщение "обрабатываю", параметры)
+Resumer = Callable[..., Awaitable[None]]
+
+
+class HandedOff(Exception):
+    """Ожидание ответа n8n передано следующему запуску - обработчик должен завершиться без ответа пользователю"""
+
+
+class Resume:
+    """Как продолжить шаг пользователя, если ожидание ответа n8n будет передано следующему запуску"""
+
+    def __init__(self, name: str, message: Optional[Message] = None, **params: Any):
+        """
+        Args:
+            name: Имя продолжения (регистрируется через handoffs.resumer)
+            message: Сообщение "обрабатываю", которое заменяется результатом
+            params: JSON-совместимые параметры продолжения (номер поста, попытка и т.п.)
+        """
+        self.name = name
+        self.message = message
+        self.params = params
+
+
+class InFlightWait:
+    """Ожидание ответа n8n, которое можно передать следующему запуску"""
+
+    def __init__(self, telegram_id: int, request_id: str, timeout: float, resume: Resume, task: asyncio.Future):
+        self.telegram_id = telegram_id
+        self.request_id = request_id
+        self.resume = resume
+        self.task = task
+        self.expires_at = datetime.utcnow() + timedelta(seconds=timeout)
+        self.handed_off = False
+
+
+class HandoffManager:
+    """Остановка с ожиданием, передача ожиданий n8n и их продолжение после перезапуска"""
+
+    def __init__(self, drain_timeout: float):
+        """
+        Args:
+            drain_timeout: Сколько ждать завершения ожиданий n8n при остановке (секунды)
+        """
+        self.drain_timeout = drain_timeout
+        self.draining = False
+        self._past_deadline = False
+        self._completed_while_draining = 0
+        self._resumers: Dict[str, Resumer] = {}
+        self._waits: Dict[str, InFlightWait] = {}
+        self._idle = asyncio.Event()
+        self._resumed: Dict[str, Dict[str, Any]] = {}
+        self._application: Optional[Application] = None
+        self._tasks: set = set()
+
+    def resumer(self, name: str) -> Callable[[Resumer], Resumer]:
+        """Декоратор: регистрирует продолжение шага под именем name"""
+        def register(func: Resumer) -> Resumer:
+            self._resumers[name] = func
+            return func
+        return register
+
+    # ------------------------------------------------------------------
+    # Ожидания текущего запуска
+    # ------------------------------------------------------------------
+
+    async def wait(
+        self,
+        telegram_id: int,
+        request_id: str,
+        timeout: float,
+        waiter: Awaitable[Any],
+        resume: Optional[Resume] = None
+    ) -> Any:
+        """
+        Ждет ответ n8n; при остановке бота передает ожидание следующему запуску
+
+        Args:
+            telegram_id: ID пользователя
+            request_id: ID запроса n8n
+            timeout: Таймаут ожидания (секунды)
+            waiter: Корутина ожидания ответа
+            resume: Как продолжить шаг в следующем запуске (без него ожидание не передается)
+
+        Returns:
+            Результат waiter
+
+        Raises:
+            HandedOff: ожидание передано следующему запуску
+        """
+        task = asyncio.ensure_future(waiter)
+        if resume is None:
+            return await task
+
+        entry = InFlightWait(telegram_id, request_id, timeout, resume, task)
+        self._waits[request_id] = entry
+        try:
+            if self._past_deadline:
+                # Обработчик дошел до запроса в n8n уже после передачи остальных ожиданий
+                await self._hand_off([entry])
+            return await task
+        except asyncio.CancelledError:
+            if entry.handed_off:
+                raise HandedOff(request_id)
+            raise
+        finally:
+            self._waits.pop(request_id, None)
+            if self.draining and not entry.handed_off:
+                self._completed_while_draining += 1
+            if not self._waits:
+                self._idle.set()
+
+    async def drain(self, application: Application) -> Dict[str, Any]:
+        """
+        Останавливает прием обновлений, ждет ожидания n8n и передает оставшиеся
+
+        Args:
+            application: Приложение бота
+
+        Returns:
+            Отчет: completed (завершились при остановке), handed_off (передано по видам),
+            lost (не удалось сохранить), requeued (подхваченные и не завершенные),
+            registrations (итог начатых регистраций), seconds
+        """
+        self.draining = True
+        started = time.monotonic()
+        if application.updater and application.updater.running:
+            await application.updater.stop()
+        registrations = asyncio.create_task(admission.drain(self.drain_timeout))
+
+        if self._waits:
+            self._idle.clear()
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout=self.drain_timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        self._past_deadline = True
+        remaining = list(self._waits.values())
+        saved = await self._hand_off(remaining) if remaining else True
+        requeued = await self._requeue_resumed()
+        registrations = await registrations
+
+        report = {
+            'completed': self._completed_while_draining,
+            'handed_off': dict(Counter(entry.resume.name for entry in remaining)) if saved else {},
+            'lost': 0 if saved else len(remaining),
+            'requeued': requeued,
+            'registrations': registrations,
+            'seconds': round(time.monotonic() - started, 1),
+        }
+        handoffs_total.inc(report['completed'], result='completed')
+        bot_logger.info('SYSTEM', 'Остановка: ожидания n8n завершены или переданы', **report)
+        return report
+
+    async def _hand_off(self, entries: List[InFlightWait]) -> bool:
+        """Сохраняет ожидания в handoffs и прерывает их"""
+        records = [{
+            "request_id": entry.request_id,
+            "telegram_id": entry.telegram_id,
+            "resume": entry.resume.name,
+            "message": entry.resume.message.to_dict() if entry.resume.message else None,
+            "params": entry.resume.params,
+            "expires_at": entry.expires_at.isoformat(),
+            "handed_off_by": INSTANCE,
+        } for entry in entries]
+        saved = await asyncio.to_thread(db.create_handoffs, records)
+        for entry in entries:
+            # Обработчик прерывается в любом случае: иначе остановка ждала бы полный таймаут n8n
+            entry.handed_off = True
+            entry.task.cancel()
+            handoffs_total.inc(result='handed_off' if saved else 'lost')
+            if not saved:
+                bot_logger.error('SYSTEM', 'Ожидание n8n прервано остановкой и не передано',
+                                 telegram_id=entry.telegram_id, request_id=entry.request_id)
+        return saved
+
+    async def _requeue_resumed(self) -> int:
+        """Возвращает в pending ожидания, подхваченные этим запуском и еще не завершенные"""
+        if not self._resumed:
+            return 0
+        ids = [record['id'] for record in self._resumed.values()]
+        if await asyncio.to_thread(db.update_handoffs, ids, {"status": "pending", "handed_off_by": INSTANCE}):
+            self._resumed.clear()
+            return len(ids)
+        return 0
+
+    # ------------------------------------------------------------------
+    # Ожидания, переданные прошлым запуском
+    # ------------------------------------------------------------------
+
+    async def deliver(self, request_id: str, response: Any) -> bool:
+        """
+        Доставляет ответ n8n, которого не ждет ни один обработчик
+
+        Args:
+            request_id: ID запроса
+            response: Текст ответа или словарь частей пакетного ответа
+
+        Returns:
+            True если ответ относится к переданному ожиданию
+        """
+        record = self._resumed.pop(request_id, None)
+        if record is not None:
+            self._spawn(self._finish(record, response))
+            return True
+        # Ожидание передано (этим или прошлым запуском) и еще не подхвачено
+        return await asyncio.to_thread(db.save_handoff_response, request_id, response)
+
+    async def resume_all(self, application: Application) -> int:
+        """
+        Подхватывает ожидания, переданные прошлым запуском
+
+        Args:
+            application: Приложение бота (для контекста продолжений)
+
+        Returns:
+            Количество подхваченных ожиданий
+        """
+        self._application = application
+        records = await asyncio.to_thread(db.get_pending_handoffs)
+        if not records:
+            return 0
+        if not await asyncio.to_thread(db.update_handoffs, [record['id'] for record in records],
+                                       {"status": "resumed"}):
+            return 0
+
+        now = datetime.utcnow()
+        for record in records:
+            handoffs_total.inc(result='resumed')
+            if record.get('response') is not None:
+                self._spawn(self._finish(record, record['response']))
+                continue
+            remaining = (datetime.fromisoformat(record['expires_at']).replace(tzinfo=None) - now).total_seconds()
+            self._resumed[record['request_id']] = record
+            self._spawn(self._expire(record['request_id'], max(remaining, 0)))
+
+        bot_logger.info('SYSTEM', 'Подхвачены ожидания n8n прошлого запуска', count=len(records),
+                        kinds=dict(Counter(record['resume'] for record in records)))
+        return len(records)
+
+    async def _expire(self, request_id: str, delay: float) -> None:
+        await asyncio.sleep(delay)
+        record = self._resumed.pop(request_id, None)
+        if record is not None:
+            handoffs_total.inc(result='expired')
+            bot_logger.n8n_timeout(record['telegram_id'], request_id, int(delay))
+            await self._finish(record, None)
+
+    async def _finish(self, record: Dict[str, Any], response: Any) -> None:
+        """Выполняет продолжение шага с ответом n8n (или None при таймауте)"""
+        telegram_id = record['telegram_id']
+        resumer = self._resumers.get(record['resume'])
+        try:
+            if resumer is None:
+                bot_logger.error('SYSTEM', f'Неизвестное продолжение: {record["resume"]}', telegram_id=telegram_id)
+                return
+            application = self._application
+            context = application.context_types.context(application, chat_id=telegram_id, user_id=telegram_id)
+            message = Message.de_json(record['message'], application.bot) if record.get('message') else None
+            await resumer(context, telegram_id, response, message, **(record.get('params') or {}))
+            bot_logger.info('SYSTEM', 'Шаг продолжен после перезапуска', telegram_id=telegram_id,
+                            request_id=record['request_id'], resume=record['resume'])
+        except Exception as e:
+            bot_logger.error('SYSTEM', f'Ошибка продолжения шага после перезапуска: {str(e)}',
+                             telegram_id=telegram_id, error=e)
+        finally:
+            await asyncio.to_thread(db.update_handoffs, [record['id']], {"status": "done"})
+
+    def _spawn(self, coro: Awaitable[None]) -> None:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+
+def format_drain_report(report: Dict[str, Any]) -> str:
+    """Отчет об остановке одной строкой (для консоли)"""
+    handed_off = ', '.join(f'{name}: {count}' for name, count in sorted(report['handed_off'].items()))
+    line = (f"завершено ожиданий n8n: {report['completed']}, "
+            f"передано следующему запуску: {sum(report['handed_off'].values())}")
+    if handed_off:
+        line += f' ({handed_off})'
+    if report['lost']:
+        line += f", потеряно: {report['lost']}"
+    if report['requeued']:
+        line += f", возвращено в очередь: {report['requeued']}"
+    registrations = report['registrations']
+    if any(registrations.values()):
+        line += (f", регистраций завершено: {registrations['completed']}, "
+                 f"прервано: {registrations['cancelled']}, снято с очереди: {registrations['dropped']}")
+    return f"{line}, {report['seconds']} с"
+
+
+# Глобальный менеджер остановки и передачи ожиданий
+handoffs = HandoffManager(drain_timeout=DRAIN_TIMEOUT)
@@ -0,0 +1,420 @@
+"""
+Виртуальные пользователи нагрузочного теста
+
+Каждый пользователь проходит обучение от /start до COMPLETED: нажимает
+кнопки из последнего сообщения бота, а когда кнопок нет - отвечает текстом
+по своему состоянию в базе (email, ответы на вопросы, ссылки).
+
+Шаг - одно действие пользователя. Для шага замеряются:
+  first - время до первой реакции бота (сообщение или редактирование)
+  done  - время до последней реакции перед следующим действием
+          (для шагов с генерацией в n8n включает ожидание ответа)
+"""
+import asyncio
+import math
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from fake_bot_api import FakeBotApi
+from latency import Distribution
+
+# Кнопки в порядке предпочтения: путь через все этапы с генерацией в n8n
+PREFERRED_BUTTONS = [
+    'video_watched', 'channel_created', 'need_help', 'write_posts_express', 'next_post',
+    'help_publish', 'bot_added', 'skip_link', 'button_to_website', 'button_text_zhm',
+    'post_ok', 'help_write_anons', 'help_write_sales', 'to_final_step', 'retry_express',
+]
+
+# Кнопки выбора режима создания постов (--posts)
+POSTS_BUTTONS = {
+    'express': 'write_posts_express',
+    'sequential': 'write_posts',
+    'myself': 'write_myself',
+}
+
+# Состояния, в которых бот ждет текст от пользователя
+TEXT_STATES = {
+    'new', 'waiting_email', 'waiting_help_answer', 'answering_post_questions',
+    'answering_express_questions', 'waiting_channel_link', 'answering_blue_questions',
+    'waiting_website_link', 'waiting_custom_button_text', 'answering_anons_questions',
+    'answering_sales_questions',
+}
+
+COMPLETED_STATE = 'completed'
+
+# Первый telegram_id виртуальных пользователей
+USER_ID_BASE = 900_000_000
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Перцентиль методом ближайшего ранга"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class StepStats:
+    """Задержки и ошибки по шагам"""
+
+    def __init__(self):
+        self.first: Dict[str, List[float]] = defaultdict(list)
+        self.done: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, Counter] = defaultdict(Counter)
+
+    def record(self, step: str, first: float, done: float) -> None:
+        self.first[step].append(first)
+        self.done[step].append(done)
+
+    def record_error(self, step: str, reason: str) -> None:
+        self.errors[step][reason] += 1
+
+    def steps(self) -> List[str]:
+        return list(dict.fromkeys(list(self.done) + list(self.errors)))
+
+
+class LoopLagMonitor:
+    """Задержка event loop самого драйвера (чтобы отличить узкое место бота от стенда)"""
+
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+
+    async def _run(self) -> None:
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.monotonic() - started - self.interval))
+
+
+class UserFailed(Exception):
+    """Пользователь не может продолжить сценарий"""
+
+    def __init__(self, reason: str, detail: str):
+        super().__init__(f'{reason}: {detail}')
+        self.reason = reason
+
+
+class VirtualUser:
+    """Один пользователь, проходящий обучение"""
+
+    def __init__(self, driver: 'Driver', index: int):
+        self.driver = driver
+        self.index = index
+        self.telegram_id = USER_ID_BASE + index
+        self.user = {
+            'id': self.telegram_id,
+            'is_bot': False,
+            'first_name': f'Load{index}',
+            'username': f'loadtest_user_{index}',
+            'language_code': 'ru',
+        }
+        self.email = f'lt{index}@loadtest.local'
+        self.steps = 0
+        self.state: Optional[str] = None
+
+    async def run(self) -> bool:
+        """
+        Проходит сценарий
+
+        Returns:
+            True если пользователь дошел до COMPLETED
+        """
+        api = self.driver.api
+        chat = api.chat(self.telegram_id)
+        try:
+            await self._act('/start', lambda: api.push_message(self.user, '/start'))
+            while self.state != COMPLETED_STATE:
+                self.steps += 1
+                if self.steps > self.driver.max_steps:
+                    raise UserFailed('зацикливание', f'больше {self.driver.max_steps} шагов, состояние {self.state}')
+
+                await asyncio.sleep(self.driver.think())
+                keyboard = chat.pending_keyboard()
+                if keyboard:
+                    data = self._choose_button(keyboard)
+                    if data:
+                        await self._act(f'button:{data}', lambda: api.push_callback(self.user, keyboard, data))
+                        continue
+                    # Только кнопки-ссылки - нажимать нечего
+                    keyboard['consumed'] = True
+
+                if self.state not in TEXT_STATES:
+                    raise UserFailed('тупик', f'нет кнопок и бот не ждет текст в состоянии {self.state}')
+                text = self._text_for_state(self.state)
+                await self._act(f'text:{self.state}', lambda: api.push_message(self.user, text))
+            return True
+        except UserFailed as e:
+            self.driver.failures[e.reason] += 1
+            self.driver.failed_users.append((self.telegram_id, str(e)))
+            return False
+
+    async def _act(self, step: str, send) -> None:
+        """Выполняет действие и ждет, пока бот закончит реагировать"""
+        chat = self.driver.api.chat(self.telegram_id)
+        started = time.monotonic()
+        chat.changed.clear()
+        send()
+
+        first: Optional[float] = None
+        checked = False
+        while True:
+            remaining = self.driver.step_timeout - (time.monotonic() - max(started, chat.last_activity))
+            if remaining <= 0:
+                if first is None:
+                    self.driver.stats.record_error(step, 'timeout')
+                    raise UserFailed('нет ответа бота', f'{self.driver.step_timeout:.0f}с без реакции на {step}')
+                self.driver.stats.record_error(step, 'stuck')
+                raise UserFailed('бот перестал отвечать', f'после {step} в состоянии {self.state}')
+            try:
+                await asyncio.wait_for(chat.changed.wait(), timeout=min(remaining, self.driver.settle))
+                chat.changed.clear()
+                if first is None:
+                    first = chat.last_activity - started
+                checked = False
+                continue
+            except asyncio.TimeoutError:
+                pass
+
+            # Бот молчит settle секунд - один раз проверяем, можно ли действовать дальше
+            # (если нет - бот еще работает, например ждет n8n; ждем новой активности)
+            if first is None or checked:
+                continue
+            checked = True
+            self.state = await self.driver.fetch_state(self.telegram_id)
+            if chat.pending_keyboard() or self.state in TEXT_STATES or self.state == COMPLETED_STATE:
+                self.driver.stats.record(step, first, chat.last_activity - started)
+                return
+
+    def _choose_button(self, keyboard: Dict[str, Any]) -> Optional[str]:
+        buttons = [
+            button.get('callback_data')
+            for row in keyboard['reply_markup']['inline_keyboard'] for button in row
+            if button.get('callback_data')
+        ]
+        for data in self.driver.preferred_buttons:
+            if data in buttons:
+                return data
+        return buttons[0] if buttons else None
+
+    def _text_for_state(self, state: str) -> str:
+        if state in ('new', 'waiting_email'):
+            return self.email
+        if state == 'waiting_channel_link':
+            return f'@loadtest_channel_{self.index}'
+        if state == 'waiting_website_link':
+            return f'https://example.com/loadtest/{self.index}'
+        if state == 'waiting_custom_button_text':
+            return 'Записаться'
+        return f'Ответ пользователя {self.index} на шаге {self.steps}: ' + 'подробности ' * 10
+
+
+class Driver:
+    """Запуск виртуальных пользователей и сбор результатов"""
+
+    def __init__(
+        self,
+        api: FakeBotApi,
+        rest_url: str,
+        think: Distribution,
+        posts_mode: str = 'express',
+        step_timeout: float = 300,
+        settle: float = 0.3,
+        max_steps: int = 300
+    ):
+        """
+        Args:
+            api: Имитация Bot API, через которую идут сообщения пользователей
+            rest_url: Адрес PostgREST (как SUPABASE_URL бота + /rest/v1)
+            think: Пауза пользователя перед каждым действием
+            posts_mode: Режим создания постов: express, sequential или myself
+            step_timeout: Сколько ждать реакции бота на действие (секунды)
+            settle: Тишина от бота, после которой шаг считается завершенным
+            max_steps: Предел шагов на пользователя (защита от зацикливания)
+        """
+        self.api = api
+        self.rest_url = rest_url.rstrip('/')
+        self.think = think
+        self.step_timeout = step_timeout
+        self.settle = settle
+        self.max_steps = max_steps
+        self.preferred_buttons = [
+            POSTS_BUTTONS[posts_mode] if data == 'write_posts_express' else data
+            for data in PREFERRED_BUTTONS
+        ]
+        self.stats = StepStats()
+        self.failures: Counter = Counter()
+        self.failed_users: List[Tuple[int, str]] = []
+        self.completion_times: List[float] = []
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self) -> 'Driver':
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self._session.close()
+
+    async def prepare(self, users: int) -> None:
+        """
+        Сбрасывает данные виртуальных пользователей с прошлых запусков
+        и создает записи с email для регистрации
+        """
+        await self._rest('DELETE', f'publish_jobs?telegram_id=gte.{USER_ID_BASE}')
+        await self._rest('DELETE', 'users?email=like.*%40loadtest.local')
+        rows = [{'email': f'lt{index}@loadtest.local'} for index in range(users)]
+        for offset in range(0, len(rows), 1000):
+            await self._rest('POST', 'users', json=rows[offset:offset + 1000])
+
+    async def fetch_state(self, telegram_id: int) -> str:
+        rows = await self._rest('GET', f'users?select=state&telegram_id=eq.{telegram_id}')
+        # Пока email не подтвержден, записи с telegram_id нет - бот ждет email
+        return rows[0]['state'] if rows else 'new'
+
+    async def _rest(self, method: str, path: str, json: Any = None) -> Any:
+        headers = {'Prefer': 'return=minimal'} if method != 'GET' else {}
+        async with self._session.request(method, f'{self.rest_url}/{path}', json=json, headers=headers) as response:
+            if response.status >= 400:
+                raise RuntimeError(f'PostgREST {method} {path}: {response.status} {await response.text()}')
+            return await response.json() if method == 'GET' else None
+
+    async def run(self, users: int, ramp: float) -> float:
+        """
+        Запускает пользователей (равномерно в течение ramp секунд) и ждет завершения
+
+        Returns:
+            Длительность прогона (секунды)
+        """
+        started = time.monotonic()
+
+        async def start_user(index: int) -> None:
+            await asyncio.sleep(ramp * index / max(users, 1))
+            user_started = time.monotonic()
+            if await VirtualUser(self, index).run():
+                self.completion_times.append(time.monotonic() - user_started)
+
+        await asyncio.gather(*(start_user(index) for index in range(users)))
+        return time.monotonic() - started
+
+
+def parse_prometheus(text: str) -> Dict[str, float]:
+    """Значения метрик из ответа /metrics: {'name{labels}': value}"""
+    values = {}
+    for line in text.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        name, _, value = line.rpartition(' ')
+        try:
+            values[name] = float(value)
+        except ValueError:
+            continue
+    return values
+
+
+def histogram_percentile(before: Dict[str, float], after: Dict[str, float], name: str, q: float) -> Optional[float]:
+    """
+    Оценка перцентиля гистограммы за время прогона (верхняя граница корзины)
+
+    Args:
+        before: Метрики до прогона
+        after: Метрики после прогона
+        name: Имя гистограммы
+        q: Перцентиль (0-100)
+    """
+    prefix = f'{name}_bucket{{le="'
+    buckets = []
+    for key, value in after.items():
+        if key.startswith(prefix):
+            bound = key[len(prefix):-2]
+            buckets.append((float('inf') if bound == '+Inf' else float(bound), value - before.get(key, 0)))
+    buckets.sort()
+    if not buckets or buckets[-1][1] <= 0:
+        return None
+    target = buckets[-1][1] * q / 100
+    for bound, cumulative in buckets:
+        if cumulative >= target:
+            return bound
+    return None
+
+
+def _fmt(value: Optional[float]) -> str:
+    if value is None:
+        return '—'
+    if value == float('inf'):
+        return '>max'
+    return f'{value:.3f}'
+
+
+def format_report(
+    driver: Driver,
+    users: int,
+    duration: float,
+    api: FakeBotApi,
+    n8n_requests: Counter,
+    n8n_outcomes: Counter,
+    bot_metrics: Optional[Tuple[Dict[str, float], Dict[str, float]]],
+    harness_lag: List[float]
+) -> str:
+    """Итоговый отчет прогона"""
+    completed = len(driver.completion_times)
+    lines = [
+        '=' * 100,
+        f'Пользователей: {users}, дошли до COMPLETED: {completed} ({completed / max(users, 1):.0%}), '
+        f'длительность: {duration:.1f} с',
+        f'Время прохождения: p50 {_fmt(percentile(driver.completion_times, 50))} с, '
+        f'p95 {_fmt(percentile(driver.completion_times, 95))} с',
+        '',
+        f'{"Шаг":<42}{"n":>6}{"ошибки":>9}{"first p50":>11}{"p95":>9}{"done p50":>10}{"p95":>9}{"p99":>9}',
+    ]
+    stats = driver.stats
+    for step in stats.steps():
+        done = stats.done.get(step, [])
+        first = stats.first.get(step, [])
+        errors = sum(stats.errors[step].values())
+        attempts = len(done) + errors
+        lines.append(
+            f'{step:<42}{attempts:>6}{errors / max(attempts, 1):>9.1%}'
+            f'{_fmt(percentile(first, 50)):>11}{_fmt(percentile(first, 95)):>9}'
+            f'{_fmt(percentile(done, 50)):>10}{_fmt(percentile(done, 95)):>9}{_fmt(percentile(done, 99)):>9}'
+        )
+
+    if driver.failures:
+        lines.extend(['', 'Пользователи остановлены:'])
+        for reason, count in driver.failures.most_common():
+            lines.append(f'  {count:>6}  {reason}')
+
+    lines.extend(['', 'Bot API: ' + ', '.join(f'{method}={count}' for method, count in api.calls.most_common())])
+    if api.errors:
+        lines.append('Bot API ошибки: ' + ', '.join(f'{kind}={count}' for kind, count in api.errors.most_common()))
+    lines.append('n8n запросы: ' + (', '.join(f'{kind}={count}' for kind, count in n8n_requests.most_common()) or '—'))
+    if n8n_outcomes:
+        lines.append('n8n ответы: ' + ', '.join(f'{kind}={count}' for kind, count in n8n_outcomes.most_common()))
+
+    lines.append('')
+    if bot_metrics:
+        before, after = bot_metrics
+        lag = [histogram_percentile(before, after, 'event_loop_lag_seconds', q) for q in (50, 95, 99)]
+        lines.append(
+            f'Задержка event loop бота (≤, по корзинам): p50 {_fmt(lag[0])} с, p95 {_fmt(lag[1])} с, '
+            f'p99 {_fmt(lag[2])} с, max {_fmt(after.get("event_loop_lag_max_seconds"))} с'
+        )
+    else:
+        lines.append('Задержка event loop бота: /metrics недоступен')
+    lines.append(
+        f'Задержка event loop стенда: p99 {_fmt(percentile(harness_lag, 99))} с, '
+        f'max {_fmt(max(harness_lag) if harness_lag else None)} с'
+    )
+    lines.append('=' * 100)
+    return '\n'.join(lines)
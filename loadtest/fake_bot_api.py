@@ -0,0 +1,327 @@
+"""
+Имитация Telegram Bot API для нагрузочного теста
+
+Бот подключается к серверу как к собственному telegram-bot-api
+(TELEGRAM_API_BASE_URL). Обновления от виртуальных пользователей
+отдаются через getUpdates, ответы бота сохраняются по чатам, чтобы
+драйвер видел сообщения и кнопки и мог реагировать на них.
+"""
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+from latency import Distribution
+
+BOT_USER = {
+    'id': 7000000001,
+    'is_bot': True,
+    'first_name': 'LoadTest Bot',
+    'username': 'loadtest_bot',
+}
+
+# Методы, на которых можно имитировать флуд-контроль (429)
+FLOOD_METHODS = {'sendMessage', 'sendVideo', 'editMessageText', 'editMessageReplyMarkup'}
+
+
+class ChatLog:
+    """Сообщения бота в одном чате и ожидание новой активности"""
+
+    def __init__(self):
+        self.messages: Dict[int, Dict[str, Any]] = {}
+        self.last_activity = 0.0
+        self.changed = asyncio.Event()
+
+    def touch(self) -> None:
+        self.last_activity = time.monotonic()
+        self.changed.set()
+
+    def pending_keyboard(self) -> Optional[Dict[str, Any]]:
+        """Последнее сообщение с inline кнопками, которые еще не нажимали"""
+        for message in reversed(list(self.messages.values())):
+            if message.get('reply_markup') and not message.get('consumed'):
+                return message
+        return None
+
+
+def _parse_value(value: Any) -> Any:
+    """Значения формы приходят строками, вложенные объекты - как JSON"""
+    if isinstance(value, str) and value[:1] in ('{', '['):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    return value
+
+
+class FakeBotApi:
+    """Сервер, отвечающий на вызовы Bot API в памяти"""
+
+    def __init__(self, latency: Distribution, flood_rate: float = 0.0):
+        """
+        Args:
+            latency: Задержка ответа на вызов метода
+            flood_rate: Доля вызовов отправки, на которые отвечать 429
+        """
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.chats: Dict[int, ChatLog] = {}
+        self.calls: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.channels: Dict[str, int] = {}
+        self._updates: List[Dict[str, Any]] = []
+        self._new_updates = asyncio.Event()
+        self._update_ids = itertools.count(1)
+        self._message_ids: Dict[int, itertools.count] = {}
+        self._callback_ids = itertools.count(1)
+
+    # ---------- сторона драйвера ----------
+
+    def chat(self, chat_id: int) -> ChatLog:
+        if chat_id not in self.chats:
+            self.chats[chat_id] = ChatLog()
+        return self.chats[chat_id]
+
+    def push_message(self, user: Dict[str, Any], text: str) -> None:
+        """Сообщение пользователя боту"""
+        message = {
+            'message_id': self._next_message_id(user['id']),
+            'from': user,
+            'chat': self._private_chat(user),
+            'date': int(time.time()),
+            'text': text,
+        }
+        if text.startswith('/'):
+            command = text.split()[0]
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+        self._push_update({'message': message})
+
+    def push_callback(self, user: Dict[str, Any], message: Dict[str, Any], data: str) -> None:
+        """Нажатие inline кнопки под сообщением бота"""
+        message['consumed'] = True
+        self._push_update({'callback_query': {
+            'id': str(next(self._callback_ids)),
+            'from': user,
+            'chat_instance': f'loadtest-{user["id"]}',
+            'message': {key: value for key, value in message.items() if key != 'consumed'},
+            'data': data,
+        }})
+
+    def _push_update(self, payload: Dict[str, Any]) -> None:
+        self._updates.append({'update_id': next(self._update_ids), **payload})
+        self._new_updates.set()
+
+    def _next_message_id(self, chat_id: int) -> int:
+        if chat_id not in self._message_ids:
+            self._message_ids[chat_id] = itertools.count(1)
+        return next(self._message_ids[chat_id])
+
+    @staticmethod
+    def _private_chat(user: Dict[str, Any]) -> Dict[str, Any]:
+        return {'id': user['id'], 'type': 'private', 'first_name': user.get('first_name', '')}
+
+    def _chat_object(self, chat_id: int) -> Dict[str, Any]:
+        if chat_id < 0:
+            username = next((name for name, cid in self.channels.items() if cid == chat_id), None)
+            chat = {'id': chat_id, 'type': 'channel', 'title': f'Channel {chat_id}'}
+            if username:
+                chat['username'] = username
+            return chat
+        return {'id': chat_id, 'type': 'private', 'first_name': f'User {chat_id}'}
+
+    def _channel_id(self, username: str) -> int:
+        """Каналы создаются при первом обращении: у каждого @username свой id"""
+        username = username.lstrip('@')
+        if username not in self.channels:
+            self.channels[username] = -1001000000000 - len(self.channels)
+        return self.channels[username]
+
+    # ---------- HTTP ----------
+
+    def create_app(self) -> web.Application:
+        app = web.Application(client_max_size=200 * 1024 ** 2)
+        app.router.add_route('*', '/bot{token}/{method}', self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        self.calls[method] += 1
+
+        params: Dict[str, Any] = dict(request.query)
+        if request.can_read_body:
+            if request.content_type == 'application/json':
+                params.update(await request.json())
+            else:
+                params.update(await request.post())
+        params = {key: _parse_value(value) for key, value in params.items()}
+
+        if method != 'getUpdates':
+            await asyncio.sleep(self.latency())
+
+        if method in FLOOD_METHODS and self.flood_rate and random.random() < self.flood_rate:
+            self.errors['429'] += 1
+            return web.json_response({
+                'ok': False,
+                'error_code': 429,
+                'description': 'Too Many Requests: retry after 1',
+                'parameters': {'retry_after': 1},
+            }, status=429)
+
+        handler = getattr(self, f'_method_{method}', None)
+        if handler is None:
+            self.errors[f'unknown:{method}'] += 1
+            return web.json_response(
+                {'ok': False, 'error_code': 404, 'description': 'Not Found: method not found'}, status=404
+            )
+
+        try:
+            result = await handler(params)
+        except LookupError as e:
+            self.errors[f'{method}:400'] += 1
+            return web.json_response({'ok': False, 'error_code': 400, 'description': f'Bad Request: {e}'},
+                                     status=400)
+        return web.json_response({'ok': True, 'result': result})
+
+    # ---------- методы ----------
+
+    async def _method_getMe(self, params):
+        return {**BOT_USER, 'can_join_groups': True, 'can_read_all_group_messages': False,
+                'supports_inline_queries': False}
+
+    async def _method_deleteWebhook(self, params):
+        return True
+
+    async def _method_setMyCommands(self, params):
+        return True
+
+    async def _method_close(self, params):
+        return True
+
+    async def _method_getUpdates(self, params):
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        timeout = float(params.get('timeout') or 0)
+
+        if offset:
+            self._updates = [update for update in self._updates if update['update_id'] >= offset]
+        if not self._updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout=min(timeout, 50))
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    async def _method_sendMessage(self, params):
+        return self._store_message(params, {'text': str(params.get('text', ''))})
+
+    async def _method_sendVideo(self, params):
+        video = params.get('video')
+        if isinstance(video, str):
+            file_id = video
+        else:
+            file_id = f'loadtest_video_{self.calls["sendVideo"]}'
+        return self._store_message(params, {'video': {
+            'file_id': file_id,
+            'file_unique_id': file_id,
+            'width': 1280,
+            'height': 720,
+            'duration': 60,
+        }})
+
+    async def _method_sendChatAction(self, params):
+        return True
+
+    async def _method_editMessageText(self, params):
+        message = self._find_message(params)
+        message['text'] = str(params.get('text', ''))
+        message['edit_date'] = int(time.time())
+        self._set_markup(message, params)
+        return self._touch(params, message)
+
+    async def _method_editMessageReplyMarkup(self, params):
+        message = self._find_message(params)
+        self._set_markup(message, params)
+        return self._touch(params, message)
+
+    async def _method_deleteMessage(self, params):
+        chat = self.chat(int(params['chat_id']))
+        chat.messages.pop(int(params['message_id']), None)
+        return True
+
+    async def _method_answerCallbackQuery(self, params):
+        return True
+
+    async def _method_getChat(self, params):
+        chat_id = params['chat_id']
+        if isinstance(chat_id, str) and chat_id.startswith('@'):
+            return self._chat_object(self._channel_id(chat_id))
+        return self._chat_object(int(chat_id))
+
+    async def _method_getChatMember(self, params):
+        user_id = int(params['user_id'])
+        if user_id != BOT_USER['id']:
+            return {'status': 'member', 'user': {'id': user_id, 'is_bot': False, 'first_name': 'User'}}
+        # Бот - администратор любого канала с правом публикации
+        return {
+            'status': 'administrator',
+            'user': BOT_USER,
+            'can_be_edited': False,
+            'is_anonymous': False,
+            'can_manage_chat': True,
+            'can_delete_messages': True,
+            'can_manage_video_chats': False,
+            'can_restrict_members': False,
+            'can_promote_members': False,
+            'can_change_info': False,
+            'can_invite_users': True,
+            'can_post_messages': True,
+            'can_edit_messages': True,
+            'can_post_stories': False,
+            'can_edit_stories': False,
+            'can_delete_stories': False,
+        }
+
+    async def _method_pinChatMessage(self, params):
+        return True
+
+    # ---------- хранение сообщений ----------
+
+    def _store_message(self, params: Dict[str, Any], content: Dict[str, Any]) -> Dict[str, Any]:
+        chat_id = int(params['chat_id'])
+        message = {
+            'message_id': self._next_message_id(chat_id),
+            'from': BOT_USER,
+            'chat': self._chat_object(chat_id),
+            'date': int(time.time()),
+            **content,
+        }
+        self._set_markup(message, params)
+        return self._touch(params, message)
+
+    def _find_message(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        chat = self.chat(int(params['chat_id']))
+        message = chat.messages.get(int(params['message_id']))
+        if message is None:
+            raise LookupError('message to edit not found')
+        return message
+
+    @staticmethod
+    def _set_markup(message: Dict[str, Any], params: Dict[str, Any]) -> None:
+        markup = params.get('reply_markup')
+        if isinstance(markup, dict) and markup.get('inline_keyboard'):
+            message['reply_markup'] = markup
+            message.pop('consumed', None)
+        else:
+            message.pop('reply_markup', None)
+
+    def _touch(self, params: Dict[str, Any], message: Dict[str, Any]) -> Dict[str, Any]:
+        chat = self.chat(int(params['chat_id']))
+        chat.messages[message['message_id']] = message
+        chat.touch()
+        return {key: value for key, value in message.items() if key != 'consumed'}
@@ -0,0 +1,107 @@
+"""
+Имитация n8n для нагрузочного теста
+
+Принимает запросы бота на /webhook/<тип> (osebe, post, bluebutt, anons,
+prodaj), сразу отвечает 200 и через случайную задержку из заданного
+распределения вызывает /webhook/response/<тип> бота - как настоящий
+workflow с LLM. Пакетные запросы (поле batch) получают ответ списком.
+"""
+import asyncio
+import random
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, List
+
+import aiohttp
+from aiohttp import web
+
+from latency import Distribution
+
+
+class FakeN8n:
+    """Webhook'и n8n с настраиваемой задержкой и отказами"""
+
+    def __init__(
+        self,
+        bot_url: str,
+        latencies: Dict[str, Distribution],
+        error_rate: float = 0.0,
+        drop_rate: float = 0.0
+    ):
+        """
+        Args:
+            bot_url: Адрес webhook сервера бота, например http://bot:8080
+            latencies: Задержка ответа по типам webhook ('default' - для остальных)
+            error_rate: Доля запросов, на которые n8n отвечает 500
+            drop_rate: Доля запросов, на которые ответ не приходит никогда
+        """
+        self.bot_url = bot_url.rstrip('/')
+        self.latencies = latencies
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.requests: Counter = Counter()
+        self.outcomes: Counter = Counter()
+        self.callback_durations: Dict[str, List[float]] = defaultdict(list)
+        self._session: aiohttp.ClientSession | None = None
+        self._tasks: set = set()
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/webhook/{webhook_type}', self.handle)
+        app.on_cleanup.append(self._close)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        webhook_type = request.match_info['webhook_type']
+        payload = await request.json()
+        self.requests[webhook_type] += 1
+
+        if self.error_rate and random.random() < self.error_rate:
+            self.outcomes['error_500'] += 1
+            return web.json_response({'message': 'Workflow failed'}, status=500)
+        if self.drop_rate and random.random() < self.drop_rate:
+            self.outcomes['dropped'] += 1
+            return web.json_response({'message': 'Workflow was started'})
+
+        task = asyncio.create_task(self._respond_later(webhook_type, payload))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.json_response({'message': 'Workflow was started'})
+
+    async def _respond_later(self, webhook_type: str, payload: Dict[str, Any]) -> None:
+        latency = self.latencies.get(webhook_type) or self.latencies['default']
+        await asyncio.sleep(latency())
+
+        body: Dict[str, Any] = {
+            'telegram_id': payload['telegram_id'],
+            'request_id': payload['request_id'],
+        }
+        if payload.get('batch'):
+            body['responses'] = [
+                {'post_number': item['post_number'], 'response': self._generated_text(webhook_type)}
+                for item in payload['batch']
+            ]
+        else:
+            body['response'] = self._generated_text(webhook_type)
+
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+        started = time.monotonic()
+        try:
+            async with self._session.post(f'{self.bot_url}/webhook/response/{webhook_type}', json=body) as response:
+                self.outcomes[f'callback_{response.status}'] += 1
+        except aiohttp.ClientError as e:
+            self.outcomes[f'callback_{type(e).__name__}'] += 1
+        except asyncio.TimeoutError:
+            self.outcomes['callback_timeout'] += 1
+        self.callback_durations[webhook_type].append(time.monotonic() - started)
+
+    @staticmethod
+    def _generated_text(webhook_type: str) -> str:
+        return f'Сгенерированный текст ({webhook_type}). ' + 'Текст для нагрузочного теста. ' * 20
+
+    async def _close(self, app: web.Application) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        if self._session is not None:
+            await self._session.close()
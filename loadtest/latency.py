@@ -0,0 +1,69 @@
+"""
+Распределения задержек для нагрузочного теста
+
+Формат описания: "<тип>:<параметры через запятую>"
+  fixed:2            - всегда 2 секунды
+  uniform:1,5        - равномерно от 1 до 5 секунд
+  normal:3,1         - нормальное (среднее, отклонение), отрицательные значения = 0
+  lognormal:3,0.5    - логнормальное (медиана, sigma) - похоже на время ответа LLM
+  exp:2              - экспоненциальное со средним 2
+"""
+import math
+import random
+from typing import Callable, Dict, Iterable
+
+Distribution = Callable[[], float]
+
+
+def parse_distribution(spec: str) -> Distribution:
+    """
+    Создает генератор задержек по описанию
+
+    Args:
+        spec: Описание распределения, например "lognormal:3,0.5"
+
+    Returns:
+        Функция без аргументов, возвращающая задержку в секундах
+    """
+    kind, _, raw_args = spec.partition(':')
+    try:
+        args = [float(value) for value in raw_args.split(',') if value.strip()]
+    except ValueError:
+        raise ValueError(f'Неверные параметры распределения: {spec}')
+
+    kind = kind.strip().lower()
+    if kind == 'fixed' and len(args) == 1:
+        return lambda: args[0]
+    if kind == 'uniform' and len(args) == 2:
+        return lambda: random.uniform(args[0], args[1])
+    if kind == 'normal' and len(args) == 2:
+        return lambda: max(0.0, random.gauss(args[0], args[1]))
+    if kind == 'lognormal' and len(args) == 2:
+        mu = math.log(args[0])
+        return lambda: random.lognormvariate(mu, args[1])
+    if kind == 'exp' and len(args) == 1:
+        return lambda: random.expovariate(1 / args[0]) if args[0] > 0 else 0.0
+    raise ValueError(f'Неизвестное распределение: {spec}')
+
+
+def parse_distribution_map(specs: Iterable[str], default: str) -> Dict[str, Distribution]:
+    """
+    Разбирает набор распределений по ключам: ["post=lognormal:8,0.4", "fixed:1"]
+
+    Описание без ключа задает распределение по умолчанию (ключ 'default').
+
+    Args:
+        specs: Описания из командной строки
+        default: Распределение по умолчанию, если не задано
+
+    Returns:
+        Словарь {ключ: генератор задержек}
+    """
+    result = {'default': parse_distribution(default)}
+    for spec in specs:
+        key, sep, value = spec.partition('=')
+        if sep:
+            result[key.strip()] = parse_distribution(value)
+        else:
+            result['default'] = parse_distribution(spec)
+    return result
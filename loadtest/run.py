@@ -0,0 +1,164 @@
+"""
+Нагрузочный тест: сколько одновременных учеников выдерживает один контейнер бота
+
+Запускает имитацию Bot API и n8n, ждет готовности бота, проводит
+виртуальных пользователей от /start до COMPLETED и печатает отчет.
+Подробности - в loadtest/README.md.
+
+Пример:
+    python loadtest/run.py --users 200 --ramp 60 --n8n-latency lognormal:5,0.5
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from typing import Dict, Optional, Tuple
+
+import aiohttp
+from aiohttp import web
+
+from driver import Driver, LoopLagMonitor, format_report, parse_prometheus, percentile
+from fake_bot_api import FakeBotApi
+from fake_n8n import FakeN8n
+from latency import parse_distribution, parse_distribution_map
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Нагрузочный тест воронки обучения')
+    parser.add_argument('--users', type=int, default=50, help='Количество виртуальных пользователей')
+    parser.add_argument('--ramp', type=float, default=30, help='За сколько секунд запустить всех пользователей')
+    parser.add_argument('--think', default='uniform:0.5,2', help='Пауза пользователя перед действием')
+    parser.add_argument('--posts', choices=['express', 'sequential', 'myself'], default='express',
+                        help='Режим создания постов')
+    parser.add_argument('--bot-url', default='http://bot:8080', help='Webhook сервер бота')
+    parser.add_argument('--metrics-token', default='loadtest', help='METRICS_TOKEN бота (для /metrics)')
+    parser.add_argument('--rest-url', default='http://rest:8000/rest/v1', help='PostgREST (SUPABASE_URL + /rest/v1)')
+    parser.add_argument('--bot-api-port', type=int, default=8081)
+    parser.add_argument('--n8n-port', type=int, default=5678)
+    parser.add_argument('--bot-api-latency', default='lognormal:0.05,0.3', help='Задержка ответа Bot API')
+    parser.add_argument('--flood-rate', type=float, default=0.0, help='Доля отправок, получающих 429')
+    parser.add_argument('--n8n-latency', action='append', default=[],
+                        help='Задержка n8n: "lognormal:5,0.5" или по типу "post=lognormal:15,0.4" (можно повторять)')
+    parser.add_argument('--n8n-error-rate', type=float, default=0.0, help='Доля запросов в n8n с ответом 500')
+    parser.add_argument('--n8n-drop-rate', type=float, default=0.0, help='Доля запросов в n8n без ответа')
+    parser.add_argument('--step-timeout', type=float, default=300, help='Ожидание реакции бота на действие')
+    parser.add_argument('--settle', type=float, default=0.3, help='Тишина бота, после которой шаг завершен')
+    parser.add_argument('--wait-bot', type=float, default=120, help='Сколько ждать готовности бота')
+    parser.add_argument('--json', help='Сохранить результаты в JSON файл')
+    return parser.parse_args()
+
+
+async def start_site(app: web.Application, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '0.0.0.0', port).start()
+    return runner
+
+
+async def wait_for_bot(session: aiohttp.ClientSession, bot_url: str, timeout: float) -> None:
+    """Ждет, пока бот поднимет webhook сервер и начнет опрашивать getUpdates"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(f'{bot_url}/health') as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(1)
+    raise RuntimeError(f'Бот не ответил на {bot_url}/health за {timeout:.0f}с')
+
+
+async def scrape_metrics(session: aiohttp.ClientSession, bot_url: str, token: str) -> Optional[Dict[str, float]]:
+    try:
+        async with session.get(f'{bot_url}/metrics', headers={'Authorization': f'Bearer {token}'}) as response:
+            if response.status != 200:
+                return None
+            return parse_prometheus(await response.text())
+    except aiohttp.ClientError:
+        return None
+
+
+async def main() -> int:
+    args = parse_args()
+
+    api = FakeBotApi(parse_distribution(args.bot_api_latency), flood_rate=args.flood_rate)
+    n8n = FakeN8n(
+        args.bot_url,
+        parse_distribution_map(args.n8n_latency, default='lognormal:5,0.5'),
+        error_rate=args.n8n_error_rate,
+        drop_rate=args.n8n_drop_rate,
+    )
+    runners = [
+        await start_site(api.create_app(), args.bot_api_port),
+        await start_site(n8n.create_app(), args.n8n_port),
+    ]
+    print(f'Bot API: :{args.bot_api_port}, n8n: :{args.n8n_port}')
+
+    harness_lag = LoopLagMonitor()
+    try:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
+            await wait_for_bot(session, args.bot_url, args.wait_bot)
+            print(f'Бот готов: {args.bot_url}')
+
+            async with Driver(
+                api,
+                args.rest_url,
+                think=parse_distribution(args.think),
+                posts_mode=args.posts,
+                step_timeout=args.step_timeout,
+                settle=args.settle,
+            ) as driver:
+                await driver.prepare(args.users)
+                metrics_before = await scrape_metrics(session, args.bot_url, args.metrics_token)
+
+                print(f'Запуск {args.users} пользователей за {args.ramp:.0f}с...')
+                harness_lag.start()
+                duration = await driver.run(args.users, args.ramp)
+                harness_lag.stop()
+
+                metrics_after = await scrape_metrics(session, args.bot_url, args.metrics_token)
+
+        bot_metrics: Optional[Tuple[Dict[str, float], Dict[str, float]]] = None
+        if metrics_before is not None and metrics_after is not None:
+            bot_metrics = (metrics_before, metrics_after)
+
+        print(format_report(driver, args.users, duration, api, n8n.requests, n8n.outcomes,
+                            bot_metrics, harness_lag.samples))
+
+        if args.json:
+            stats = driver.stats
+            result = {
+                'users': args.users,
+                'completed': len(driver.completion_times),
+                'duration': duration,
+                'steps': {
+                    step: {
+                        'count': len(stats.done.get(step, [])),
+                        'errors': dict(stats.errors.get(step, {})),
+                        **{f'first_p{q}': percentile(stats.first.get(step, []), q) for q in (50, 95, 99)},
+                        **{f'done_p{q}': percentile(stats.done.get(step, []), q) for q in (50, 95, 99)},
+                    }
+                    for step in stats.steps()
+                },
+                'failures': dict(driver.failures),
+                'failed_users': driver.failed_users[:100],
+                'bot_api_calls': dict(api.calls),
+                'bot_api_errors': dict(api.errors),
+                'n8n_requests': dict(n8n.requests),
+                'n8n_outcomes': dict(n8n.outcomes),
+                'bot_metrics_after': metrics_after,
+            }
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+            print(f'Результаты сохранены в {args.json}')
+
+        return 0 if len(driver.completion_times) == args.users else 1
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
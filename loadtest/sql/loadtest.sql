@@ -0,0 +1,13 @@
+-- ============================================
+-- РОЛИ POSTGREST ДЛЯ НАГРУЗОЧНОГО ТЕСТА
+-- Выполняется после setup.sql (docker-entrypoint-initdb.d)
+-- ============================================
+
+-- Запросы без JWT выполняются от роли anon (nginx убирает заголовок Authorization)
+CREATE ROLE anon NOLOGIN;
+GRANT anon TO postgres;
+
+GRANT USAGE ON SCHEMA public TO anon;
+GRANT ALL ON ALL TABLES IN SCHEMA public TO anon;
+GRANT ALL ON ALL SEQUENCES IN SCHEMA public TO anon;
+GRANT EXECUTE ON ALL FUNCTIONS IN SCHEMA public TO anon;
@@ -285,9 +285,9 @@ logs_stats() {
     echo "SELECT 
     COUNT(*) as total_users,
     COUNT(CASE WHEN state = 'registered' THEN 1 END) as registered,
-    COUNT(CASE WHEN channel_link IS NOT NULL THEN 1 END) as with_channels,
-    COUNT(CASE WHEN blue_post_text IS NOT NULL THEN 1 END) as published_intro,
-    COUNT(CASE WHEN sales_text IS NOT NULL THEN 1 END) as created_sales
+    COUNT(CASE WHEN channel_id IS NOT NULL THEN 1 END) as with_channels,
+    (SELECT COUNT(*) FROM user_intro_posts WHERE blue_post_text IS NOT NULL) as published_intro,
+    (SELECT COUNT(*) FROM user_sales WHERE sales_text IS NOT NULL) as created_sales
 FROM users;"
 }
 
@@ -0,0 +1,142 @@
+"""
+Отдельная "полоса" для передачи видео
+
+Видео отправляются через собственный экземпляр Bot с отдельным пулом
+соединений и длинными таймаутами записи. Поэтому медленная загрузка
+50 МБ файла не занимает соединения основного пула и не задерживает
+send_message / edit_message_text.
+"""
+import asyncio
+from pathlib import Path
+from typing import Optional
+
+from telegram import Bot, Message
+from telegram.error import NetworkError, RetryAfter
+
+from config import (
+    MEDIA_POOL_SIZE, MEDIA_MAX_CONCURRENT_UPLOADS,
+    MEDIA_WRITE_TIMEOUT, MEDIA_READ_TIMEOUT, MEDIA_CONNECT_TIMEOUT, MEDIA_POOL_TIMEOUT,
+    MEDIA_MAX_RETRIES, MEDIA_RETRY_BACKOFF
+)
+from logger import bot_logger
+from telegram_transport import ConfiguredHTTPXRequest, bot_api_server_kwargs
+
+
+class MediaTransferLane:
+    """Исполнитель отправки видео с собственным пулом, лимитом и повторами"""
+
+    def __init__(
+        self,
+        pool_size: int,
+        max_concurrent_uploads: int,
+        write_timeout: float,
+        read_timeout: float,
+        connect_timeout: float,
+        pool_timeout: float,
+        max_retries: int,
+        retry_backoff: float
+    ):
+        self.pool_size = pool_size
+        self.write_timeout = write_timeout
+        self.read_timeout = read_timeout
+        self.connect_timeout = connect_timeout
+        self.pool_timeout = pool_timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._upload_semaphore = asyncio.Semaphore(max_concurrent_uploads)
+        self._bot: Optional[Bot] = None
+        self._init_lock = asyncio.Lock()
+
+    def _build_bot(self, main_bot: Bot) -> Bot:
+        """Создает Bot с тем же токеном, но отдельным пулом соединений"""
+        # media_write_timeout - именно он действует для запросов с файлами
+        request = ConfiguredHTTPXRequest(
+            client_name='media',
+            connection_pool_size=self.pool_size,
+            write_timeout=self.write_timeout,
+            media_write_timeout=self.write_timeout,
+            read_timeout=self.read_timeout,
+            connect_timeout=self.connect_timeout,
+            pool_timeout=self.pool_timeout,
+        )
+        return Bot(token=main_bot.token, request=request, **bot_api_server_kwargs())
+
+    async def _get_bot(self, main_bot: Bot) -> Bot:
+        if self._bot is not None:
+            return self._bot
+        async with self._init_lock:
+            if self._bot is None:
+                bot = self._build_bot(main_bot)
+                await bot.initialize()
+                self._bot = bot
+                bot_logger.info('VIDEO', 'Media-полоса инициализирована',
+                                pool_size=self.pool_size, write_timeout=self.write_timeout)
+        return self._bot
+
+    async def send_video(self, main_bot: Bot, chat_id: int, video, **kwargs) -> Message:
+        """
+        Отправляет видео через media-полосу
+
+        Загрузки с диска ограничены по количеству одновременно выполняемых,
+        отправки по file_id и локальному пути идут без ограничения (только пул соединений).
+
+        Args:
+            main_bot: Основной бот (context.bot) - источник токена
+            chat_id: ID чата
+            video: file_id (str), открытый файл или Path (локальный режим)
+            **kwargs: Дополнительные параметры send_video
+
+        Returns:
+            Отправленное сообщение
+        """
+        bot = await self._get_bot(main_bot)
+
+        # file_id и локальный путь (локальный сервер) не передают тело файла
+        if isinstance(video, (str, Path)):
+            return await self._send_with_retries(bot, chat_id, video, **kwargs)
+
+        async with self._upload_semaphore:
+            return await self._send_with_retries(bot, chat_id, video, **kwargs)
+
+    async def _send_with_retries(self, bot: Bot, chat_id: int, video, **kwargs) -> Message:
+        """Отправляет видео с повторами при флуд-контроле и сетевых ошибках"""
+        attempt = 1
+        while True:
+            try:
+                if hasattr(video, 'seek'):
+                    video.seek(0)
+                return await bot.send_video(chat_id=chat_id, video=video, **kwargs)
+            except RetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = float(getattr(e.retry_after, 'total_seconds', lambda: e.retry_after)())
+                bot_logger.warning('VIDEO', f'Флуд-контроль, повтор через {delay:.0f}с',
+                                   telegram_id=chat_id, attempt=attempt)
+            except NetworkError as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.retry_backoff * (2 ** (attempt - 1))
+                bot_logger.warning('VIDEO', f'Сетевая ошибка при отправке видео: {str(e)}, '
+                                   f'повтор через {delay:.0f}с',
+                                   telegram_id=chat_id, attempt=attempt)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def shutdown(self) -> None:
+        """Закрывает соединения media-полосы"""
+        if self._bot is not None:
+            await self._bot.shutdown()
+            self._bot = None
+
+
+# Глобальная media-полоса
+media_lane = MediaTransferLane(
+    pool_size=MEDIA_POOL_SIZE,
+    max_concurrent_uploads=MEDIA_MAX_CONCURRENT_UPLOADS,
+    write_timeout=MEDIA_WRITE_TIMEOUT,
+    read_timeout=MEDIA_READ_TIMEOUT,
+    connect_timeout=MEDIA_CONNECT_TIMEOUT,
+    pool_timeout=MEDIA_POOL_TIMEOUT,
+    max_retries=MEDIA_MAX_RETRIES,
+    retry_backoff=MEDIA_RETRY_BACKOFF,
+)
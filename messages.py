@@ -41,6 +41,44 @@ REGISTRATION_SUCCESS = """
 Сейчас вы получите обучающее видео.
 """
 
+# Очередь на регистрацию при наплыве пользователей
+ADMISSION_QUEUED = """
+⏳ <b>Сейчас много желающих начать обучение</b>
+
+Ваше место в очереди: <b>{position}</b>
+Примерное ожидание: {eta}
+
+Ничего отправлять не нужно - регистрация начнется автоматически.
+"""
+
+# Очередь на генерацию (заменяет сообщение "обрабатываю", пока запрос ждет отправки в n8n)
+GENERATION_QUEUED = """
+⏳ <b>Сейчас много запросов на генерацию</b>
+
+Ваше место в очереди: <b>{position}</b>
+Примерное ожидание: {eta}
+
+Ничего отправлять не нужно - генерация начнется автоматически.
+"""
+
+# Повторный email, пока пользователь в очереди: регистрируется последний
+ADMISSION_EMAIL_UPDATED = """
+✏️ <b>Email обновлен</b>
+
+Ваше место в очереди не изменилось: <b>{position}</b>
+Примерное ожидание: {eta}
+"""
+
+# Повторный email во время регистрации
+ADMISSION_IN_PROGRESS = "⏳ Регистрация уже идет, подождите несколько секунд."
+
+# Очередь на регистрацию заполнена
+ADMISSION_OVERLOADED = """
+😔 <b>Сейчас слишком много желающих</b>
+
+Пожалуйста, отправьте ваш email еще раз через {retry}.
+"""
+
 # Сообщение после отправки видео
 VIDEO_SENT_MESSAGE = """
 🎥 <b>Обучающее видео отправлено</b>
@@ -191,6 +229,7 @@ LEARN4_VIDEO_MESSAGE = """
 
 # Текст кнопок для выбора постов
 BUTTON_WRITE_POSTS = "✍️ Напиши мне посты"
+BUTTON_WRITE_POSTS_EXPRESS = "⚡ Ответить на все вопросы сразу"
 BUTTON_WRITE_MYSELF = "📝 Напишу сам"
 
 # Сообщение при выборе "Напишу сам"
@@ -268,6 +307,86 @@ POST_ERROR_MESSAGE = """
 Давайте попробуем еще раз - ответьте на вопросы заново.
 """
 
+# Конвейерный режим: пост ушел в фоновую генерацию
+POST_PIPELINE_QUEUED_MESSAGE = """
+⏳ <b>Пост #{post_number} генерируется в фоне</b>
+
+Пока он готовится, продолжим со следующим постом.
+Готовый текст появится в этом сообщении.
+"""
+
+# Конвейерный режим: готовый пост
+POST_PIPELINE_RESULT_MESSAGE = """
+✅ <b>Пост #{post_number} готов:</b>
+
+{post_text}
+"""
+
+# Конвейерный режим: пост не удалось сгенерировать
+POST_PIPELINE_ERROR_MESSAGE = """
+❌ <b>Не удалось создать пост #{post_number}</b>
+
+AI не ответил вовремя. Ваши ответы сохранены - нажмите кнопку ниже, чтобы попробовать еще раз.
+"""
+
+# Конвейерный режим: пост не удалось сгенерировать и попытки закончились
+POST_PIPELINE_FAILED_MESSAGE = """
+❌ <b>Не удалось создать пост #{post_number}</b>
+
+AI не ответил вовремя, а попытки создать этот пост закончились.
+"""
+
+# Конвейерный режим: все ответы собраны, но часть постов не создана
+POST_PIPELINE_RETRY_FAILED_MESSAGE = """
+⚠️ <b>Не удалось создать посты: {post_numbers}</b>
+
+Нажмите «Попробовать еще раз» под этими постами - блок завершится, когда они будут готовы.
+"""
+
+# Конвейерный режим: пост переписывается по тем же ответам
+POST_PIPELINE_REWRITING_MESSAGE = """
+⏳ <b>Переписываю пост #{post_number}</b>
+
+Можно продолжать отвечать на вопросы - новый текст появится в этом сообщении.
+"""
+
+# Конвейерный режим: ответы для поста больше недоступны
+POST_PIPELINE_REWRITE_UNAVAILABLE = "Этот пост уже нельзя переписать"
+
+BUTTON_RETRY_POST = "🔄 Попробовать еще раз"
+
+# Конвейерный режим: все ответы собраны, ждем оставшиеся посты
+POST_PIPELINE_WAITING_MESSAGE = """
+👍 <b>Все ответы получены!</b>
+
+Дописываю оставшиеся посты, они появятся выше по мере готовности.
+"""
+
+# Экспресс-режим: начало
+START_EXPRESS_POSTS_MESSAGE = """
+⚡ <b>Экспресс-режим</b>
+
+Я задам сразу все вопросы для 5 постов (по 3 на каждый), а затем напишу все посты за один раз.
+Отвечайте текстом или голосовым сообщением.
+"""
+
+# Экспресс-режим: генерация всех постов
+PROCESSING_EXPRESS_POSTS_MESSAGE = """
+⏳ <b>Создаю все 5 постов...</b>
+
+Все ответы получены, генерирую посты одним пакетом.
+Это займет не более 5 минут.
+"""
+
+# Экспресс-режим: пакетная генерация не удалась
+EXPRESS_POSTS_ERROR_MESSAGE = """
+❌ <b>Не удалось создать посты</b>
+
+AI не ответил вовремя. Ваши ответы сохранены - нажмите кнопку ниже, чтобы попробовать еще раз.
+"""
+
+BUTTON_RETRY_EXPRESS = "🔄 Попробовать еще раз"
+
 # Сообщение о завершении всех постов
 ALL_POSTS_COMPLETED_MESSAGE = """
 🎉 <b>Поздравляю! Все 5 постов готовы!</b>
@@ -423,6 +542,11 @@ PROCESSING_BLUE_BUTTON_POST = """
 Это займет не более 3 минут.
 """
 
+# Ответ не удалось сохранить (ошибка базы) - вопрос остается тем же
+ANSWER_SAVE_ERROR = """
+❌ Не удалось сохранить ответ. Пожалуйста, отправьте его еще раз.
+"""
+
 # Ошибка при создании поста с кнопкой
 BLUE_BUTTON_POST_ERROR = """
 ❌ <b>Произошла ошибка</b>
@@ -733,3 +857,49 @@ REMINDER_3 = """
 После просмотра не забудьте нажать кнопку "Видео просмотрено, едем дальше".
 """
 
+
+# ============================================
+# РАССЫЛКИ (команды администратора)
+# ============================================
+
+BROADCAST_USAGE = """
+📣 <b>Рассылка по состоянию пользователей</b>
+
+<code>/broadcast СОСТОЯНИЕ ДНЕЙ ТЕКСТ</code>
+
+• СОСТОЯНИЕ - например, <code>learn4_sent</code>
+• ДНЕЙ - сколько дней без активности (0 - все пользователи в состоянии)
+• ТЕКСТ - сообщение (можно с форматированием и переносами строк)
+
+Пример: <code>/broadcast learn4_sent 3 Вы остановились на 4-м уроке - продолжим?</code>
+
+<code>/broadcast_status</code> - активные рассылки
+<code>/broadcast_cancel ID</code> - остановить рассылку
+"""
+
+BROADCAST_UNKNOWN_STATE = "❌ Неизвестное состояние: <code>{state}</code>"
+
+BROADCAST_CREATE_ERROR = "❌ Не удалось создать рассылку. Проверьте логи."
+
+BROADCAST_PROGRESS = """
+📣 <b>Рассылка #{broadcast_id}</b> ({state}, без активности {inactive_days} дн.)
+{status}
+
+✅ Отправлено: {sent}
+🚫 Заблокировали бота: {blocked}
+❌ Ошибки: {failed}
+"""
+
+BROADCAST_STATUS_RUNNING = "⏳ Идет рассылка..."
+BROADCAST_STATUS_DONE = "🏁 Рассылка завершена"
+BROADCAST_STATUS_CANCELLED = "⏹ Рассылка остановлена"
+
+BROADCAST_NONE_ACTIVE = "Активных рассылок нет"
+BROADCAST_CANCEL_USAGE = "Укажите номер рассылки: <code>/broadcast_cancel ID</code>"
+BROADCAST_NOT_FOUND = "❌ Активная рассылка #{broadcast_id} не найдена"
+
+# ============================================
+# АНАЛИТИКА (команда администратора /stats)
+# ============================================
+
+STATS_NOT_READY = "📊 Снимок аналитики еще не готов. Попробуйте <code>/stats refresh</code>"
@@ -0,0 +1,160 @@
+"""
+Простые метрики процесса в формате Prometheus
+
+Счетчики, gauge и гистограммы хранятся в памяти и отдаются
+webhook сервером на GET /metrics.
+"""
+import asyncio
+import bisect
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+LabelValues = Tuple[Tuple[str, str], ...]
+
+# Границы по умолчанию для длительностей (секунды)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _labels_key(labels: Dict[str, object]) -> LabelValues:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels: LabelValues, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    body = ','.join(f'{name}="{value}"' for name, value in pairs)
+    return '{' + body + '}'
+
+
+class Counter:
+    """Монотонно растущий счетчик"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = _labels_key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_labels_key(labels), 0)
+
+    def render(self) -> List[str]:
+        return [f'{self.name}{_format_labels(key)} {value}' for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    """Значение, которое может расти и уменьшаться"""
+
+    kind = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        self._values[_labels_key(labels)] = value
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, description: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(sorted(buckets))
+        # Ключ меток -> (счетчики по корзинам, сумма, количество)
+        self._values: Dict[LabelValues, Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = _labels_key(labels)
+        counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            counts[index] += 1
+        self._values[key] = (counts, total + value, count + 1)
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{_format_labels(key, ("le", str(bound)))} {cumulative}')
+            lines.append(f'{self.name}_bucket{_format_labels(key, ("le", "+Inf"))} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    """Реестр метрик процесса"""
+
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+
+    def _get_or_create(self, cls, name: str, description: str, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = cls(name, description, **kwargs)
+            self._metrics[name] = metric
+        return metric
+
+    def counter(self, name: str, description: str) -> Counter:
+        return self._get_or_create(Counter, name, description)
+
+    def gauge(self, name: str, description: str) -> Gauge:
+        return self._get_or_create(Gauge, name, description)
+
+    def histogram(self, name: str, description: str,
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, description, buckets=buckets)
+
+    def render(self) -> str:
+        """
+        Формирует текст в формате Prometheus exposition
+
+        Returns:
+            Текст для ответа на GET /metrics
+        """
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.description}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# Глобальный реестр метрик
+metrics = MetricsRegistry()
+
+
+async def monitor_event_loop_lag(interval: float) -> None:
+    """
+    Фоновая задача: измеряет задержку event loop
+
+    Раз в interval секунд засыпает и замеряет, насколько позже запланированного
+    проснулась. Большая задержка означает, что loop заблокирован синхронным
+    кодом (запросы к базе, requests.post) и все пользователи ждут.
+
+    Args:
+        interval: Период измерения (секунды)
+    """
+    lag_histogram = metrics.histogram(
+        'event_loop_lag_seconds', 'Задержка пробуждения event loop',
+        buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    )
+    lag_max = metrics.gauge('event_loop_lag_max_seconds', 'Максимальная задержка event loop с запуска')
+    while True:
+        started = time.monotonic()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.monotonic() - started - interval)
+        lag_histogram.observe(lag)
+        if lag > lag_max.value():
+            lag_max.set(lag)
@@ -2,9 +2,9 @@
 Модуль для работы с n8n webhook
 Отправка запросов и получение ответов через прямые webhooks
 """
-import requests
+import time
 import uuid
-from typing import Optional
+from typing import Optional, Dict, Any, Tuple
 from config import (
     N8N_WEBHOOK_OSEBE,
     N8N_WEBHOOK_POST,
@@ -13,8 +13,14 @@ from config import (
     N8N_WEBHOOK_PRODAJ
 )
 from logger import bot_logger
+from services import services
+from circuit_breaker import n8n_guard
+from handoff import handoffs, Resume
 import webhook_server
 
+# Отправленные запросы: request_id -> (тип webhook, время отправки) для предохранителя и задержек
+_sent: Dict[str, Tuple[str, float]] = {}
+
 
 def generate_request_id() -> str:
     """
@@ -26,7 +32,13 @@ def generate_request_id() -> str:
     return str(uuid.uuid4())
 
 
-def send_to_n8n(telegram_id: int, text: str, request_id: str, webhook_type: str) -> bool:
+def send_to_n8n(
+    telegram_id: int,
+    text: str,
+    request_id: str,
+    webhook_type: str,
+    extra: Optional[Dict[str, Any]] = None
+) -> bool:
     """
     Отправляет данные в n8n через webhook
     
@@ -35,9 +47,11 @@ def send_to_n8n(telegram_id: int, text: str, request_id: str, webhook_type: str)
         text: Текст для отправки (промпт или ответ пользователя)
         request_id: Уникальный ID запроса
         webhook_type: Тип webhook ('osebe', 'post', 'bluebutt', 'anons', 'prodaj')
+        extra: Дополнительные поля payload (например, batch для пакетной генерации)
         
     Returns:
         True если запрос отправлен успешно, False если нет
+        (в том числе сразу, если предохранитель этого типа разомкнут)
     """
     # Определяем URL webhook в зависимости от типа
     webhook_urls = {
@@ -62,20 +76,30 @@ def send_to_n8n(telegram_id: int, text: str, request_id: str, webhook_type: str)
                         telegram_id=telegram_id)
         return False
     
+    # n8n не отвечает - отказываем сразу, а не после полного таймаута
+    breaker = n8n_guard.breaker(webhook_type)
+    if not breaker.allow():
+        bot_logger.warning('N8N', f'Предохранитель {webhook_type} разомкнут, запрос не отправлен',
+                           telegram_id=telegram_id, request_id=request_id)
+        return False
+    
     try:
         payload = {
             "telegram_id": telegram_id,
             "text": text,
             "request_id": request_id
         }
+        if extra:
+            payload.update(extra)
         
-        response = requests.post(
+        response = services.http.post(
             webhook_url,
             json=payload,
             timeout=10
         )
         
         if response.status_code == 200:
+            _sent[request_id] = (webhook_type, time.monotonic())
             bot_logger.n8n_request_sent(telegram_id, request_id, text[:50])
             bot_logger.info('N8N', f'Запрос отправлен на {webhook_type}', telegram_id=telegram_id, 
                           request_id=request_id, webhook_type=webhook_type)
@@ -83,9 +107,11 @@ def send_to_n8n(telegram_id: int, text: str, request_id: str, webhook_type: str)
         else:
             bot_logger.error('N8N', f'HTTP {response.status_code}', telegram_id=telegram_id, 
                            request_id=request_id, url=webhook_url, webhook_type=webhook_type)
+            breaker.record_failure()
             return False
             
     except Exception as e:
+        breaker.record_failure()
         bot_logger.n8n_error(telegram_id, str(e))
         bot_logger.error('N8N', f'Ошибка подключения: {str(e)}', telegram_id=telegram_id, 
                         url=webhook_url, webhook_type=webhook_type)
@@ -95,7 +121,8 @@ def send_to_n8n(telegram_id: int, text: str, request_id: str, webhook_type: str)
 async def wait_for_n8n_response(
     telegram_id: int,
     request_id: str,
-    timeout: int = 180
+    timeout: Optional[float] = None,
+    resume: Optional[Resume] = None
 ) -> Optional[str]:
     """
     Ожидает ответ от n8n через webhook
@@ -103,15 +130,118 @@ async def wait_for_n8n_response(
     Args:
         telegram_id: ID пользователя в Telegram
         request_id: ID запроса
-        timeout: Время ожидания в секундах (по умолчанию 180 = 3 минуты)
+        timeout: Время ожидания в секундах (по умолчанию - по задержкам этого типа webhook,
+                 см. circuit_breaker.py, не больше N8N_TIMEOUT_MAX)
+        resume: Продолжение шага, если бот остановится раньше ответа (см. handoff.py)
         
     Returns:
         Ответ от n8n или None если ответ не получен
+        
+    Raises:
+        HandedOff: бот останавливается, ожидание передано следующему запуску
     """
-    response = await webhook_server.wait_for_response(request_id, timeout)
+    sent = _sent.get(request_id)
+    if timeout is None:
+        timeout = n8n_guard.timeout(sent[0] if sent else None)
     
+    try:
+        response = await handoffs.wait(
+            telegram_id, request_id, timeout, webhook_server.wait_for_response(request_id, timeout), resume
+        )
+    finally:
+        _sent.pop(request_id, None)
+    
+    record_outcome(sent, bool(response), observe_latency=True)
     if not response:
-        bot_logger.n8n_timeout(telegram_id, request_id, timeout)
+        bot_logger.n8n_timeout(telegram_id, request_id, round(timeout))
     
     return response
 
+
+
+async def wait_for_n8n_batch_response(
+    telegram_id: int,
+    request_id: str,
+    timeout: int = 300,
+    resume: Optional[Resume] = None
+) -> Optional[Dict[int, str]]:
+    """
+    Ожидает пакетный ответ от n8n (один callback с несколькими результатами)
+    
+    Args:
+        telegram_id: ID пользователя в Telegram
+        request_id: ID пакетного запроса
+        timeout: Время ожидания в секундах
+        resume: Продолжение шага, если бот остановится раньше ответа (см. handoff.py)
+        
+    Returns:
+        Словарь {номер части: текст} или None если ответ не получен или не является пакетом
+        
+    Raises:
+        HandedOff: бот останавливается, ожидание передано следующему запуску
+    """
+    sent = _sent.get(request_id)
+    try:
+        response = await handoffs.wait(
+            telegram_id, request_id, timeout, webhook_server.wait_for_response(request_id, timeout), resume
+        )
+    finally:
+        _sent.pop(request_id, None)
+    
+    # Пакет дольше одиночного запроса: задержка в расчет таймаута не идет
+    record_outcome(sent, bool(response), observe_latency=False)
+    if not response:
+        bot_logger.n8n_timeout(telegram_id, request_id, timeout)
+        return None
+    
+    return normalize_batch_response(response, request_id) or None
+
+
+def record_outcome(sent: Optional[Tuple[str, float]], answered: bool, observe_latency: bool) -> None:
+    """
+    Учитывает результат ожидания в предохранителе и задержках типа webhook
+    
+    Args:
+        sent: Тип webhook и время отправки (None - запрос отправлен не этим запуском)
+        answered: Получен ли ответ до таймаута
+        observe_latency: Учитывать ли задержку (или истекший таймаут) в расчете таймаута
+    """
+    if sent is None:
+        return
+    webhook_type, sent_at = sent
+    if answered:
+        n8n_guard.breaker(webhook_type).record_success()
+        if observe_latency:
+            n8n_guard.latency(webhook_type).observe(time.monotonic() - sent_at)
+    else:
+        n8n_guard.breaker(webhook_type).record_failure()
+        if observe_latency:
+            n8n_guard.latency(webhook_type).observe_timeout(time.monotonic() - sent_at)
+
+
+def normalize_batch_response(response: Any, request_id: Optional[str] = None) -> Dict[int, str]:
+    """
+    Приводит пакетный ответ к словарю {номер части: текст}
+    
+    Args:
+        response: Словарь частей (ключи - числа или строки после JSON)
+        request_id: ID пакетного запроса (для логов)
+        
+    Returns:
+        Словарь {номер части: текст}; пустой, если n8n ответил не пакетом
+    """
+    if not isinstance(response, dict):
+        # Одиночный текст на пакетный запрос - ошибка протокола, а не первая часть пакета
+        bot_logger.error('N8N', 'Ответ n8n на пакетный запрос не является пакетом',
+                         request_id=request_id, response_type=type(response).__name__)
+        return {}
+    
+    parts = {}
+    for key, text in response.items():
+        number = webhook_server.parse_part_number(key)
+        if number is None:
+            bot_logger.warning('N8N', f'Часть пакетного ответа с некорректным номером пропущена: {key!r}',
+                               request_id=request_id)
+            continue
+        parts[number] = text
+    return parts
@@ -0,0 +1,340 @@
+"""
+Локальное хранилище user_data и состояния бота для python-telegram-bot
+
+Без persistence context.user_data живет только в памяти и после каждого
+перезапуска пуст. SQLitePersistence хранит его во встроенной базе SQLite
+(режим WAL) на диске рядом с ботом, без сетевых запросов:
+
+  - загрузка ленивая: при запуске ничего не читается, данные пользователя
+    подгружаются одним запросом по первичному ключу при первом его
+    обновлении после запуска (refresh_user_data);
+  - запись пакетная: PTB раз в update_interval секунд передает данные
+    пользователей, затронутых за это время; неизменившиеся отбрасываются,
+    остальные собираются flush_delay секунд и пишутся одной транзакцией
+    в отдельном потоке, не блокируя event loop;
+  - при остановке (flush) несохраненное записывается сразу, а WAL
+    переносится в основной файл.
+
+Значения хранятся как JSON, поэтому в user_data должны быть только
+JSON-совместимые данные (строки, числа, списки, словари).
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Optional, Set, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from logger import bot_logger
+from metrics import metrics
+
+# Виды записей в таблице
+USER, CHAT, BOT, CALLBACK, CONVERSATION = 'user', 'chat', 'bot', 'callback', 'conversation'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS persistence (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (kind, key)
+) WITHOUT ROWID
+"""
+
+persistence_loads_total = metrics.counter(
+    'persistence_loads_total', 'Ленивые загрузки данных из локального хранилища (found, empty)'
+)
+persistence_rows_written_total = metrics.counter(
+    'persistence_rows_written_total', 'Записей в локальное хранилище (upsert, delete)'
+)
+persistence_flush_seconds = metrics.histogram(
+    'persistence_flush_seconds', 'Длительность пакетной записи в локальное хранилище',
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+)
+
+# Ключ записи: (вид, ключ) -> JSON или None (удалить)
+RowKey = Tuple[str, str]
+
+
+class SQLitePersistence(BasePersistence):
+    """Persistence для PTB во встроенной базе SQLite с ленивой загрузкой и пакетной записью"""
+
+    def __init__(
+        self,
+        filepath: str,
+        update_interval: float = 5,
+        flush_delay: float = 1,
+        store_data: Optional[PersistenceInput] = None
+    ):
+        """
+        Args:
+            filepath: Путь к файлу базы (папка создается при открытии)
+            update_interval: Как часто PTB передает измененные данные (секунды)
+            flush_delay: Сколько собирать изменения перед записью одной транзакцией (секунды)
+            store_data: Что хранить; по умолчанию user_data и bot_data (chat_data в личных
+                чатах совпадает с user_data, callback_data бот не использует)
+        """
+        super().__init__(
+            store_data=store_data or PersistenceInput(chat_data=False, callback_data=False),
+            update_interval=update_interval
+        )
+        self.filepath = filepath
+        self.flush_delay = flush_delay
+        self._reader: Optional[sqlite3.Connection] = None
+        self._writer: Optional[sqlite3.Connection] = None
+        self._loaded: Set[RowKey] = set()
+        # Последнее записанное значение: неизменившиеся данные не пишутся повторно
+        self._written: Dict[RowKey, str] = {}
+        self._pending: Dict[RowKey, Optional[str]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._write_lock = asyncio.Lock()
+
+    # ------------------------------------------------------------------
+    # Соединения
+    # ------------------------------------------------------------------
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.filepath, check_same_thread=False, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        # В WAL с synchronous=NORMAL коммит не ждет fsync; при сбое питания
+        # теряются только последние транзакции, база остается целой
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    def _open(self) -> None:
+        if self._reader is not None:
+            return
+        folder = os.path.dirname(self.filepath)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._writer = self._connect()
+        self._writer.execute(_SCHEMA)
+        # Чтение идет в event loop отдельным соединением: в WAL оно не ждет записи
+        self._reader = self._connect()
+        bot_logger.info('SYSTEM', 'Открыто локальное хранилище состояния', file=self.filepath)
+
+    def _read(self, kind: str, key: str) -> Optional[Any]:
+        self._open()
+        row = self._reader.execute(
+            'SELECT data FROM persistence WHERE kind = ? AND key = ?', (kind, key)
+        ).fetchone()
+        if row is None:
+            return None
+        self._written[(kind, key)] = row[0]
+        return json.loads(row[0])
+
+    def _read_kind(self, kind: str) -> Dict[str, Any]:
+        self._open()
+        rows = self._reader.execute('SELECT key, data FROM persistence WHERE kind = ?', (kind,)).fetchall()
+        return {key: json.loads(data) for key, data in rows}
+
+    def _load(self, kind: str, key: str) -> Optional[Any]:
+        """Читает запись один раз за время работы бота"""
+        row_key = (kind, key)
+        if row_key in self._loaded:
+            return None
+        self._loaded.add(row_key)
+        data = self._read(kind, key)
+        persistence_loads_total.inc(kind=kind, result='found' if data is not None else 'empty')
+        return data
+
+    # ------------------------------------------------------------------
+    # Пакетная запись
+    # ------------------------------------------------------------------
+
+    def _stage(self, kind: str, key: str, data: Any) -> None:
+        """Ставит запись в пакет, если она отличается от сохраненной"""
+        row_key = (kind, key)
+        try:
+            encoded = json.dumps(data, ensure_ascii=False, sort_keys=True)
+        except (TypeError, ValueError) as e:
+            bot_logger.error('SYSTEM', f'Данные не сохранены в локальное хранилище: {str(e)}',
+                             kind=kind, key=key, error=e)
+            return
+        if self._pending.get(row_key, self._written.get(row_key)) == encoded:
+            return
+        self._pending[row_key] = encoded
+        self._schedule_flush()
+
+    def _stage_delete(self, kind: str, key: str) -> None:
+        row_key = (kind, key)
+        self._loaded.add(row_key)
+        self._pending[row_key] = None
+        self._schedule_flush()
+
+    def _schedule_flush(self) -> None:
+        # Первое изменение запускает отложенную запись, следующие попадают в тот же пакет
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self) -> None:
+        await asyncio.sleep(self.flush_delay)
+        # Запись, которая уже идет в потоке, не прерывается остановкой (flush дождется ее)
+        await asyncio.shield(self._write_pending())
+
+    async def _write_pending(self) -> None:
+        async with self._write_lock:
+            if not self._pending:
+                return
+            self._open()
+            batch, self._pending = self._pending, {}
+            started = time.monotonic()
+            try:
+                await asyncio.to_thread(self._write_batch, batch)
+            except sqlite3.Error as e:
+                # Возвращаем пакет: более новые значения, пришедшие за время записи, важнее
+                self._pending = {**batch, **self._pending}
+                bot_logger.error('SYSTEM', f'Ошибка записи в локальное хранилище: {str(e)}',
+                                 rows=len(batch), error=e)
+                return
+            persistence_flush_seconds.observe(time.monotonic() - started)
+            for row_key, encoded in batch.items():
+                if encoded is None:
+                    self._written.pop(row_key, None)
+                    persistence_rows_written_total.inc(op='delete')
+                else:
+                    self._written[row_key] = encoded
+                    persistence_rows_written_total.inc(op='upsert')
+
+    def _write_batch(self, batch: Dict[RowKey, Optional[str]]) -> None:
+        """Пишет пакет одной транзакцией (выполняется в отдельном потоке)"""
+        upserts = [(kind, key, data) for (kind, key), data in batch.items() if data is not None]
+        deletes = [(kind, key) for (kind, key), data in batch.items() if data is None]
+        self._writer.execute('BEGIN')
+        try:
+            if upserts:
+                self._writer.executemany(
+                    'INSERT INTO persistence (kind, key, data) VALUES (?, ?, ?) '
+                    'ON CONFLICT (kind, key) DO UPDATE SET data = excluded.data',
+                    upserts
+                )
+            if deletes:
+                self._writer.executemany('DELETE FROM persistence WHERE kind = ? AND key = ?', deletes)
+            self._writer.execute('COMMIT')
+        except sqlite3.Error:
+            self._writer.execute('ROLLBACK')
+            raise
+
+    def _merge_unloaded(self, kind: str, key: str, data: dict) -> Optional[dict]:
+        """
+        Данные, которые PTB передает для сохранения до ленивой загрузки
+
+        PTB сохраняет user_data каждого пользователя с обновлением, даже если
+        ни один обработчик не сработал и данные не загружались. Пустой словарь
+        в этом случае не пишется (и не затирает сохраненные данные), а
+        непустой дополняется сохраненными.
+        """
+        if not data:
+            return None
+        stored = self._load(kind, key)
+        if stored:
+            return {**stored, **data}
+        return data
+
+    # ------------------------------------------------------------------
+    # user_data
+    # ------------------------------------------------------------------
+
+    async def get_user_data(self) -> Dict[int, Dict[Any, Any]]:
+        # Загрузка ленивая: данные читаются в refresh_user_data
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[Any, Any]) -> None:
+        stored = self._load(USER, str(user_id))
+        if stored:
+            # Значения, установленные до загрузки, новее сохраненных
+            for name, value in stored.items():
+                user_data.setdefault(name, value)
+
+    async def update_user_data(self, user_id: int, data: Dict[Any, Any]) -> None:
+        key = str(user_id)
+        if (USER, key) not in self._loaded:
+            data = self._merge_unloaded(USER, key, data)
+            if data is None:
+                return
+        self._stage(USER, key, data)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._stage_delete(USER, str(user_id))
+
+    # ------------------------------------------------------------------
+    # chat_data
+    # ------------------------------------------------------------------
+
+    async def get_chat_data(self) -> Dict[int, Dict[Any, Any]]:
+        return {}
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict[Any, Any]) -> None:
+        stored = self._load(CHAT, str(chat_id))
+        if stored:
+            for name, value in stored.items():
+                chat_data.setdefault(name, value)
+
+    async def update_chat_data(self, chat_id: int, data: Dict[Any, Any]) -> None:
+        key = str(chat_id)
+        if (CHAT, key) not in self._loaded:
+            data = self._merge_unloaded(CHAT, key, data)
+            if data is None:
+                return
+        self._stage(CHAT, key, data)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._stage_delete(CHAT, str(chat_id))
+
+    # ------------------------------------------------------------------
+    # bot_data, callback_data, conversations
+    # ------------------------------------------------------------------
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        self._loaded.add((BOT, ''))
+        return self._read(BOT, '') or {}
+
+    async def refresh_bot_data(self, bot_data: Dict[Any, Any]) -> None:
+        # bot_data меняет только этот процесс, в памяти всегда актуальная версия
+        pass
+
+    async def update_bot_data(self, data: Dict[Any, Any]) -> None:
+        self._stage(BOT, '', data)
+
+    async def get_callback_data(self) -> Optional[Any]:
+        data = self._read(CALLBACK, '')
+        if data is None:
+            return None
+        buttons, query_ids = data
+        return [tuple(entry) for entry in buttons], query_ids
+
+    async def update_callback_data(self, data: Any) -> None:
+        self._stage(CALLBACK, '', data)
+
+    async def get_conversations(self, name: str) -> Dict[Tuple[Any, ...], object]:
+        rows = self._read_kind(f'{CONVERSATION}:{name}')
+        return {tuple(json.loads(key)): state for key, state in rows.items()}
+
+    async def update_conversation(self, name: str, key: Tuple[Any, ...], new_state: Optional[object]) -> None:
+        row_key = json.dumps(list(key))
+        if new_state is None:
+            self._stage_delete(f'{CONVERSATION}:{name}', row_key)
+        else:
+            self._stage(f'{CONVERSATION}:{name}', row_key, new_state)
+
+    # ------------------------------------------------------------------
+    # Остановка
+    # ------------------------------------------------------------------
+
+    async def flush(self) -> None:
+        """Записывает все несохраненное и закрывает базу (вызывается PTB при остановке)"""
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self._write_pending()
+        if self._writer is None:
+            return
+        try:
+            # Переносим WAL в основной файл, чтобы он не рос между запусками
+            self._writer.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        except sqlite3.Error as e:
+            bot_logger.warning('SYSTEM', f'Не удалось сжать WAL локального хранилища: {str(e)}')
+        self._reader.close()
+        self._writer.close()
+        self._reader = self._writer = None
+        bot_logger.info('SYSTEM', 'Локальное хранилище состояния сохранено', file=self.filepath)
@@ -0,0 +1,143 @@
+"""
+Конвейерная генерация постов
+
+Пока пользователь отвечает на вопросы поста N+1, пост N генерируется в фоне.
+Готовые посты доставляются строго по порядку номеров, даже если n8n
+ответил на более поздний пост раньше.
+"""
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from handoff import HandedOff
+from logger import bot_logger
+
+# Результат поста, ожидание которого передано следующему запуску бота
+HANDED_OFF = object()
+
+# Генерация поста: возвращает текст или None при ошибке
+GenerateFunc = Callable[[], Awaitable[Optional[str]]]
+# Доставка результата пользователю: (номер поста, текст или None)
+DeliverFunc = Callable[[int, Optional[str]], Awaitable[None]]
+
+
+class UserPipeline:
+    """Посты одного пользователя, находящиеся в генерации"""
+
+    def __init__(self, first_post: int):
+        self.tasks: Dict[int, asyncio.Task] = {}
+        self.results: Dict[int, Optional[str]] = {}
+        self.delivers: Dict[int, DeliverFunc] = {}
+        self.next_to_deliver = first_post
+        self.lock = asyncio.Lock()
+
+    def is_empty(self) -> bool:
+        return not self.tasks and not self.results
+
+
+class PostPipeline:
+    """Менеджер фоновой генерации постов для всех пользователей"""
+
+    def __init__(self):
+        self._users: Dict[int, UserPipeline] = {}
+
+    def submit(
+        self,
+        telegram_id: int,
+        post_num: int,
+        generate: GenerateFunc,
+        deliver: DeliverFunc
+    ) -> None:
+        """
+        Ставит пост в фоновую генерацию
+
+        Args:
+            telegram_id: ID пользователя
+            post_num: Номер поста (1-5)
+            generate: Корутина генерации текста поста
+            deliver: Корутина доставки результата пользователю
+        """
+        pipeline = self._users.get(telegram_id)
+        if pipeline is None or pipeline.is_empty():
+            pipeline = UserPipeline(post_num)
+            self._users[telegram_id] = pipeline
+
+        pipeline.delivers[post_num] = deliver
+        pipeline.tasks[post_num] = asyncio.create_task(
+            self._run(telegram_id, pipeline, post_num, generate)
+        )
+
+        bot_logger.info('POSTS', f'Пост {post_num} поставлен в фоновую генерацию',
+                        telegram_id=telegram_id, in_flight=len(pipeline.tasks))
+
+    def in_flight(self, telegram_id: int) -> List[int]:
+        """
+        Возвращает номера постов, которые еще не доставлены пользователю
+
+        Args:
+            telegram_id: ID пользователя
+
+        Returns:
+            Отсортированный список номеров постов
+        """
+        pipeline = self._users.get(telegram_id)
+        if not pipeline:
+            return []
+        return sorted(set(pipeline.tasks) | set(pipeline.results))
+
+    def cancel(self, telegram_id: int) -> None:
+        """
+        Отменяет все фоновые генерации пользователя (например, при перезапуске постов)
+
+        Args:
+            telegram_id: ID пользователя
+        """
+        pipeline = self._users.pop(telegram_id, None)
+        if not pipeline:
+            return
+        for task in pipeline.tasks.values():
+            task.cancel()
+
+    async def _run(
+        self,
+        telegram_id: int,
+        pipeline: UserPipeline,
+        post_num: int,
+        generate: GenerateFunc
+    ) -> None:
+        """Выполняет генерацию и доставляет готовые посты по порядку"""
+        try:
+            result = await generate()
+        except asyncio.CancelledError:
+            raise
+        except HandedOff:
+            # Пост доставит следующий запуск, готовые после него - доставляем сейчас
+            result = HANDED_OFF
+        except Exception as e:
+            bot_logger.error('POSTS', f'Ошибка фоновой генерации поста {post_num}: {str(e)}',
+                             telegram_id=telegram_id)
+            result = None
+
+        async with pipeline.lock:
+            pipeline.tasks.pop(post_num, None)
+            pipeline.results[post_num] = result
+
+            # Доставляем все посты, которые готовы подряд начиная с ожидаемого
+            while pipeline.next_to_deliver in pipeline.results:
+                number = pipeline.next_to_deliver
+                text = pipeline.results.pop(number)
+                deliver = pipeline.delivers.pop(number)
+                pipeline.next_to_deliver += 1
+                if text is HANDED_OFF:
+                    continue
+                try:
+                    await deliver(number, text)
+                except Exception as e:
+                    bot_logger.error('POSTS', f'Ошибка доставки поста {number}: {str(e)}',
+                                     telegram_id=telegram_id)
+
+            if pipeline.is_empty() and self._users.get(telegram_id) is pipeline:
+                del self._users[telegram_id]
+
+
+# Глобальный экземпляр конвейера
+post_pipeline = PostPipeline()
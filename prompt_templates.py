@@ -0,0 +1,197 @@
+"""
+Шаблоны промптов: компиляция в список токенов и подстановка за один проход
+
+Плейсхолдеры в промптах (таблицы prompts и posts):
+  - явные: {{vopros_1}}, {{link10}}
+  - старые "голые" имена: vopros_1, link1 - только целым словом,
+    поэтому link1 не задевает link10, а blueotvet1 - blueotvet12
+
+Шаблон компилируется один раз на версию (версия - текст шаблона: после
+правки в БД он компилируется заново), подстановка идет за один проход,
+так что ответы пользователя, содержащие имена плейсхолдеров, повторно
+не заменяются. Неизвестные и отсутствующие плейсхолдеры попадают в лог
+при компиляции - при запуске бота (preload) или при первой встрече версии.
+"""
+import re
+from collections import OrderedDict
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from config import BLUE_BUTTON_QUESTIONS, BEST_LINKS_COUNT, QUESTIONS_PER_POST
+from database import Database
+from logger import bot_logger
+from metrics import metrics
+
+db = Database()
+
+# Переменные каждого вида промпта
+PROMPT_VARIABLES: Dict[str, Tuple[str, ...]] = {
+    'prompt_osebe': ('otvet_osebe',),
+    'prompt_post': tuple(f'vopros_{i}' for i in range(1, QUESTIONS_PER_POST + 1)),
+    'prompt_bluebutt': (
+        tuple(f'blueotvet{i}' for i in range(1, BLUE_BUTTON_QUESTIONS + 1))
+        + tuple(f'link{i}' for i in range(1, BEST_LINKS_COUNT + 1))
+    ),
+    'prompt_anons': ('anons1', 'anons2'),
+    'prompt_prodaj': ('prodaj1', 'prodaj2', 'prodaj3'),
+}
+
+# Сколько версий шаблонов держать в кеше (5 промптов + 5 постов и их правки)
+TEMPLATE_CACHE_SIZE = 64
+
+_EXPLICIT_PATTERN = r'\{\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*\}\}'
+_WORD = 'A-Za-z0-9_'
+
+template_compiles_total = metrics.counter(
+    'prompt_template_compiles_total', 'Компиляций шаблонов промптов (новые версии)'
+)
+template_warnings_total = metrics.counter(
+    'prompt_template_warnings_total', 'Предупреждений при компиляции шаблонов промптов'
+)
+
+
+class PromptTemplate:
+    """Скомпилированный шаблон: литералы и позиции плейсхолдеров"""
+
+    def __init__(self, kind: str, text: str, parts: List[str], slots: List[Tuple[int, str]], warnings: List[str]):
+        self.kind = kind
+        self.text = text
+        self.warnings = warnings
+        self._parts = parts
+        self._slots = slots
+
+    @property
+    def placeholders(self) -> List[str]:
+        """Имена плейсхолдеров в порядке появления"""
+        return [name for _, name in self._slots]
+
+    def render(self, values: Mapping[str, Any]) -> str:
+        """
+        Подставляет значения за один проход
+
+        Args:
+            values: Значения переменных (отсутствующие и None - пустая строка)
+
+        Returns:
+            Готовый текст промпта
+        """
+        parts = self._parts.copy()
+        for index, name in self._slots:
+            value = values.get(name)
+            parts[index] = '' if value is None else str(value)
+        return ''.join(parts)
+
+
+def _build_pattern(variables: Sequence[str]) -> 're.Pattern[str]':
+    # Длинные имена раньше коротких, плюс границы слова: link10 никогда не читается как link1 + "0"
+    names = '|'.join(re.escape(name) for name in sorted(variables, key=len, reverse=True))
+    return re.compile(f'{_EXPLICIT_PATTERN}|(?<![{_WORD}])({names})(?![{_WORD}])')
+
+
+_PATTERNS = {kind: _build_pattern(variables) for kind, variables in PROMPT_VARIABLES.items()}
+
+
+def compile_template(kind: str, text: str) -> PromptTemplate:
+    """
+    Разбирает шаблон на литералы и плейсхолдеры (без кеша)
+
+    Args:
+        kind: Вид промпта (ключ PROMPT_VARIABLES)
+        text: Текст шаблона
+
+    Returns:
+        Скомпилированный шаблон; warnings - неизвестные и отсутствующие плейсхолдеры
+    """
+    variables = PROMPT_VARIABLES[kind]
+    parts: List[str] = []
+    slots: List[Tuple[int, str]] = []
+    unknown: List[str] = []
+    position = 0
+
+    for match in _PATTERNS[kind].finditer(text):
+        explicit, bare = match.group(1), match.group(2)
+        name = explicit or bare
+        if name not in variables:
+            # {{что-то}} вне списка переменных оставляем как есть
+            unknown.append(name)
+            continue
+        parts.append(text[position:match.start()])
+        slots.append((len(parts), name))
+        parts.append('')
+        position = match.end()
+    parts.append(text[position:])
+
+    warnings = []
+    if unknown:
+        warnings.append(f'неизвестные плейсхолдеры: {", ".join(dict.fromkeys(unknown))}')
+    missing = [name for name in variables if name not in {slot_name for _, slot_name in slots}]
+    if missing:
+        warnings.append(f'нет плейсхолдеров: {", ".join(missing)}')
+
+    return PromptTemplate(kind, text, parts, slots, warnings)
+
+
+class PromptTemplateCache:
+    """Кеш скомпилированных шаблонов по виду промпта и версии (тексту)"""
+
+    def __init__(self, max_size: int = TEMPLATE_CACHE_SIZE):
+        self.max_size = max_size
+        self._templates: 'OrderedDict[Tuple[str, str], PromptTemplate]' = OrderedDict()
+
+    def get(self, kind: str, text: str, source: Optional[str] = None) -> PromptTemplate:
+        """
+        Возвращает скомпилированный шаблон, компилируя новую версию при первой встрече
+
+        Args:
+            kind: Вид промпта (ключ PROMPT_VARIABLES)
+            text: Текст шаблона из БД или запасной из кода
+            source: Откуда шаблон (для лога), по умолчанию kind
+
+        Returns:
+            Скомпилированный шаблон
+        """
+        key = (kind, text)
+        template = self._templates.get(key)
+        if template is not None:
+            self._templates.move_to_end(key)
+            return template
+
+        template = compile_template(kind, text)
+        template_compiles_total.inc(kind=kind)
+        for warning in template.warnings:
+            template_warnings_total.inc(kind=kind)
+            bot_logger.warning('PROMPT', f'Шаблон {source or kind}: {warning}', kind=kind)
+
+        self._templates[key] = template
+        if len(self._templates) > self.max_size:
+            self._templates.popitem(last=False)
+        return template
+
+    def render(self, kind: str, text: str, values: Mapping[str, Any], source: Optional[str] = None) -> str:
+        """Компилирует (при необходимости) и заполняет шаблон"""
+        return self.get(kind, text, source).render(values)
+
+    def preload(self) -> Dict[str, List[str]]:
+        """
+        Компилирует все промпты из таблиц prompts и posts, чтобы
+        ошибки в шаблонах были видны при запуске, а не на первом пользователе
+
+        Returns:
+            Предупреждения по шаблонам {источник: [предупреждения]}
+        """
+        warnings: Dict[str, List[str]] = {}
+        for prompt in db.get_all_prompts():
+            kind = prompt.get('prompt_name')
+            if kind in PROMPT_VARIABLES and prompt.get('prompt_text'):
+                template = self.get(kind, prompt['prompt_text'])
+                if template.warnings:
+                    warnings[kind] = template.warnings
+        for post in db.get_all_posts():
+            if post.get('prompt_post'):
+                source = f'posts[{post.get("post_number")}]'
+                template = self.get('prompt_post', post['prompt_post'], source)
+                if template.warnings:
+                    warnings[source] = template.warnings
+        return warnings
+
+
+prompt_templates = PromptTemplateCache()
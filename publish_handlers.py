@@ -10,10 +10,16 @@ from telegram.constants import ParseMode
 from database import Database
 from config import UserState, BLUE_BUTTON_QUESTIONS, BEST_LINKS_COUNT
 import messages
-from channel_helper import check_if_channel, check_bot_admin, publish_post_to_channel
+from channel_helper import (
+    check_if_channel, check_bot_admin, update_channel_cache_from_member
+)
 from n8n_helper import generate_request_id, send_to_n8n, wait_for_n8n_response
+from generation_queue import generation_queue
+from handoff import handoffs, Resume
 from logger import bot_logger
 from video_helper import send_video_safe
+from publish_queue import publish_queue
+from prompt_templates import prompt_templates
 
 # Инициализация базы данных
 db = Database()
@@ -98,6 +104,21 @@ async def process_channel_link(update: Update, context: ContextTypes.DEFAULT_TYP
     )
 
 
+async def handle_my_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Обрабатывает изменение статуса бота в канале (добавлен, удален, изменены права)
+    и обновляет кеш проверок каналов
+    """
+    change = update.my_chat_member
+    if not change or change.chat.type != 'channel':
+        return
+    
+    can_post = update_channel_cache_from_member(change.chat, change.new_chat_member)
+    bot_logger.info('PUBLISH', 'Изменен статус бота в канале',
+                    channel_id=change.chat.id, status=change.new_chat_member.status,
+                    can_post=can_post)
+
+
 async def check_bot_admin_status(query, context: ContextTypes.DEFAULT_TYPE, telegram_id: int) -> None:
     """
     Проверяет, является ли бот администратором канала
@@ -160,20 +181,15 @@ async def ask_blue_question(context: ContextTypes.DEFAULT_TYPE, telegram_id: int
         )
 
 
-async def process_blue_answer(update: Update, context: ContextTypes.DEFAULT_TYPE, telegram_id: int, answer: str, question_num: int) -> None:
+async def process_blue_answer(update: Update, context: ContextTypes.DEFAULT_TYPE, telegram_id: int, answer: str) -> None:
     """
     Обрабатывает ответ на вопрос для поста с кнопкой
     """
-    # Получаем текущие ответы
-    blue_data = db.get_blue_button_data(telegram_id)
-    if not blue_data:
-        blue_data = {'blue_answers': {}}
-    
-    blue_answers = blue_data.get('blue_answers', {})
-    
-    # Сохраняем ответ
-    blue_answers[f'blueotvet{question_num}'] = answer
-    db.save_blue_button_data(telegram_id, blue_answers=blue_answers)
+    # Сохраняем ответ следующим номером (blueotvetN) - номер вопроса возвращает база
+    question_num = db.append_numbered_answer(telegram_id, 'blue_answers', 'blueotvet', answer)
+    if question_num is None:
+        await update.message.reply_text(messages.ANSWER_SAVE_ERROR, parse_mode=ParseMode.HTML)
+        return
     
     # Если это был последний вопрос - переходим к запросу ссылок
     if question_num >= BLUE_BUTTON_QUESTIONS:
@@ -212,20 +228,15 @@ async def request_best_link(context: ContextTypes.DEFAULT_TYPE, telegram_id: int
     )
 
 
-async def process_best_link(update: Update, context: ContextTypes.DEFAULT_TYPE, telegram_id: int, link: str, link_num: int) -> None:
+async def process_best_link(update: Update, context: ContextTypes.DEFAULT_TYPE, telegram_id: int, link: str) -> None:
     """
     Обрабатывает ссылку на лучший пост
     """
-    # Получаем текущие ссылки
-    blue_data = db.get_blue_button_data(telegram_id)
-    if not blue_data:
-        blue_data = {'best_links': {}}
-    
-    best_links = blue_data.get('best_links', {})
-    
-    # Сохраняем ссылку
-    best_links[f'link{link_num}'] = link
-    db.save_blue_button_data(telegram_id, best_links=best_links)
+    # Сохраняем ссылку следующим номером (linkN)
+    link_num = db.append_numbered_answer(telegram_id, 'best_links', 'link', link)
+    if link_num is None:
+        await update.message.reply_text(messages.ANSWER_SAVE_ERROR, parse_mode=ParseMode.HTML)
+        return
     
     # Если это была последняя ссылка - генерируем пост
     if link_num >= BEST_LINKS_COUNT:
@@ -239,19 +250,11 @@ async def handle_skip_link(query, context: ContextTypes.DEFAULT_TYPE, telegram_i
     """
     Обрабатывает пропуск ссылки
     """
-    # Получаем текущие ссылки
-    blue_data = db.get_blue_button_data(telegram_id)
-    if not blue_data:
-        blue_data = {'best_links': {}}
-    
-    best_links = blue_data.get('best_links', {})
-    
-    # Определяем номер текущей ссылки
-    current_link_num = len(best_links) + 1
-    
-    # Сохраняем пустую ссылку
-    best_links[f'link{current_link_num}'] = ""
-    db.save_blue_button_data(telegram_id, best_links=best_links)
+    # Сохраняем пустую ссылку следующим номером
+    current_link_num = db.append_numbered_answer(telegram_id, 'best_links', 'link', "")
+    if current_link_num is None:
+        await query.answer(messages.ANSWER_SAVE_ERROR.strip(), show_alert=True)
+        return
     
     await query.answer("Пропущено")
     
@@ -263,6 +266,21 @@ async def handle_skip_link(query, context: ContextTypes.DEFAULT_TYPE, telegram_i
         await request_best_link(context, telegram_id, current_link_num + 1)
 
 
+def render_blue_button_prompt(prompt_template: str, blue_answers: dict, best_links: dict) -> str:
+    """
+    Подставляет ответы и ссылки пользователя в промпт поста с кнопкой
+    
+    Args:
+        prompt_template: Промпт prompt_bluebutt (с плейсхолдерами blueotvet1..5 и link1..5 или {{link1}}..)
+        blue_answers: Ответы пользователя (blueotvet1..5)
+        best_links: Ссылки на лучшие посты (link1..5)
+        
+    Returns:
+        Готовый текст промпта
+    """
+    return prompt_templates.render('prompt_bluebutt', prompt_template, {**blue_answers, **best_links})
+
+
 async def generate_blue_button_post(update_or_query, context: ContextTypes.DEFAULT_TYPE, telegram_id: int) -> None:
     """
     Генерирует пост с кнопкой через n8n
@@ -299,37 +317,44 @@ async def generate_blue_button_post(update_or_query, context: ContextTypes.DEFAU
         prompt_template = "Создай пост на основе ответов: blueotvet1, blueotvet2, blueotvet3, blueotvet4, blueotvet5. Добавь ссылки: link1, link2, link3, link4, link5"
     
     # Подставляем ответы и ссылки в промпт
-    prompt_text = prompt_template
-    for i in range(1, BLUE_BUTTON_QUESTIONS + 1):
-        answer = blue_answers.get(f'blueotvet{i}', '')
-        prompt_text = prompt_text.replace(f'blueotvet{i}', answer)
-    
-    for i in range(1, BEST_LINKS_COUNT + 1):
-        link = best_links.get(f'link{i}', '')
-        prompt_text = prompt_text.replace(f'link{i}', link)
+    prompt_text = render_blue_button_prompt(prompt_template, blue_answers, best_links)
     
     # Генерируем request_id
     request_id = generate_request_id()
     
-    # Отправляем в n8n (prompt_bluebutt - пост-знакомство)
-    success = send_to_n8n(telegram_id, prompt_text, request_id, 'bluebutt')
-    
-    if not success:
-        await processing_msg.edit_text(
-            messages.BLUE_BUTTON_POST_ERROR,
-            parse_mode=ParseMode.HTML
+    async with generation_queue.slot(telegram_id, 'bluebutt', processing_msg):
+        # Отправляем в n8n (prompt_bluebutt - пост-знакомство)
+        success = await asyncio.to_thread(send_to_n8n, telegram_id, prompt_text, request_id, 'bluebutt')
+        
+        if not success:
+            await processing_msg.edit_text(
+                messages.BLUE_BUTTON_POST_ERROR,
+                parse_mode=ParseMode.HTML
+            )
+            db.update_user_state(telegram_id, UserState.ANSWERING_BLUE_QUESTIONS)
+            await ask_blue_question(context, telegram_id, 1)
+            return
+        
+        # Ждем ответ от n8n через webhook
+        n8n_response = await wait_for_n8n_response(
+            telegram_id,
+            request_id,
+            resume=Resume('bluebutt', processing_msg)
         )
-        db.update_user_state(telegram_id, UserState.ANSWERING_BLUE_QUESTIONS)
-        await ask_blue_question(context, telegram_id, 1)
-        return
-    
-    # Ждем ответ от n8n через webhook
-    n8n_response = await wait_for_n8n_response(
-        telegram_id,
-        request_id,
-        180
-    )
     
+    await finish_blue_button_post(context, telegram_id, n8n_response, processing_msg)
+
+
+@handoffs.resumer('bluebutt')
+async def finish_blue_button_post(
+    context: ContextTypes.DEFAULT_TYPE,
+    telegram_id: int,
+    n8n_response: str | None,
+    processing_msg
+) -> None:
+    """
+    Показывает пост с кнопкой по ответу n8n или возвращает к вопросам при таймауте
+    """
     if n8n_response:
         # Сохраняем текст поста
         db.save_blue_button_data(telegram_id, post_text=n8n_response)
@@ -586,31 +611,63 @@ async def handle_post_confirmation(query, context: ContextTypes.DEFAULT_TYPE, te
     button_text = blue_data.get('button_text', '')
     button_url = blue_data.get('button_url', '')
     
-    # Публикуем пост
-    success, message_id = await publish_post_to_channel(
-        context.bot,
+    # Ставим публикацию в очередь: отправку и закрепление выполнит фоновый обработчик
+    job = publish_queue.enqueue(
+        telegram_id,
         channel_id,
         post_text,
         button_text,
         button_url
     )
     
-    if success:
-        db.update_user_state(telegram_id, UserState.POST_PUBLISHED)
-        await context.bot.send_message(
-            chat_id=telegram_id,
-            text=messages.POST_PUBLISHED_SUCCESS,
-            parse_mode=ParseMode.HTML
-        )
-        
-        # Переходим к созданию анонсов
-        await start_anons_flow(context, telegram_id)
-    else:
+    if not job:
         await context.bot.send_message(
             chat_id=telegram_id,
             text="❌ Ошибка при публикации поста. Попробуйте еще раз.",
             parse_mode=ParseMode.HTML
         )
+        return
+    
+    if job['status'] == 'done':
+        # Повторное нажатие - пост уже опубликован
+        bot_logger.info('PUBLISH', 'Пост уже опубликован, повторная публикация пропущена',
+                        telegram_id=telegram_id, job_id=job['id'])
+        return
+    
+    db.update_user_state(telegram_id, UserState.PUBLISHING_POST)
+    publish_queue.trigger(context)
+
+
+async def on_post_published(context: ContextTypes.DEFAULT_TYPE, job: dict) -> None:
+    """
+    Вызывается очередью публикаций после успешной публикации поста
+    """
+    telegram_id = job['telegram_id']
+    db.update_user_state(telegram_id, UserState.POST_PUBLISHED)
+    await context.bot.send_message(
+        chat_id=telegram_id,
+        text=messages.POST_PUBLISHED_SUCCESS,
+        parse_mode=ParseMode.HTML
+    )
+    
+    # Переходим к созданию анонсов
+    await start_anons_flow(context, telegram_id)
+
+
+async def on_post_publish_failed(context: ContextTypes.DEFAULT_TYPE, job: dict) -> None:
+    """
+    Вызывается очередью публикаций, если пост опубликовать не удалось
+    """
+    telegram_id = job['telegram_id']
+    await context.bot.send_message(
+        chat_id=telegram_id,
+        text="❌ Ошибка при публикации поста. Попробуйте еще раз.",
+        parse_mode=ParseMode.HTML
+    )
+    await show_post_preview(context, telegram_id)
+
+
+publish_queue.set_callbacks(on_post_published, on_post_publish_failed)
 
 
 # ============================================
@@ -755,29 +812,45 @@ async def generate_anons_with_n8n(update: Update, context: ContextTypes.DEFAULT_
         prompt_template = f"Создай анонс для поста на основе: О чем пост: anons1. Ссылка: anons2"
     
     # Подставляем ответы в промпт
-    prompt_text = prompt_template.replace('anons1', anons1).replace('anons2', anons2)
+    prompt_text = prompt_templates.render('prompt_anons', prompt_template, {'anons1': anons1, 'anons2': anons2})
     
     # Генерируем request_id
     request_id = generate_request_id()
     
-    # Отправляем в n8n (prompt_anons - создание анонсов)
-    success = send_to_n8n(telegram_id, prompt_text, request_id, 'anons')
-    
-    if not success:
-        await processing_msg.edit_text(
-            messages.ANONS_ERROR_MESSAGE,
-            parse_mode=ParseMode.HTML
+    user_message_id = update.message.message_id
+    async with generation_queue.slot(telegram_id, 'anons', processing_msg):
+        # Отправляем в n8n (prompt_anons - создание анонсов)
+        success = await asyncio.to_thread(send_to_n8n, telegram_id, prompt_text, request_id, 'anons')
+        
+        if not success:
+            await processing_msg.edit_text(
+                messages.ANONS_ERROR_MESSAGE,
+                parse_mode=ParseMode.HTML
+            )
+            await ask_anons_question(context, telegram_id, 1)
+            return
+        
+        # Ждем ответ от n8n через webhook
+        n8n_response = await wait_for_n8n_response(
+            telegram_id,
+            request_id,
+            resume=Resume('anons', processing_msg, user_message_id=user_message_id)
         )
-        await ask_anons_question(context, telegram_id, 1)
-        return
-    
-    # Ждем ответ от n8n через webhook
-    n8n_response = await wait_for_n8n_response(
-        telegram_id,
-        request_id,
-        180
-    )
     
+    await finish_anons(context, telegram_id, n8n_response, processing_msg, user_message_id)
+
+
+@handoffs.resumer('anons')
+async def finish_anons(
+    context: ContextTypes.DEFAULT_TYPE,
+    telegram_id: int,
+    n8n_response: str | None,
+    processing_msg,
+    user_message_id: int
+) -> None:
+    """
+    Показывает анонс по ответу n8n или возвращает к вопросам при таймауте
+    """
     if n8n_response:
         # Сохраняем готовый анонс
         db.save_anons_data(telegram_id, anons_text=n8n_response)
@@ -790,7 +863,7 @@ async def generate_anons_with_n8n(update: Update, context: ContextTypes.DEFAULT_
         )
         
         # Удаляем ответ пользователя (не нужен больше)
-        await delete_message_safe(context, telegram_id, update.message.message_id)
+        await delete_message_safe(context, telegram_id, user_message_id)
         
         # Автоматически переходим к созданию продающего поста
         await start_sales_post_flow(context, telegram_id)
@@ -955,36 +1028,54 @@ async def generate_sales_post_with_n8n(update: Update, context: ContextTypes.DEF
         prompt_template = f"Создай продающий пост на основе: Продукт: prodaj1. Проблема: prodaj2. Призыв: prodaj3"
     
     # Подставляем ответы в промпт
-    prompt_text = prompt_template.replace('prodaj1', prodaj1).replace('prodaj2', prodaj2).replace('prodaj3', prodaj3)
+    prompt_text = prompt_templates.render(
+        'prompt_prodaj', prompt_template, {'prodaj1': prodaj1, 'prodaj2': prodaj2, 'prodaj3': prodaj3}
+    )
     
     # Генерируем request_id
     request_id = generate_request_id()
     
-    # Отправляем в n8n (prompt_prodaj - продающий пост)
-    success = send_to_n8n(telegram_id, prompt_text, request_id, 'prodaj')
-    
-    if not success:
-        await processing_msg.edit_text(
-            messages.SALES_POST_ERROR_MESSAGE,
-            parse_mode=ParseMode.HTML
+    user_message_id = update.message.message_id
+    async with generation_queue.slot(telegram_id, 'prodaj', processing_msg):
+        # Отправляем в n8n (prompt_prodaj - продающий пост)
+        success = await asyncio.to_thread(send_to_n8n, telegram_id, prompt_text, request_id, 'prodaj')
+        
+        if not success:
+            await processing_msg.edit_text(
+                messages.SALES_POST_ERROR_MESSAGE,
+                parse_mode=ParseMode.HTML
+            )
+            await ask_sales_question(context, telegram_id, 1)
+            return
+        
+        # Ждем ответ от n8n через webhook
+        n8n_response = await wait_for_n8n_response(
+            telegram_id,
+            request_id,
+            resume=Resume('prodaj', processing_msg, user_message_id=user_message_id)
         )
-        await ask_sales_question(context, telegram_id, 1)
-        return
-    
-    # Ждем ответ от n8n через webhook
-    n8n_response = await wait_for_n8n_response(
-        telegram_id,
-        request_id,
-        180
-    )
     
+    await finish_sales_post(context, telegram_id, n8n_response, processing_msg, user_message_id)
+
+
+@handoffs.resumer('prodaj')
+async def finish_sales_post(
+    context: ContextTypes.DEFAULT_TYPE,
+    telegram_id: int,
+    n8n_response: str | None,
+    processing_msg,
+    user_message_id: int
+) -> None:
+    """
+    Показывает продающий пост по ответу n8n или возвращает к вопросам при таймауте
+    """
     if n8n_response:
         # Сохраняем готовый продающий пост
         db.save_sales_data(telegram_id, sales_text=n8n_response)
         db.update_user_state(telegram_id, UserState.SALES_POST_READY)
         
         # Удаляем ответ пользователя (не нужен больше)
-        await delete_message_safe(context, telegram_id, update.message.message_id)
+        await delete_message_safe(context, telegram_id, user_message_id)
         
         # Проверяем количество переписываний
         sales_data = db.get_sales_data(telegram_id)
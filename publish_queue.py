@@ -0,0 +1,281 @@
+"""
+Очередь публикаций в каналы
+
+Публикация - это задача в таблице publish_jobs, которую выполняет фоновый
+обработчик (job_queue). Шаги: отправка поста -> сохранение message_id ->
+закрепление. Если message_id уже сохранен, пост повторно не отправляется,
+поэтому повтор после сбоя закрепления или перезапуска бота не создает дубль.
+Если message_id не удалось сохранить, задача дальше не выполняется: message_id
+хранится в памяти, и следующие проходы сначала повторяют его запись.
+
+Задачи переживают перезапуск бота, публикацию можно запланировать
+на заданное время (scheduled_at).
+"""
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+from telegram.ext import ContextTypes
+
+from channel_helper import send_channel_post, pin_channel_post
+from config import (
+    PUBLISH_CHANNEL_MIN_INTERVAL, PUBLISH_MAX_ATTEMPTS, PUBLISH_RETRY_BASE_DELAY
+)
+from database import Database
+from logger import bot_logger
+from rate_limit import KeyedRateLimiter
+
+# Инициализация базы данных
+db = Database()
+
+# Уведомление о результате задачи: (контекст, задача)
+JobCallback = Callable[[ContextTypes.DEFAULT_TYPE, Dict[str, Any]], Awaitable[None]]
+
+
+class PublishQueue:
+    """Фоновое выполнение задач публикации с повторами и ограничением частоты"""
+
+    def __init__(self, rate_limiter: KeyedRateLimiter, max_attempts: int, retry_base_delay: int):
+        """
+        Args:
+            rate_limiter: Ограничитель частоты отправки по каналам
+            max_attempts: Максимум попыток до перевода задачи в failed
+            retry_base_delay: Пауза перед первым повтором (далее удваивается)
+        """
+        self.rate_limiter = rate_limiter
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.on_published: Optional[JobCallback] = None
+        self.on_failed: Optional[JobCallback] = None
+        self._running = False
+        self._rerun = False
+        # message_id отправленных постов, которые не удалось сохранить: {id задачи: message_id}
+        self._unsaved_message_ids: Dict[Any, int] = {}
+
+    def set_callbacks(self, on_published: JobCallback, on_failed: JobCallback) -> None:
+        """
+        Задает уведомления о публикации и окончательной ошибке
+
+        Args:
+            on_published: Вызывается после отправки (и закрепления) поста
+            on_failed: Вызывается, когда попытки исчерпаны или ошибка неисправима
+        """
+        self.on_published = on_published
+        self.on_failed = on_failed
+
+    def enqueue(
+        self,
+        telegram_id: int,
+        channel_id: int,
+        post_text: str,
+        button_text: str,
+        button_url: str,
+        scheduled_at: Optional[datetime] = None,
+        dedup_key: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Ставит публикацию в очередь
+
+        Повторный вызов с тем же dedup_key не создает новую задачу: у еще не
+        отправленной задачи обновляется текст, задача в статусе failed
+        перезапускается (с закрепления, если пост уже отправлен).
+
+        Args:
+            telegram_id: ID пользователя
+            channel_id: ID канала
+            post_text: Текст поста
+            button_text: Текст кнопки
+            button_url: URL кнопки
+            scheduled_at: Время публикации (UTC), по умолчанию - сразу
+            dedup_key: Ключ дедупликации, по умолчанию - пост-знакомство пользователя в канале
+
+        Returns:
+            Задача или None при ошибке базы данных
+        """
+        key = dedup_key or f'intro:{telegram_id}:{channel_id}'
+        content = {
+            "post_text": post_text,
+            "button_text": button_text,
+            "button_url": button_url,
+            "scheduled_at": scheduled_at.isoformat() if scheduled_at else None,
+        }
+        job = db.create_publish_job({
+            "telegram_id": telegram_id,
+            "channel_id": channel_id,
+            "dedup_key": key,
+            **content,
+        })
+        if not job:
+            return None
+
+        fields = {}
+        if not job.get('message_id') and job['status'] != 'done':
+            # Пост еще не отправлен - публикуем актуальный текст
+            fields.update({name: value for name, value in content.items() if job.get(name) != value})
+            if scheduled_at and "scheduled_at" in fields:
+                fields["next_attempt_at"] = content["scheduled_at"]
+        if job['status'] == 'failed':
+            fields.update({
+                "status": 'sent' if job.get('message_id') else 'pending',
+                "attempts": 0,
+                "last_error": None,
+                "next_attempt_at": content["scheduled_at"] or datetime.utcnow().isoformat(),
+            })
+        if fields:
+            db.update_publish_job(job['id'], fields)
+            job.update(fields)
+
+        bot_logger.info('PUBLISH', 'Публикация поставлена в очередь', telegram_id=telegram_id,
+                        job_id=job['id'], status=job['status'])
+        return job
+
+    def trigger(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Запускает обработку очереди сейчас, не дожидаясь периодического прохода"""
+        context.job_queue.run_once(self.process_due_jobs, when=0)
+
+    async def process_due_jobs(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """
+        Выполняет задачи, которые пора выполнить (callback для job_queue)
+
+        Args:
+            context: Контекст бота
+        """
+        if self._running:
+            # Проход уже идет - попросим его повториться, чтобы подхватить новые задачи
+            self._rerun = True
+            return
+
+        self._running = True
+        try:
+            while True:
+                self._rerun = False
+                for job in db.get_due_publish_jobs():
+                    await self._execute(context, job)
+                if not self._rerun:
+                    break
+        finally:
+            self._running = False
+
+    async def _execute(self, context: ContextTypes.DEFAULT_TYPE, job: Dict[str, Any]) -> None:
+        """Выполняет оставшиеся шаги одной задачи"""
+        channel_id = job['channel_id']
+        telegram_id = job['telegram_id']
+
+        try:
+            if not job.get('message_id') and job['id'] in self._unsaved_message_ids:
+                # Пост уже отправлен прошлым проходом - сначала дописываем его message_id
+                job['message_id'] = self._unsaved_message_ids[job['id']]
+                if not self._save_message_id(job):
+                    return
+
+            if not job.get('message_id'):
+                if self.rate_limiter.try_acquire(channel_id):
+                    # Канал недавно получал сообщение - возьмем задачу в следующем проходе
+                    return
+
+                message = await send_channel_post(
+                    context.bot, channel_id, job['post_text'], job['button_text'], job['button_url']
+                )
+                job['message_id'] = message.message_id
+                bot_logger.info('PUBLISH', 'Пост отправлен в канал', telegram_id=telegram_id,
+                                job_id=job['id'], message_id=message.message_id)
+                # Сохраняем сразу: после этого повтор задачи только закрепляет пост
+                if not self._save_message_id(job):
+                    return
+
+            pinned = True
+            last_error = None
+            try:
+                await pin_channel_post(context.bot, channel_id, job['message_id'])
+            except (BadRequest, Forbidden) as e:
+                # Пост уже опубликован - без закрепления, но второй раз не отправляем
+                pinned = False
+                last_error = f'pin: {str(e)}'
+                bot_logger.warning('PUBLISH', f'Пост опубликован, но не закреплен: {str(e)}',
+                                   telegram_id=telegram_id, job_id=job['id'])
+
+            db.update_publish_job(job['id'], {"status": "done", "pinned": pinned, "last_error": last_error})
+            job.update({"status": "done", "pinned": pinned})
+            await self._notify(self.on_published, context, job)
+
+        except RetryAfter as e:
+            retry_after = getattr(e.retry_after, 'total_seconds', lambda: e.retry_after)()
+            await self._schedule_retry(context, job, e, delay=float(retry_after))
+        except (BadRequest, Forbidden) as e:
+            # Отправка отклонена (нет прав, канал удален) - повтор не поможет
+            await self._fail(context, job, e)
+        except TelegramError as e:
+            await self._schedule_retry(context, job, e)
+        except Exception as e:
+            bot_logger.error('PUBLISH', f'Ошибка выполнения задачи публикации: {str(e)}',
+                             telegram_id=telegram_id, job_id=job['id'])
+            await self._schedule_retry(context, job, e)
+
+    def _save_message_id(self, job: Dict[str, Any]) -> bool:
+        """
+        Сохраняет message_id отправленного поста
+
+        Returns:
+            True если сохранен; иначе message_id остается в памяти до следующего прохода
+        """
+        if db.update_publish_job(job['id'], {"status": "sent", "message_id": job['message_id']}):
+            self._unsaved_message_ids.pop(job['id'], None)
+            return True
+        self._unsaved_message_ids[job['id']] = job['message_id']
+        bot_logger.error('PUBLISH', 'Не удалось сохранить message_id опубликованного поста, '
+                         'закрепление отложено до следующего прохода',
+                         telegram_id=job['telegram_id'], job_id=job['id'], message_id=job['message_id'])
+        return False
+
+    async def _schedule_retry(
+        self,
+        context: ContextTypes.DEFAULT_TYPE,
+        job: Dict[str, Any],
+        error: Exception,
+        delay: Optional[float] = None
+    ) -> None:
+        attempts = (job.get('attempts') or 0) + 1
+        if attempts >= self.max_attempts:
+            job['attempts'] = attempts
+            await self._fail(context, job, error)
+            return
+
+        if delay is None:
+            delay = self.retry_base_delay * (2 ** (attempts - 1))
+        next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+        db.update_publish_job(job['id'], {
+            "attempts": attempts,
+            "last_error": str(error),
+            "next_attempt_at": next_attempt_at.isoformat(),
+        })
+        bot_logger.warning('PUBLISH', f'Ошибка публикации, повтор через {delay:.0f}с: {str(error)}',
+                           telegram_id=job['telegram_id'], job_id=job['id'], attempt=attempts)
+
+    async def _fail(self, context: ContextTypes.DEFAULT_TYPE, job: Dict[str, Any], error: Exception) -> None:
+        db.update_publish_job(job['id'], {
+            "status": "failed",
+            "attempts": job.get('attempts') or 0,
+            "last_error": str(error),
+        })
+        job['status'] = 'failed'
+        bot_logger.error('PUBLISH', f'Публикация не удалась: {str(error)}',
+                         telegram_id=job['telegram_id'], job_id=job['id'])
+        await self._notify(self.on_failed, context, job)
+
+    async def _notify(self, callback: Optional[JobCallback], context: ContextTypes.DEFAULT_TYPE,
+                      job: Dict[str, Any]) -> None:
+        if callback is None:
+            return
+        try:
+            await callback(context, job)
+        except Exception as e:
+            bot_logger.error('PUBLISH', f'Ошибка уведомления о публикации: {str(e)}',
+                             telegram_id=job['telegram_id'], job_id=job['id'])
+
+
+# Глобальная очередь публикаций
+publish_queue = PublishQueue(
+    KeyedRateLimiter(PUBLISH_CHANNEL_MIN_INTERVAL),
+    max_attempts=PUBLISH_MAX_ATTEMPTS,
+    retry_base_delay=PUBLISH_RETRY_BASE_DELAY,
+)
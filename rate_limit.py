@@ -0,0 +1,87 @@
+"""
+Ограничители частоты отправки сообщений
+"""
+import asyncio
+import time
+from typing import Dict, Hashable, Optional
+
+
+class KeyedRateLimiter:
+    """
+    Минимальный интервал между действиями для каждого ключа (например, канала)
+
+    Telegram ограничивает частоту сообщений в один чат, поэтому публикации
+    в один канал разносятся во времени, а в разные каналы идут независимо.
+    """
+
+    def __init__(self, min_interval: float, idle_ttl: float = 3600.0):
+        """
+        Args:
+            min_interval: Минимальная пауза между действиями по одному ключу (секунды)
+            idle_ttl: Через сколько секунд без действий забывать ключ
+        """
+        self.min_interval = min_interval
+        self.idle_ttl = idle_ttl
+        self._next_allowed: Dict[Hashable, float] = {}
+
+    def try_acquire(self, key: Hashable) -> float:
+        """
+        Пытается занять слот для ключа
+
+        Args:
+            key: Ключ ограничения
+
+        Returns:
+            0 если слот занят (действие можно выполнять), иначе сколько секунд подождать
+        """
+        now = time.monotonic()
+        next_allowed = self._next_allowed.get(key, 0.0)
+        if next_allowed > now:
+            return next_allowed - now
+
+        self._next_allowed[key] = now + self.min_interval
+        self._cleanup(now)
+        return 0.0
+
+    def _cleanup(self, now: float) -> None:
+        """Удаляет давно неиспользуемые ключи"""
+        if len(self._next_allowed) < 1000:
+            return
+        expired = [key for key, until in self._next_allowed.items() if until + self.idle_ttl < now]
+        for key in expired:
+            del self._next_allowed[key]
+
+
+class TokenBucket:
+    """
+    Глобальное ограничение частоты (например, сообщений в секунду для всего бота)
+
+    Допускает короткие всплески до capacity, в среднем - не больше rate в секунду.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """
+        Args:
+            rate: Сколько действий в секунду разрешено в среднем
+            capacity: Размер всплеска (по умолчанию = rate)
+        """
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        """Ждет, пока не появится свободный токен, и занимает его"""
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
@@ -0,0 +1,120 @@
+"""
+Общие клиенты внешних сервисов и отчет о времени запуска
+
+Клиенты Supabase, OpenAI и HTTP сессия для n8n создаются один раз на
+процесс и только при первом обращении: импорт supabase и openai занимает
+сотни миллисекунд, а каждый Database() раньше создавал свой клиент.
+Теперь все экземпляры Database используют один клиент, а OpenAI
+загружается только при первом голосовом сообщении.
+
+Обращения к клиентам идут и из потоков (asyncio.to_thread), поэтому
+создание защищено блокировкой.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Iterator, List, Optional, Tuple
+
+from config import SUPABASE_URL, SUPABASE_KEY, OPENAI_API_KEY
+from logger import bot_logger
+from metrics import metrics
+
+if TYPE_CHECKING:
+    import requests
+    from openai import OpenAI
+    from supabase import Client
+
+startup_seconds = metrics.gauge('startup_seconds', 'Длительность этапов запуска бота')
+
+
+class StartupTimer:
+    """Длительность этапов запуска: импорт, создание клиентов, инициализация"""
+
+    def __init__(self):
+        self._phases: List[Tuple[str, float]] = []
+
+    def record(self, name: str, seconds: float) -> None:
+        """Добавляет этап с уже замеренной длительностью"""
+        self._phases.append((name, seconds))
+        startup_seconds.set(round(seconds, 4), phase=name)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Замеряет этап запуска"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def report(self, total: float) -> str:
+        """
+        Отчет о запуске для консоли
+
+        Args:
+            total: Общее время запуска (секунды)
+
+        Returns:
+            Многострочная таблица этапов
+        """
+        lines = [f"   {name:<38} {seconds * 1000:>8.0f} мс" for name, seconds in self._phases]
+        lines.append(f"   {'всего':<38} {total * 1000:>8.0f} мс")
+        return '\n'.join(lines)
+
+
+class Services:
+    """Лениво создаваемые общие клиенты"""
+
+    def __init__(self, startup: StartupTimer):
+        self.startup = startup
+        self._supabase: Optional['Client'] = None
+        self._openai: Optional['OpenAI'] = None
+        self._http: Optional['requests.Session'] = None
+        self._lock = threading.Lock()
+
+    @property
+    def supabase(self) -> 'Client':
+        """Клиент Supabase (один на процесс)"""
+        if self._supabase is None:
+            with self._lock:
+                if self._supabase is None:
+                    with self.startup.phase('supabase: импорт и клиент'):
+                        from supabase import create_client
+                        self._supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+        return self._supabase
+
+    @property
+    def openai(self) -> 'OpenAI':
+        """Клиент OpenAI (создается при первой транскрибации)"""
+        if self._openai is None:
+            with self._lock:
+                if self._openai is None:
+                    started = time.perf_counter()
+                    from openai import OpenAI
+                    self._openai = OpenAI(api_key=OPENAI_API_KEY)
+                    bot_logger.info('SYSTEM', 'Создан клиент OpenAI',
+                                    ms=round((time.perf_counter() - started) * 1000))
+        return self._openai
+
+    @property
+    def http(self) -> 'requests.Session':
+        """HTTP сессия для запросов в n8n (соединения переиспользуются)"""
+        if self._http is None:
+            with self._lock:
+                if self._http is None:
+                    import requests
+                    self._http = requests.Session()
+        return self._http
+
+    def close(self) -> None:
+        """Закрывает созданные клиенты (при остановке бота)"""
+        if self._http is not None:
+            self._http.close()
+        if self._openai is not None:
+            self._openai.close()
+
+
+startup = StartupTimer()
+
+# Глобальные клиенты сервисов
+services = Services(startup)
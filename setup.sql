@@ -6,6 +6,8 @@
 -- ============================================
 -- 1. ТАБЛИЦА ПОЛЬЗОВАТЕЛЕЙ
 -- ============================================
+-- Только то, что читается на каждом шаге: вход, состояние и позиция в этапах.
+-- Ответы и готовые тексты этапов - в таблицах раздела 10.
 
 CREATE TABLE IF NOT EXISTS users (
   id BIGSERIAL PRIMARY KEY,
@@ -13,31 +15,15 @@ CREATE TABLE IF NOT EXISTS users (
   telegram_id BIGINT UNIQUE,
   state TEXT DEFAULT 'new',
   video_sent_at TIMESTAMP,
-  -- Поля для работы с постами
+  -- Позиция в создании постов
   current_post_number INT DEFAULT 1,
   current_question_number INT DEFAULT 1,
   post_attempt INT DEFAULT 1,
-  post_answers JSONB,
-  -- Поля для публикации поста с кнопкой
+  -- Канал пользователя
   channel_username TEXT,
   channel_id BIGINT,
-  blue_answers JSONB,
-  best_links JSONB,
-  button_action TEXT,
-  button_url TEXT,
-  button_text TEXT,
-  blue_post_text TEXT,
-  -- Данные для анонсов
-  anons1 TEXT,
-  anons2 TEXT,
-  anons_text TEXT,
-  -- Данные для продающего поста
-  prodaj1 TEXT,
-  prodaj2 TEXT,
-  prodaj3 TEXT,
-  sales_text TEXT,
-  rewrite_count INT DEFAULT 0,
   -- Служебные поля
+  version INT NOT NULL DEFAULT 0,  -- растет при каждом изменении строки (раздел 11)
   created_at TIMESTAMP DEFAULT NOW(),
   updated_at TIMESTAMP DEFAULT NOW()
 );
@@ -233,6 +219,474 @@ INSERT INTO posts (post_number, topic, vopros_1, vopros_2, vopros_3, prompt_post
 )
 ON CONFLICT (post_number) DO NOTHING;
 
+-- ============================================
+-- 5. ОЧЕРЕДЬ ПУБЛИКАЦИЙ В КАНАЛЫ
+-- ============================================
+-- Задача проходит шаги: pending -> sent (message_id сохранен) -> done (закреплен)
+-- Если message_id уже сохранен, пост повторно не отправляется - только закрепляется
+
+CREATE TABLE IF NOT EXISTS publish_jobs (
+  id BIGSERIAL PRIMARY KEY,
+  telegram_id BIGINT NOT NULL,
+  channel_id BIGINT NOT NULL,
+  dedup_key TEXT UNIQUE NOT NULL,
+  post_text TEXT NOT NULL,
+  button_text TEXT,
+  button_url TEXT,
+  status TEXT DEFAULT 'pending',  -- pending | sent | done | failed
+  message_id BIGINT,
+  pinned BOOLEAN DEFAULT FALSE,
+  attempts INT DEFAULT 0,
+  last_error TEXT,
+  scheduled_at TIMESTAMP DEFAULT NOW(),
+  next_attempt_at TIMESTAMP DEFAULT NOW(),
+  created_at TIMESTAMP DEFAULT NOW(),
+  updated_at TIMESTAMP DEFAULT NOW()
+);
+
+-- Индекс для выборки задач, которые пора выполнить
+CREATE INDEX IF NOT EXISTS idx_publish_jobs_due ON publish_jobs(status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS idx_publish_jobs_telegram_id ON publish_jobs(telegram_id);
+
+-- ============================================
+-- 6. РАССЫЛКИ
+-- ============================================
+-- last_user_id - контрольная точка: после перезапуска рассылка продолжается с users.id > last_user_id
+
+CREATE TABLE IF NOT EXISTS broadcasts (
+  id BIGSERIAL PRIMARY KEY,
+  admin_id BIGINT NOT NULL,
+  state TEXT NOT NULL,
+  inactive_days INT DEFAULT 0,
+  updated_before TIMESTAMP,
+  text TEXT NOT NULL,
+  status TEXT DEFAULT 'running',  -- running | done | cancelled
+  last_user_id BIGINT DEFAULT 0,
+  sent INT DEFAULT 0,
+  failed INT DEFAULT 0,
+  blocked INT DEFAULT 0,
+  progress_chat_id BIGINT,
+  progress_message_id BIGINT,
+  created_at TIMESTAMP DEFAULT NOW(),
+  updated_at TIMESTAMP DEFAULT NOW(),
+  finished_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts(status);
+
+-- Keyset пагинация рассылки: WHERE state = ? AND id > ? ORDER BY id
+CREATE INDEX IF NOT EXISTS idx_state_id ON users(state, id);
+
+-- ============================================
+-- 7. АНАЛИТИКА ВОРОНКИ
+-- ============================================
+-- История смены состояний пишется триггером, агрегаты считаются на сервере
+-- функцией funnel_stats и сохраняются снимками в funnel_snapshots.
+-- Бот и /analytics/funnel читают только последний снимок.
+
+CREATE TABLE IF NOT EXISTS user_state_events (
+  id BIGSERIAL PRIMARY KEY,
+  user_id BIGINT NOT NULL,
+  from_state TEXT,
+  to_state TEXT NOT NULL,
+  changed_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_user_state_events_user ON user_state_events(user_id, changed_at);
+CREATE INDEX IF NOT EXISTS idx_user_state_events_state ON user_state_events(to_state, user_id);
+
+CREATE OR REPLACE FUNCTION log_user_state_change() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+  IF TG_OP = 'INSERT' OR NEW.state IS DISTINCT FROM OLD.state THEN
+    INSERT INTO user_state_events (user_id, from_state, to_state)
+    VALUES (NEW.id, CASE WHEN TG_OP = 'UPDATE' THEN OLD.state END, NEW.state);
+  END IF;
+  RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_user_state_events ON users;
+CREATE TRIGGER trg_user_state_events
+  AFTER INSERT OR UPDATE OF state ON users
+  FOR EACH ROW EXECUTE FUNCTION log_user_state_change();
+
+CREATE TABLE IF NOT EXISTS funnel_snapshots (
+  id BIGSERIAL PRIMARY KEY,
+  data JSONB NOT NULL,
+  created_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_funnel_snapshots_created ON funnel_snapshots(created_at DESC);
+
+-- p_stages - этапы воронки (состояния в порядке прохождения). Этап "достигнут", если
+-- пользователь побывал в этом состоянии (user_state_events) или находится в нем сейчас
+-- (пользователи, не менявшие состояние с создания триггера). Ветки (голосовое или
+-- текстовое прохождение, экспресс-режим) учитываются только у тех, кто по ним прошел.
+DROP FUNCTION IF EXISTS refresh_funnel_snapshot(TEXT[], TEXT[]);
+DROP FUNCTION IF EXISTS funnel_stats(TEXT[], TEXT[]);
+
+CREATE OR REPLACE FUNCTION funnel_stats(p_stages TEXT[]) RETURNS JSONB
+LANGUAGE sql STABLE AS $$
+  WITH counts AS (
+    SELECT state, COUNT(*) AS users
+    FROM users
+    WHERE telegram_id IS NOT NULL
+    GROUP BY state
+  ),
+  visits AS (
+    SELECT e.to_state AS stage, e.user_id
+    FROM user_state_events e
+    JOIN users u ON u.id = e.user_id AND u.telegram_id IS NOT NULL
+    WHERE e.to_state = ANY(p_stages)
+    UNION
+    SELECT state, id
+    FROM users
+    WHERE telegram_id IS NOT NULL AND state = ANY(p_stages)
+  ),
+  stages AS (
+    SELECT s.stage, s.ord,
+           (SELECT COUNT(*) FROM visits v WHERE v.stage = s.stage) AS reached
+    FROM unnest(p_stages) WITH ORDINALITY AS s(stage, ord)
+  ),
+  conversion AS (
+    SELECT stage, ord, reached,
+           ROUND(reached::NUMERIC / NULLIF(LAG(reached) OVER (ORDER BY ord), 0), 4) AS conversion
+    FROM stages
+  ),
+  durations AS (
+    SELECT to_state AS state,
+           EXTRACT(EPOCH FROM (LEAD(changed_at) OVER (PARTITION BY user_id ORDER BY changed_at, id) - changed_at)) AS seconds
+    FROM user_state_events
+  ),
+  medians AS (
+    SELECT state,
+           percentile_cont(0.5) WITHIN GROUP (ORDER BY seconds) AS median_seconds,
+           COUNT(*) AS samples
+    FROM durations
+    WHERE seconds IS NOT NULL
+    GROUP BY state
+  )
+  SELECT jsonb_build_object(
+    'generated_at', NOW(),
+    'total_users', (SELECT COALESCE(SUM(users), 0) FROM counts),
+    'states', (SELECT COALESCE(jsonb_object_agg(state, users), '{}'::JSONB) FROM counts),
+    'stages', (SELECT COALESCE(jsonb_agg(jsonb_build_object(
+                  'stage', stage, 'reached', reached, 'conversion', conversion) ORDER BY ord), '[]'::JSONB)
+               FROM conversion),
+    'time_in_state', (SELECT COALESCE(jsonb_object_agg(state, jsonb_build_object(
+                        'median_seconds', ROUND(median_seconds::NUMERIC), 'samples', samples)), '{}'::JSONB)
+                      FROM medians)
+  );
+$$;
+
+CREATE OR REPLACE FUNCTION refresh_funnel_snapshot(p_stages TEXT[]) RETURNS JSONB
+LANGUAGE plpgsql AS $$
+DECLARE
+  result JSONB;
+BEGIN
+  result := funnel_stats(p_stages);
+  INSERT INTO funnel_snapshots (data) VALUES (result);
+  DELETE FROM funnel_snapshots WHERE created_at < NOW() - INTERVAL '30 days';
+  RETURN result;
+END;
+$$;
+
+-- ============================================
+-- 8. РЕГИСТРАЦИЯ
+-- ============================================
+-- Привязка telegram_id к email и перевод в состояние после регистрации одним
+-- запросом. Возвращает строку пользователя или NULL, если email не найден.
+
+CREATE OR REPLACE FUNCTION claim_registration(p_email TEXT, p_telegram_id BIGINT, p_state TEXT) RETURNS JSONB
+LANGUAGE sql AS $$
+  UPDATE users
+  SET telegram_id = p_telegram_id,
+      state = p_state,
+      updated_at = NOW()
+  WHERE email = lower(p_email)
+  RETURNING to_jsonb(users.*);
+$$;
+
+-- ============================================
+-- 9. ПЕРЕДАЧА ОЖИДАНИЙ МЕЖДУ ЗАПУСКАМИ
+-- ============================================
+-- При остановке бота (SIGTERM) ожидания ответа n8n, не завершившиеся за время
+-- остановки, сохраняются сюда и продолжаются следующим запуском.
+-- pending -> resumed (подхвачено новым запуском) -> done
+
+CREATE TABLE IF NOT EXISTS handoffs (
+  id BIGSERIAL PRIMARY KEY,
+  request_id TEXT UNIQUE NOT NULL,
+  telegram_id BIGINT NOT NULL,
+  resume TEXT NOT NULL,           -- что выполнить с ответом (osebe, post, bluebutt, ...)
+  message JSONB,                  -- сообщение "обрабатываю", которое заменяется результатом
+  params JSONB DEFAULT '{}',      -- номер поста, попытка и т.п.
+  response JSONB,                 -- ответ n8n, пришедший после передачи
+  status TEXT DEFAULT 'pending',  -- pending | resumed | done
+  expires_at TIMESTAMP NOT NULL,  -- после этого ожидание считается таймаутом
+  handed_off_by TEXT,
+  created_at TIMESTAMP DEFAULT NOW(),
+  updated_at TIMESTAMP DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_handoffs_status ON handoffs(status);
+
+-- ============================================
+-- 10. ДАННЫЕ ЭТАПОВ (ОТВЕТЫ И ГОТОВЫЕ ТЕКСТЫ)
+-- ============================================
+-- Ответы и сгенерированные тексты хранятся по этапам в отдельных таблицах и
+-- читаются только обработчиками своего этапа; строка users остается узкой.
+-- Ответы - JSONB-объекты, ответ добавляется на сервере одним запросом: бот
+-- не читает и не перезаписывает всю карту ответов.
+
+-- Этап 6: ответы на вопросы постов
+CREATE TABLE IF NOT EXISTS user_posts (
+  telegram_id BIGINT PRIMARY KEY REFERENCES users(telegram_id) ON DELETE CASCADE ON UPDATE CASCADE,
+  post_answers JSONB DEFAULT '{}',
+  updated_at TIMESTAMP DEFAULT NOW()
+);
+
+-- Этап 7: пост-знакомство
+CREATE TABLE IF NOT EXISTS user_intro_posts (
+  telegram_id BIGINT PRIMARY KEY REFERENCES users(telegram_id) ON DELETE CASCADE ON UPDATE CASCADE,
+  blue_answers JSONB DEFAULT '{}',
+  best_links JSONB DEFAULT '{}',
+  button_action TEXT,
+  button_url TEXT,
+  button_text TEXT,
+  blue_post_text TEXT,
+  updated_at TIMESTAMP DEFAULT NOW()
+);
+
+-- Этап 8: анонс
+CREATE TABLE IF NOT EXISTS user_anons (
+  telegram_id BIGINT PRIMARY KEY REFERENCES users(telegram_id) ON DELETE CASCADE ON UPDATE CASCADE,
+  anons1 TEXT,
+  anons2 TEXT,
+  anons_text TEXT,
+  updated_at TIMESTAMP DEFAULT NOW()
+);
+
+-- Этап 9: продающий пост
+CREATE TABLE IF NOT EXISTS user_sales (
+  telegram_id BIGINT PRIMARY KEY REFERENCES users(telegram_id) ON DELETE CASCADE ON UPDATE CASCADE,
+  prodaj1 TEXT,
+  prodaj2 TEXT,
+  prodaj3 TEXT,
+  sales_text TEXT,
+  rewrite_count INT DEFAULT 0,
+  updated_at TIMESTAMP DEFAULT NOW()
+);
+
+-- Перенос из таблиц, созданных до разделения: данные этапов копируются в новые
+-- таблицы (ответы, записанные раньше строкой JSON, переводятся в объекты), затем
+-- колонки удаляются из users. Выполняется один раз, повторный запуск ничего не делает.
+-- Место старых значений освобождается при перезаписи строк; сразу - отдельной
+-- командой VACUUM FULL users (блокирует таблицу на время выполнения).
+DO $$
+BEGIN
+  IF NOT EXISTS (
+    SELECT 1 FROM information_schema.columns
+    WHERE table_schema = 'public' AND table_name = 'users' AND column_name = 'post_answers'
+  ) THEN
+    RETURN;
+  END IF;
+
+  INSERT INTO user_posts (telegram_id, post_answers)
+  SELECT telegram_id,
+         CASE WHEN jsonb_typeof(post_answers) = 'string' THEN (post_answers #>> '{}')::JSONB ELSE post_answers END
+  FROM users
+  WHERE telegram_id IS NOT NULL AND post_answers IS NOT NULL
+  ON CONFLICT (telegram_id) DO NOTHING;
+
+  INSERT INTO user_intro_posts (telegram_id, blue_answers, best_links, button_action, button_url, button_text, blue_post_text)
+  SELECT telegram_id,
+         CASE WHEN jsonb_typeof(blue_answers) = 'string' THEN (blue_answers #>> '{}')::JSONB ELSE COALESCE(blue_answers, '{}') END,
+         CASE WHEN jsonb_typeof(best_links) = 'string' THEN (best_links #>> '{}')::JSONB ELSE COALESCE(best_links, '{}') END,
+         button_action, button_url, button_text, blue_post_text
+  FROM users
+  WHERE telegram_id IS NOT NULL
+    AND num_nonnulls(blue_answers, best_links, button_action, button_url, button_text, blue_post_text) > 0
+  ON CONFLICT (telegram_id) DO NOTHING;
+
+  INSERT INTO user_anons (telegram_id, anons1, anons2, anons_text)
+  SELECT telegram_id, anons1, anons2, anons_text
+  FROM users
+  WHERE telegram_id IS NOT NULL AND num_nonnulls(anons1, anons2, anons_text) > 0
+  ON CONFLICT (telegram_id) DO NOTHING;
+
+  INSERT INTO user_sales (telegram_id, prodaj1, prodaj2, prodaj3, sales_text, rewrite_count)
+  SELECT telegram_id, prodaj1, prodaj2, prodaj3, sales_text, COALESCE(rewrite_count, 0)
+  FROM users
+  WHERE telegram_id IS NOT NULL
+    AND (num_nonnulls(prodaj1, prodaj2, prodaj3, sales_text) > 0 OR rewrite_count > 0)
+  ON CONFLICT (telegram_id) DO NOTHING;
+
+  ALTER TABLE users
+    DROP COLUMN post_answers,
+    DROP COLUMN blue_answers,
+    DROP COLUMN best_links,
+    DROP COLUMN button_action,
+    DROP COLUMN button_url,
+    DROP COLUMN button_text,
+    DROP COLUMN blue_post_text,
+    DROP COLUMN anons1,
+    DROP COLUMN anons2,
+    DROP COLUMN anons_text,
+    DROP COLUMN prodaj1,
+    DROP COLUMN prodaj2,
+    DROP COLUMN prodaj3,
+    DROP COLUMN sales_text,
+    DROP COLUMN rewrite_count;
+END;
+$$;
+
+-- Функции записи с проверкой версии строки users (p_version, раздел 11): NULL - без проверки,
+-- иначе при несовпадении версии - ошибка 40001 version_conflict, бот повторяет шаг по свежим данным.
+-- Старые варианты без p_version удаляются, чтобы PostgREST не выбирал между перегрузками.
+DROP FUNCTION IF EXISTS save_post_progress(BIGINT, INT, INT, INT, JSONB);
+DROP FUNCTION IF EXISTS save_post_answer(BIGINT, TEXT[], JSONB, INT, INT, INT);
+DROP FUNCTION IF EXISTS save_post_answer(BIGINT, TEXT[], JSONB, INT, INT, INT, INT);
+
+-- Позиция в создании постов и (если p_answers не NULL) замена всей карты ответов - одной транзакцией.
+-- Возвращает FALSE, если пользователь не найден
+CREATE OR REPLACE FUNCTION save_post_progress(
+  p_telegram_id BIGINT, p_post INT, p_question INT, p_attempt INT, p_answers JSONB, p_version INT DEFAULT NULL
+) RETURNS BOOLEAN
+LANGUAGE plpgsql AS $$
+BEGIN
+  UPDATE users
+  SET current_post_number = p_post,
+      current_question_number = p_question,
+      post_attempt = p_attempt,
+      updated_at = NOW()
+  WHERE telegram_id = p_telegram_id AND (p_version IS NULL OR version = p_version);
+
+  IF NOT FOUND THEN
+    PERFORM raise_version_conflict(p_telegram_id, p_version);
+    RETURN FALSE;
+  END IF;
+
+  IF p_answers IS NOT NULL THEN
+    INSERT INTO user_posts (telegram_id, post_answers) VALUES (p_telegram_id, p_answers)
+    ON CONFLICT (telegram_id) DO UPDATE SET post_answers = EXCLUDED.post_answers, updated_at = NOW();
+  END IF;
+  RETURN TRUE;
+END;
+$$;
+
+-- Ответ на вопрос поста и позиция в users. p_path: {answer_1} или {post_2,answer_1} (экспресс-режим).
+-- p_state (не NULL) - новое состояние тем же обновлением: последний ответ сразу переводит
+-- пользователя в генерацию, и повтор шага после конфликта версий видит, что ответы собраны.
+-- Возвращает количество ответов в объекте, куда записан ответ (NULL - пользователь не найден)
+CREATE OR REPLACE FUNCTION save_post_answer(
+  p_telegram_id BIGINT, p_path TEXT[], p_value JSONB, p_post INT, p_question INT, p_attempt INT,
+  p_version INT DEFAULT NULL, p_state TEXT DEFAULT NULL
+) RETURNS INT
+LANGUAGE plpgsql AS $$
+DECLARE
+  answers JSONB;
+BEGIN
+  UPDATE users
+  SET current_post_number = p_post,
+      current_question_number = p_question,
+      post_attempt = p_attempt,
+      state = COALESCE(p_state, state),
+      updated_at = NOW()
+  WHERE telegram_id = p_telegram_id AND (p_version IS NULL OR version = p_version);
+
+  IF NOT FOUND THEN
+    PERFORM raise_version_conflict(p_telegram_id, p_version);
+    RETURN NULL;
+  END IF;
+
+  INSERT INTO user_posts (telegram_id) VALUES (p_telegram_id) ON CONFLICT (telegram_id) DO NOTHING;
+
+  UPDATE user_posts
+  SET post_answers = CASE cardinality(p_path)
+        WHEN 1 THEN COALESCE(post_answers, '{}') || jsonb_build_object(p_path[1], p_value)
+        ELSE COALESCE(post_answers, '{}') || jsonb_build_object(
+          p_path[1], COALESCE(post_answers -> p_path[1], '{}') || jsonb_build_object(p_path[2], p_value)
+        )
+      END,
+      updated_at = NOW()
+  WHERE telegram_id = p_telegram_id
+  RETURNING post_answers INTO answers;
+
+  IF cardinality(p_path) = 2 THEN
+    answers := answers -> p_path[1];
+  END IF;
+  RETURN (SELECT count(*) FROM jsonb_object_keys(answers));
+END;
+$$;
+
+-- Следующий по номеру ответ поста-знакомства: p_prefix || (количество ответов + 1), например blueotvet3.
+-- Возвращает номер добавленного ответа (NULL - пользователь не найден)
+CREATE OR REPLACE FUNCTION append_numbered_answer(
+  p_telegram_id BIGINT, p_column TEXT, p_prefix TEXT, p_value JSONB
+) RETURNS INT
+LANGUAGE plpgsql AS $$
+DECLARE
+  answers JSONB;
+BEGIN
+  IF p_column NOT IN ('blue_answers', 'best_links') THEN
+    RAISE EXCEPTION 'append_numbered_answer: недопустимая колонка %', p_column;
+  END IF;
+
+  IF NOT EXISTS (SELECT 1 FROM users WHERE telegram_id = p_telegram_id) THEN
+    RETURN NULL;
+  END IF;
+
+  INSERT INTO user_intro_posts (telegram_id) VALUES (p_telegram_id) ON CONFLICT (telegram_id) DO NOTHING;
+
+  EXECUTE format(
+    'UPDATE user_intro_posts
+     SET %1$I = COALESCE(%1$I, ''{}'') || jsonb_build_object(
+           $2 || ((SELECT count(*) FROM jsonb_object_keys(COALESCE(%1$I, ''{}''))) + 1)::TEXT, $3
+         ),
+         updated_at = NOW()
+     WHERE telegram_id = $1
+     RETURNING %1$I', p_column
+  ) INTO answers USING p_telegram_id, p_prefix, p_value;
+
+  RETURN (SELECT count(*) FROM jsonb_object_keys(answers));
+END;
+$$;
+
+-- ============================================
+-- 11. ВЕРСИИ СТРОК USERS (ОПТИМИСТИЧНЫЕ БЛОКИРОВКИ)
+-- ============================================
+-- Любое изменение строки users увеличивает version. Шаг бота читает строку с
+-- версией и пишет с условием "версия не изменилась": два почти одновременных
+-- апдейта одного пользователя не затирают друг друга, второй повторяется.
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS version INT NOT NULL DEFAULT 0;
+
+CREATE OR REPLACE FUNCTION bump_user_version() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+  NEW.version := OLD.version + 1;
+  RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_users_version ON users;
+CREATE TRIGGER trg_users_version
+  BEFORE UPDATE ON users
+  FOR EACH ROW EXECUTE FUNCTION bump_user_version();
+
+-- Запись с проверкой версии ничего не изменила: если пользователь есть - версия устарела
+CREATE OR REPLACE FUNCTION raise_version_conflict(p_telegram_id BIGINT, p_version INT) RETURNS VOID
+LANGUAGE plpgsql AS $$
+BEGIN
+  IF p_version IS NOT NULL AND EXISTS (SELECT 1 FROM users WHERE telegram_id = p_telegram_id) THEN
+    RAISE EXCEPTION 'version_conflict' USING ERRCODE = '40001',
+      DETAIL = format('telegram_id=%s, expected version %s', p_telegram_id, p_version);
+  END IF;
+END;
+$$;
+
 -- ============================================
 -- ГОТОВО!
 -- ============================================
@@ -0,0 +1,279 @@
+"""
+HTTP транспорт для Telegram Bot API
+
+Собирает HTTPXRequest из настроек config.py: размер пула соединений,
+HTTP/2, keep-alive, таймауты по методам. Для get_updates и для
+остальных вызовов используются разные объекты запросов, чтобы долгий
+long polling не занимал соединения пула бота.
+
+Время ожидания свободного соединения пишется в метрику
+telegram_pool_wait_seconds (GET /metrics).
+
+Если задан TELEGRAM_API_BASE_URL, бот работает через собственный сервер
+telegram-bot-api (локальный режим: файлы передаются путем, лимит 2 ГБ).
+"""
+import asyncio
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+from telegram.error import TimedOut
+from telegram.request import BaseRequest, HTTPXRequest, RequestData
+
+from config import (
+    TELEGRAM_API_BASE_URL, TELEGRAM_LOCAL_MODE, TELEGRAM_LOCAL_MEDIA_ROOT, MEDIA_FOLDER,
+    TELEGRAM_POOL_SIZE, TELEGRAM_MAX_CONCURRENT_REQUESTS, TELEGRAM_HTTP_VERSION,
+    TELEGRAM_KEEPALIVE_CONNECTIONS, TELEGRAM_KEEPALIVE_EXPIRY,
+    TELEGRAM_CONNECT_TIMEOUT, TELEGRAM_READ_TIMEOUT, TELEGRAM_WRITE_TIMEOUT,
+    TELEGRAM_POOL_TIMEOUT, TELEGRAM_MEDIA_WRITE_TIMEOUT, TELEGRAM_METHOD_TIMEOUTS,
+    TELEGRAM_UPDATES_POOL_SIZE, TELEGRAM_UPDATES_READ_TIMEOUT
+)
+from logger import bot_logger
+from metrics import metrics
+
+
+POOL_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+pool_wait_seconds = metrics.histogram(
+    'telegram_pool_wait_seconds',
+    'Ожидание свободного соединения перед запросом к Telegram',
+    buckets=POOL_WAIT_BUCKETS
+)
+request_duration_seconds = metrics.histogram(
+    'telegram_request_duration_seconds',
+    'Длительность запроса к Telegram без ожидания пула'
+)
+requests_in_flight = metrics.gauge(
+    'telegram_requests_in_flight',
+    'Запросы к Telegram, выполняющиеся сейчас'
+)
+pool_timeouts_total = metrics.counter(
+    'telegram_pool_timeouts_total',
+    'Запросы, не дождавшиеся свободного соединения'
+)
+
+
+def parse_method_timeouts(raw: str) -> Dict[str, float]:
+    """
+    Разбирает строку таймаутов по методам
+
+    Args:
+        raw: Строка вида "sendVideo=120,getFile=30"
+
+    Returns:
+        Словарь {метод: секунды}
+    """
+    result = {}
+    for item in raw.split(','):
+        if '=' not in item:
+            continue
+        method, seconds = item.split('=', 1)
+        try:
+            result[method.strip()] = float(seconds)
+        except ValueError:
+            continue
+    return result
+
+
+class ConfiguredHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest с keep-alive лимитами, таймаутами по методам и метриками пула"""
+
+    def __init__(
+        self,
+        client_name: str,
+        connection_pool_size: int,
+        max_concurrent_requests: Optional[int] = None,
+        keepalive_connections: Optional[int] = None,
+        keepalive_expiry: float = 5.0,
+        method_timeouts: Optional[Dict[str, float]] = None,
+        **kwargs
+    ):
+        """
+        Args:
+            client_name: Метка клиента в метриках (bot, updates, media)
+            connection_pool_size: Максимум соединений в пуле
+            max_concurrent_requests: Одновременных запросов (по умолчанию = размеру пула,
+                для HTTP/2 можно больше - запросы мультиплексируются)
+            keepalive_connections: Сколько простаивающих соединений держать открытыми
+            keepalive_expiry: Через сколько секунд закрывать простаивающее соединение
+            method_timeouts: Таймауты чтения/записи по методам Bot API
+            **kwargs: Остальные параметры HTTPXRequest (таймауты, http_version)
+        """
+        # HTTPXRequest не дает задать keep-alive отдельно - лимиты подставляются
+        # в _build_client, который вызывается из super().__init__
+        self._limits = httpx.Limits(
+            max_connections=connection_pool_size,
+            max_keepalive_connections=keepalive_connections or connection_pool_size,
+            keepalive_expiry=keepalive_expiry,
+        )
+        super().__init__(connection_pool_size=connection_pool_size, **kwargs)
+        self.client_name = client_name
+        self.method_timeouts = method_timeouts or {}
+        self._pool_timeout = kwargs.get('pool_timeout')
+
+        # Очередь перед пулом видна нам, а не только httpx - так можно измерить ожидание
+        self._slots = asyncio.Semaphore(max_concurrent_requests or connection_pool_size)
+
+    def _build_client(self) -> httpx.AsyncClient:
+        # Вызывается при создании и при повторной инициализации после shutdown
+        return httpx.AsyncClient(**{**self._client_kwargs, 'limits': self._limits})
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout=BaseRequest.DEFAULT_NONE,
+        write_timeout=BaseRequest.DEFAULT_NONE,
+        connect_timeout=BaseRequest.DEFAULT_NONE,
+        pool_timeout=BaseRequest.DEFAULT_NONE,
+    ) -> Tuple[int, bytes]:
+        api_method = url.rsplit('/', 1)[-1]
+
+        method_timeout = self.method_timeouts.get(api_method)
+        if method_timeout is not None:
+            if read_timeout is BaseRequest.DEFAULT_NONE:
+                read_timeout = method_timeout
+            if write_timeout is BaseRequest.DEFAULT_NONE:
+                write_timeout = method_timeout
+
+        wait_limit = self._pool_timeout if pool_timeout is BaseRequest.DEFAULT_NONE else pool_timeout
+        wait_started = time.monotonic()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=wait_limit)
+        except asyncio.TimeoutError as e:
+            pool_timeouts_total.inc(client=self.client_name)
+            raise TimedOut(
+                f'Pool timeout: все {self.client_name} соединения заняты, запрос не отправлен'
+            ) from e
+
+        pool_wait_seconds.observe(time.monotonic() - wait_started, client=self.client_name)
+        requests_in_flight.inc(client=self.client_name)
+        started = time.monotonic()
+        try:
+            return await super().do_request(
+                url,
+                method,
+                request_data=request_data,
+                read_timeout=read_timeout,
+                write_timeout=write_timeout,
+                connect_timeout=connect_timeout,
+                pool_timeout=pool_timeout,
+            )
+        finally:
+            request_duration_seconds.observe(time.monotonic() - started,
+                                             client=self.client_name, method=api_method)
+            requests_in_flight.dec(client=self.client_name)
+            self._slots.release()
+
+
+def build_bot_request() -> ConfiguredHTTPXRequest:
+    """Запрос для обычных вызовов бота (send_message, edit_message_text, ...)"""
+    return ConfiguredHTTPXRequest(
+        client_name='bot',
+        connection_pool_size=TELEGRAM_POOL_SIZE,
+        max_concurrent_requests=TELEGRAM_MAX_CONCURRENT_REQUESTS,
+        keepalive_connections=TELEGRAM_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=TELEGRAM_KEEPALIVE_EXPIRY,
+        method_timeouts=parse_method_timeouts(TELEGRAM_METHOD_TIMEOUTS),
+        http_version=TELEGRAM_HTTP_VERSION,
+        connect_timeout=TELEGRAM_CONNECT_TIMEOUT,
+        read_timeout=TELEGRAM_READ_TIMEOUT,
+        write_timeout=TELEGRAM_WRITE_TIMEOUT,
+        pool_timeout=TELEGRAM_POOL_TIMEOUT,
+        media_write_timeout=TELEGRAM_MEDIA_WRITE_TIMEOUT,
+    )
+
+
+def build_updates_request() -> ConfiguredHTTPXRequest:
+    """Отдельный запрос для get_updates (long polling)"""
+    return ConfiguredHTTPXRequest(
+        client_name='updates',
+        connection_pool_size=TELEGRAM_UPDATES_POOL_SIZE,
+        keepalive_expiry=TELEGRAM_KEEPALIVE_EXPIRY,
+        http_version=TELEGRAM_HTTP_VERSION,
+        connect_timeout=TELEGRAM_CONNECT_TIMEOUT,
+        read_timeout=TELEGRAM_UPDATES_READ_TIMEOUT,
+        write_timeout=TELEGRAM_WRITE_TIMEOUT,
+        pool_timeout=TELEGRAM_POOL_TIMEOUT,
+    )
+
+
+def bot_api_server_kwargs() -> Dict[str, Any]:
+    """
+    Параметры Bot для собственного сервера telegram-bot-api
+
+    Returns:
+        {'base_url', 'base_file_url', 'local_mode'} или пустой словарь для облачного API
+    """
+    if not TELEGRAM_API_BASE_URL:
+        return {}
+    return {
+        'base_url': f'{TELEGRAM_API_BASE_URL}/bot',
+        'base_file_url': f'{TELEGRAM_API_BASE_URL}/file/bot',
+        'local_mode': TELEGRAM_LOCAL_MODE,
+    }
+
+
+def local_media_path(video_path: str) -> Path:
+    """
+    Путь к файлу из media/, как его видит локальный сервер telegram-bot-api
+
+    Args:
+        video_path: Путь к файлу у бота (например, media/learn1.mp4)
+
+    Returns:
+        Абсолютный путь на стороне сервера
+    """
+    relative = os.path.relpath(os.path.abspath(video_path), os.path.abspath(MEDIA_FOLDER))
+    return Path(TELEGRAM_LOCAL_MEDIA_ROOT) / relative
+
+
+class BotApiHealth:
+    """Проверка доступности Bot API сервера (для /health и старта бота)"""
+
+    def __init__(self, cache_seconds: float = 10.0):
+        self.bot = None
+        self.cache_seconds = cache_seconds
+        self._last_checked = 0.0
+        self._last_result: Optional[Dict[str, Any]] = None
+
+    async def check(self, force: bool = False) -> Dict[str, Any]:
+        """
+        Вызывает getMe и возвращает статус сервера
+
+        Args:
+            force: Не использовать закешированный результат
+
+        Returns:
+            {'status': 'ok'|'error'|'unknown', 'server': ..., 'latency_ms' | 'error': ...}
+        """
+        server = TELEGRAM_API_BASE_URL or 'cloud'
+        if self.bot is None:
+            return {'status': 'unknown', 'server': server}
+
+        now = time.monotonic()
+        if not force and self._last_result and now - self._last_checked < self.cache_seconds:
+            return self._last_result
+
+        started = time.monotonic()
+        try:
+            await self.bot.get_me(read_timeout=5, connect_timeout=5)
+            result = {
+                'status': 'ok',
+                'server': server,
+                'latency_ms': round((time.monotonic() - started) * 1000, 1),
+            }
+        except Exception as e:
+            bot_logger.error('SYSTEM', f'Bot API сервер недоступен: {str(e)}', server=server)
+            result = {'status': 'error', 'server': server, 'error': str(e)}
+
+        self._last_checked = now
+        self._last_result = result
+        return result
+
+
+# Глобальная проверка Bot API (bot задается в bot.py после инициализации)
+bot_api_health = BotApiHealth()
@@ -0,0 +1,318 @@
+"""
+Транскрибация голосовых сообщений с выбором бэкенда
+
+Бэкенды:
+  - openai: OpenAI Whisper API (загрузка файла и задержка API);
+  - local: квантованная модель faster-whisper на CPU в отдельных
+    процессах (модель загружается в каждый процесс один раз).
+    Работает, только если установлен пакет faster-whisper.
+
+Маршрут TRANSCRIPTION_ROUTES вида "local<30,openai": бэкенды пробуются
+по порядку, "<30" - только для голосовых короче 30 секунд. Если бэкенд
+недоступен или вернул ошибку, пробуется следующий подходящий.
+
+Для оценки точности доля TRANSCRIPTION_SAMPLE_RATE голосовых,
+распознанных не эталонным бэкендом, в фоне распознается еще и
+эталонным (TRANSCRIPTION_REFERENCE); доля ошибочных слов (WER)
+отдается в /metrics.
+"""
+import abc
+import asyncio
+import importlib.util
+import io
+import multiprocessing
+import random
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+
+from config import (
+    TRANSCRIPTION_ROUTES, TRANSCRIPTION_OPENAI_MODEL, TRANSCRIPTION_LOCAL_MODEL,
+    TRANSCRIPTION_LOCAL_COMPUTE, TRANSCRIPTION_LOCAL_WORKERS, TRANSCRIPTION_LOCAL_THREADS,
+    TRANSCRIPTION_SAMPLE_RATE, TRANSCRIPTION_REFERENCE
+)
+from logger import bot_logger
+from metrics import metrics
+from services import services
+
+LANGUAGE = 'ru'
+
+transcription_total = metrics.counter('transcription_total', 'Транскрибации по бэкендам (ok, error, empty)')
+transcription_seconds = metrics.histogram(
+    'transcription_seconds', 'Длительность транскрибации по бэкендам',
+    buckets=(0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60)
+)
+transcription_wer = metrics.histogram(
+    'transcription_wer', 'Доля ошибочных слов относительно эталонного бэкенда (выборочно)',
+    buckets=(0.01, 0.02, 0.05, 0.1, 0.15, 0.2, 0.3, 0.5, 1)
+)
+
+
+class TranscriptionBackend(abc.ABC):
+    """Бэкенд транскрибации"""
+
+    name = ''
+
+    def available(self) -> bool:
+        """Можно ли использовать бэкенд в этом окружении"""
+        return True
+
+    @abc.abstractmethod
+    async def transcribe(self, audio: bytes, filename: str) -> str:
+        """
+        Распознает речь
+
+        Args:
+            audio: Содержимое аудиофайла
+            filename: Имя файла (по расширению определяется формат)
+
+        Returns:
+            Распознанный текст
+
+        Raises:
+            Exception: ошибка бэкенда (пробуется следующий по маршруту)
+        """
+
+    def shutdown(self) -> None:
+        """Освобождает ресурсы бэкенда"""
+
+
+class OpenAIBackend(TranscriptionBackend):
+    """OpenAI Whisper API"""
+
+    name = 'openai'
+
+    def __init__(self, model: str):
+        self.model = model
+
+    async def transcribe(self, audio: bytes, filename: str) -> str:
+        transcript = await asyncio.to_thread(
+            services.openai.audio.transcriptions.create,
+            model=self.model,
+            file=(filename, audio),
+            language=LANGUAGE
+        )
+        return transcript.text
+
+
+# Модель faster-whisper в процессе пула (загружается инициализатором процесса)
+_worker_model = None
+
+
+def _init_local_worker(model_size: str, compute_type: str, threads: int) -> None:
+    global _worker_model
+    from faster_whisper import WhisperModel
+    _worker_model = WhisperModel(model_size, device='cpu', compute_type=compute_type, cpu_threads=threads)
+
+
+def _transcribe_in_worker(audio: bytes) -> str:
+    segments, _ = _worker_model.transcribe(io.BytesIO(audio), language=LANGUAGE, beam_size=1, vad_filter=True)
+    return ' '.join(segment.text.strip() for segment in segments).strip()
+
+
+class LocalWhisperBackend(TranscriptionBackend):
+    """Квантованная модель faster-whisper на CPU в пуле процессов"""
+
+    name = 'local'
+
+    def __init__(self, model_size: str, compute_type: str, workers: int, threads: int):
+        """
+        Args:
+            model_size: Модель faster-whisper (tiny, base, small...)
+            compute_type: Квантование (int8 - быстрее всего на CPU)
+            workers: Процессов с моделью (одновременных транскрибаций)
+            threads: Потоков CPU на процесс
+        """
+        self.model_size = model_size
+        self.compute_type = compute_type
+        self.workers = workers
+        self.threads = threads
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._available: Optional[bool] = None
+
+    def available(self) -> bool:
+        if self._available is None:
+            self._available = importlib.util.find_spec('faster_whisper') is not None
+            if not self._available:
+                bot_logger.warning('VOICE', 'faster-whisper не установлен, локальная транскрибация отключена')
+        return self._available
+
+    async def transcribe(self, audio: bytes, filename: str) -> str:
+        if self._pool is None:
+            # Пул (и загрузка модели) создается при первом голосовом, а не при запуске бота
+            # spawn, а не fork: копия процесса бота с event loop, потоками и
+            # открытыми соединениями в дочернем процессе небезопасна
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_local_worker,
+                initargs=(self.model_size, self.compute_type, self.threads)
+            )
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._pool, _transcribe_in_worker, audio)
+        except BrokenProcessPool:
+            # Процесс с моделью упал (например, не хватило памяти) - следующий вызов создаст пул заново
+            self._pool = None
+            raise
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+def parse_routes(raw: str) -> List[Tuple[str, Optional[float]]]:
+    """
+    Разбирает маршрут транскрибации
+
+    Args:
+        raw: Строка вида "local<30,openai"
+
+    Returns:
+        Список (бэкенд, максимальная длительность в секундах или None)
+    """
+    routes = []
+    for item in raw.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, limit = item.partition('<')
+        try:
+            routes.append((name.strip(), float(limit) if limit else None))
+        except ValueError:
+            bot_logger.warning('SYSTEM', f'Некорректный маршрут транскрибации: {item}')
+    return routes
+
+
+def word_error_rate(hypothesis: str, reference: str) -> float:
+    """
+    Доля ошибочных слов (замены, вставки, удаления) относительно эталона
+
+    Args:
+        hypothesis: Проверяемый текст
+        reference: Эталонный текст
+
+    Returns:
+        WER (0 - полное совпадение)
+    """
+    hyp = re.findall(r'\w+', hypothesis.lower())
+    ref = re.findall(r'\w+', reference.lower())
+    if not ref:
+        return 0.0 if not hyp else 1.0
+    previous = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, start=1):
+        current = [i] + [0] * len(hyp)
+        for j, hyp_word in enumerate(hyp, start=1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref_word != hyp_word))
+        previous = current
+    return previous[-1] / len(ref)
+
+
+class Transcriber:
+    """Выбор бэкенда по маршруту, запасные бэкенды и выборочная сверка точности"""
+
+    def __init__(self, backends: Dict[str, TranscriptionBackend], routes: List[Tuple[str, Optional[float]]],
+                 sample_rate: float, reference: str):
+        """
+        Args:
+            backends: Бэкенды по именам
+            routes: Маршрут (бэкенд, максимальная длительность)
+            sample_rate: Доля транскрибаций, сверяемых с эталонным бэкендом
+            reference: Имя эталонного бэкенда
+        """
+        self.backends = backends
+        self.routes = routes
+        self.sample_rate = sample_rate
+        self.reference = reference
+        self._samples: set = set()
+
+    def chain(self, duration: Optional[float]) -> List[TranscriptionBackend]:
+        """Бэкенды для голосового длительностью duration в порядке попыток"""
+        chain = []
+        for name, limit in self.routes:
+            backend = self.backends.get(name)
+            if backend is None or not backend.available():
+                continue
+            if limit is not None and (duration is None or duration >= limit):
+                continue
+            chain.append(backend)
+        return chain
+
+    async def transcribe(self, audio_file_path: str, duration: Optional[float] = None) -> Optional[str]:
+        """
+        Транскрибирует голосовое сообщение
+
+        Args:
+            audio_file_path: Путь к аудиофайлу
+            duration: Длительность голосового (секунды, из Telegram)
+
+        Returns:
+            Транскрибированный текст или None, если ни один бэкенд не справился
+        """
+        with open(audio_file_path, 'rb') as audio_file:
+            audio = audio_file.read()
+        filename = audio_file_path.rsplit('/', 1)[-1]
+
+        for backend in self.chain(duration):
+            text = await self._run(backend, audio, filename, duration)
+            if text:
+                self._maybe_sample(backend, audio, filename, text)
+                return text
+
+        bot_logger.error('VOICE', 'Не удалось транскрибировать голосовое ни одним бэкендом',
+                         file=audio_file_path, duration=duration)
+        return None
+
+    async def _run(self, backend: TranscriptionBackend, audio: bytes, filename: str,
+                   duration: Optional[float]) -> Optional[str]:
+        started = time.perf_counter()
+        try:
+            text = await backend.transcribe(audio, filename)
+        except Exception as e:
+            transcription_total.inc(backend=backend.name, result='error')
+            bot_logger.error('VOICE', f'Ошибка транскрибации ({backend.name}): {str(e)}', duration=duration)
+            return None
+        transcription_seconds.observe(time.perf_counter() - started, backend=backend.name)
+        transcription_total.inc(backend=backend.name, result='ok' if text else 'empty')
+        return text
+
+    def _maybe_sample(self, backend: TranscriptionBackend, audio: bytes, filename: str, text: str) -> None:
+        """Выборочно сверяет результат с эталонным бэкендом (в фоне, пользователь не ждет)"""
+        reference = self.backends.get(self.reference)
+        if (backend is reference or reference is None or not reference.available()
+                or random.random() >= self.sample_rate):
+            return
+        task = asyncio.create_task(self._sample(backend.name, reference, audio, filename, text))
+        self._samples.add(task)
+        task.add_done_callback(self._samples.discard)
+
+    async def _sample(self, name: str, reference: TranscriptionBackend, audio: bytes, filename: str,
+                      text: str) -> None:
+        expected = await self._run(reference, audio, filename, None)
+        if expected:
+            wer = word_error_rate(text, expected)
+            transcription_wer.observe(wer, backend=name)
+            bot_logger.info('VOICE', 'Сверка транскрибации с эталоном', backend=name, wer=round(wer, 3))
+
+    def shutdown(self) -> None:
+        """Останавливает пулы бэкендов (при остановке бота)"""
+        for backend in self.backends.values():
+            backend.shutdown()
+
+
+# Глобальный транскрибатор голосовых
+transcriber = Transcriber(
+    backends={
+        'openai': OpenAIBackend(TRANSCRIPTION_OPENAI_MODEL),
+        'local': LocalWhisperBackend(
+            TRANSCRIPTION_LOCAL_MODEL, TRANSCRIPTION_LOCAL_COMPUTE,
+            TRANSCRIPTION_LOCAL_WORKERS, TRANSCRIPTION_LOCAL_THREADS
+        ),
+    },
+    routes=parse_routes(TRANSCRIPTION_ROUTES),
+    sample_rate=TRANSCRIPTION_SAMPLE_RATE,
+    reference=TRANSCRIPTION_REFERENCE,
+)
@@ -18,22 +18,26 @@ git pull origin main
 echo "✅ Код обновлен"
 echo ""
 
-# 2. Останавливаем контейнер
-echo "2️⃣ Остановка контейнера..."
-docker-compose down
-echo "✅ Контейнер остановлен"
+# 2. Сборка нового образа (старый контейнер продолжает работать)
+echo "2️⃣ Сборка образа (это займет 1-2 минуты, бот пока работает)..."
+docker-compose build --no-cache
+echo "✅ Образ собран"
 echo ""
 
-# 3. Пересборка образа без кэша
-echo "3️⃣ Пересборка образа (это займет 1-2 минуты)..."
-docker-compose build --no-cache
-echo "✅ Образ пересобран"
+# 3. Замена контейнера: старый получает SIGTERM, перестает принимать
+#    обновления, дожидается начатых шагов пользователей (до DRAIN_TIMEOUT)
+#    и передает незавершенные ожидания n8n новому (stop_grace_period)
+echo "3️⃣ Замена контейнера (остановка с передачей начатых шагов)..."
+docker-compose up -d --no-deps bot
+echo "✅ Контейнер заменен"
 echo ""
 
-# 4. Запуск контейнера
-echo "4️⃣ Запуск контейнера..."
-docker-compose up -d
-echo "✅ Контейнер запущен"
+# 4. Отчет об остановке старого контейнера
+echo "4️⃣ Отчет об остановке:"
+LATEST_LOG=$(ls -t logs/bot_*.log 2>/dev/null | head -1)
+if [ -n "$LATEST_LOG" ]; then
+    grep "Остановка: ожидания n8n" "$LATEST_LOG" | tail -1 || echo "   (нет записи об остановке)"
+fi
 echo ""
 
 # 5. Ожидание запуска
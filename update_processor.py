@@ -0,0 +1,76 @@
+"""
+Параллельная обработка обновлений разных пользователей
+
+С CONCURRENT_UPDATES > 1 PTB обрабатывает несколько обновлений
+одновременно. Большинство шагов бота читают состояние пользователя и
+пишут новое без проверки версии, поэтому обновления одного пользователя
+(двойное нажатие кнопки, голосовое и текст подряд) выполняются по
+очереди, в порядке прихода, а обновления разных пользователей -
+параллельно. Обновление ждет своей очереди до того, как занять место из
+CONCURRENT_UPDATES: много сообщений одного пользователя не задерживают
+остальных.
+"""
+import asyncio
+from typing import Any, Awaitable, Dict
+
+from telegram.ext import BaseUpdateProcessor
+
+from metrics import metrics
+
+updates_waiting = metrics.gauge(
+    'updates_waiting_for_user', 'Обновления, ждущие завершения предыдущего обновления того же пользователя'
+)
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Обновления одного пользователя по очереди, разных - до max_concurrent_updates одновременно"""
+
+    def __init__(self, max_concurrent_updates: int):
+        """
+        Args:
+            max_concurrent_updates: Сколько обновлений обрабатывать одновременно
+        """
+        super().__init__(max_concurrent_updates)
+        self._locks: Dict[int, asyncio.Lock] = {}
+        # Обновлений пользователя в обработке и в ожидании: замок удаляется, когда их не осталось
+        self._pending: Dict[int, int] = {}
+        self._waiting = 0
+
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        user = getattr(update, 'effective_user', None)
+        if user is None:
+            await super().process_update(update, coroutine)
+            return
+
+        user_id = user.id
+        lock = self._locks.setdefault(user_id, asyncio.Lock())
+        self._pending[user_id] = self._pending.get(user_id, 0) + 1
+        try:
+            if lock.locked():
+                self._waiting += 1
+                updates_waiting.set(self._waiting)
+                try:
+                    await lock.acquire()
+                finally:
+                    self._waiting -= 1
+                    updates_waiting.set(self._waiting)
+            else:
+                await lock.acquire()
+            try:
+                await super().process_update(update, coroutine)
+            finally:
+                lock.release()
+        finally:
+            self._pending[user_id] -= 1
+            if not self._pending[user_id]:
+                del self._pending[user_id]
+                del self._locks[user_id]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
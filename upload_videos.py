@@ -1,31 +1,41 @@
 #!/usr/bin/env python3
 """
-Скрипт для однократной загрузки видео в Telegram и получения file_id.
+Скрипт для загрузки видео в Telegram и заполнения реестра file_id.
 
 Запуск:
-    python upload_videos.py YOUR_CHAT_ID
+    python upload_videos.py YOUR_CHAT_ID [--parallel 3] [--force]
 
 Ваш chat_id можно узнать через @userinfobot в Telegram.
 
-После запуска скрипт выведет строки для .env файла, например:
-    VIDEO_LEARN1_FILE_ID=BAACAgIAAxkBAAI...
+Скрипт загружает learn1.mp4 - learn7.mp4 параллельно (не более --parallel
+файлов одновременно) и записывает результат (путь, размер, sha256, file_id)
+в тот же реестр, который бот читает при работе (media/file_ids.json).
+Перезапуск бота не нужен. При повторном запуске неизмененные файлы
+пропускаются, измененные загружаются заново.
 
-Добавьте эти строки в /opt/pptbot/.env и перезапустите бота.
-Бот будет отправлять видео по file_id без ограничения 50 МБ.
+Если задан TELEGRAM_API_BASE_URL (собственный сервер telegram-bot-api),
+файлы передаются серверу по локальному пути, лимит - 2 ГБ.
 
-ВАЖНО: файлы > 50 МБ нужно предварительно сжать:
+ВАЖНО: для облачного Bot API файлы > 50 МБ нужно предварительно сжать:
     ffmpeg -i media/learn1.mp4 -vcodec libx264 -crf 28 -preset fast media/learn1.mp4.tmp
     mv media/learn1.mp4.tmp media/learn1.mp4
 """
+import argparse
 import asyncio
 import os
 import sys
+import time
 
 from dotenv import load_dotenv
 from telegram import Bot
+from telegram.request import HTTPXRequest
 
 load_dotenv()
 
+from config import TELEGRAM_API_BASE_URL, TELEGRAM_LOCAL_MODE, TELEGRAM_MAX_UPLOAD_MB  # noqa: E402 (нужен загруженный .env)
+from telegram_transport import bot_api_server_kwargs, local_media_path  # noqa: E402
+from video_registry import video_registry  # noqa: E402
+
 VIDEOS = [
     ('VIDEO_LEARN1_FILE_ID', 'media/learn1.mp4'),
     ('VIDEO_LEARN2_FILE_ID', 'media/learn2.mp4'),
@@ -36,64 +46,140 @@ VIDEOS = [
     ('VIDEO_LEARN7_FILE_ID', 'media/learn7.mp4'),
 ]
 
+MAX_UPLOAD_MB = TELEGRAM_MAX_UPLOAD_MB
+PROGRESS_INTERVAL = 5  # Секунд между строками прогресса для долгих загрузок
 
-async def upload_all(chat_id: str) -> None:
-    token = os.getenv('TELEGRAM_BOT_TOKEN')
-    if not token:
-        print('❌ TELEGRAM_BOT_TOKEN не установлен в .env')
-        sys.exit(1)
 
-    bot = Bot(token=token)
-    print('\n🎬 Загрузка видео в Telegram...\n')
-    results = []
+def format_mb(size_bytes: int) -> str:
+    return f'{size_bytes / (1024 * 1024):.1f} МБ'
+
+
+async def report_progress(video_path: str, size: int, started: float) -> None:
+    """Периодически печатает, сколько идет загрузка (без переданных байт), пока она не завершится"""
+    while True:
+        await asyncio.sleep(PROGRESS_INTERVAL)
+        print(f'   … {video_path}: загружается {time.monotonic() - started:.0f}с ({format_mb(size)})')
+
 
-    for env_key, video_path in VIDEOS:
-        existing = os.getenv(env_key)
-        if existing:
-            print(f'✅ {env_key} уже установлен, пропускаем')
-            results.append(f'{env_key}={existing}')
-            continue
+async def upload_one(
+    bot: Bot,
+    chat_id: str,
+    env_key: str,
+    video_path: str,
+    semaphore: asyncio.Semaphore,
+    force: bool,
+) -> dict:
+    """
+    Загружает один файл, если он изменился с прошлой загрузки
 
-        if not os.path.exists(video_path):
-            print(f'⚠️  {video_path} не найден, пропускаем')
-            continue
+    Returns:
+        Словарь со статусом: uploaded / skipped / missing / too_large / error
+    """
+    if not os.path.exists(video_path):
+        print(f'⚠️  {video_path} не найден, пропускаем')
+        return {'path': video_path, 'status': 'missing'}
 
-        size_mb = os.path.getsize(video_path) / (1024 * 1024)
-        print(f'📤 Загружаем {video_path} ({size_mb:.1f} МБ)...')
+    if os.getenv(env_key):
+        print(f'ℹ️  {env_key} задан в .env и имеет приоритет над реестром для {video_path}')
 
-        if size_mb > 50:
-            print(f'❌ {video_path} ({size_mb:.1f} МБ) превышает лимит 50 МБ.')
-            print(f'   Сожмите файл:')
+    size, sha256 = await asyncio.to_thread(video_registry.fingerprint, video_path)
+    entry = video_registry.get_entry(video_path)
+
+    if not force and entry and entry.get('sha256') == sha256 and entry.get('size') == size:
+        print(f'✅ {video_path} не изменился, пропускаем (file_id уже в реестре)')
+        return {'path': video_path, 'status': 'skipped'}
+
+    if size > MAX_UPLOAD_MB * 1024 * 1024:
+        print(f'❌ {video_path} ({format_mb(size)}) превышает лимит {MAX_UPLOAD_MB} МБ.')
+        if not TELEGRAM_LOCAL_MODE:
+            print(f'   Сожмите файл или используйте собственный сервер telegram-bot-api (TELEGRAM_API_BASE_URL):')
             print(f'   ffmpeg -i {video_path} -vcodec libx264 -crf 28 -preset fast {video_path}.tmp && mv {video_path}.tmp {video_path}\n')
-            continue
+        return {'path': video_path, 'status': 'too_large'}
 
+    async with semaphore:
+        reason = 'изменился' if entry else 'новый'
+        print(f'📤 {video_path} ({format_mb(size)}, {reason}) - начинаем загрузку')
+        started = time.monotonic()
+        progress = asyncio.create_task(report_progress(video_path, size, started))
         try:
-            with open(video_path, 'rb') as f:
+            if TELEGRAM_LOCAL_MODE:
                 msg = await bot.send_video(
                     chat_id=chat_id,
-                    video=f,
+                    video=local_media_path(video_path),
                     supports_streaming=True,
                 )
-            file_id = msg.video.file_id
-            print(f'✅ Загружено! {env_key}={file_id}\n')
-            results.append(f'{env_key}={file_id}')
+            else:
+                with open(video_path, 'rb') as f:
+                    msg = await bot.send_video(
+                        chat_id=chat_id,
+                        video=f,
+                        supports_streaming=True,
+                    )
         except Exception as e:
-            print(f'❌ Ошибка: {e}\n')
+            print(f'❌ {video_path}: ошибка загрузки: {e}')
+            return {'path': video_path, 'status': 'error'}
+        finally:
+            progress.cancel()
+
+    elapsed = max(time.monotonic() - started, 0.001)
+    if msg.video is None:
+        # Telegram может принять файл как документ или анимацию - такой file_id для видео не подходит
+        print(f'❌ {video_path}: Telegram не распознал файл как видео, file_id не записан')
+        return {'path': video_path, 'status': 'error'}
+    try:
+        video_registry.record(video_path, msg.video.file_id, size, sha256)
+    except Exception as e:
+        print(f'❌ {video_path}: загружено, но file_id не записан в реестр: {e}')
+        return {'path': video_path, 'status': 'error'}
+    print(f'✅ {video_path}: {format_mb(size)} за {elapsed:.1f}с '
+          f'({size / (1024 * 1024) / elapsed:.2f} МБ/с), file_id записан в реестр')
+    return {'path': video_path, 'status': 'uploaded', 'size': size, 'elapsed': elapsed}
+
+
+async def upload_all(chat_id: str, parallel: int, force: bool) -> None:
+    token = os.getenv('TELEGRAM_BOT_TOKEN')
+    if not token:
+        print('❌ TELEGRAM_BOT_TOKEN не установлен в .env')
+        sys.exit(1)
 
-    if results:
-        print('\n' + '=' * 60)
-        print('Добавьте в /opt/pptbot/.env:')
-        print('=' * 60)
-        for line in results:
-            print(line)
-        print('=' * 60)
-        print('\nЗатем перезапустите бота: docker compose restart bot')
+    server = TELEGRAM_API_BASE_URL or 'облачный Bot API'
+    print(f'\n🎬 Загрузка видео в Telegram через {server} (параллельно: {parallel})...\n')
+    semaphore = asyncio.Semaphore(parallel)
+    started = time.monotonic()
+
+    # Пул соединений по числу параллельных загрузок (по умолчанию у Bot он из одного соединения)
+    request = HTTPXRequest(connection_pool_size=parallel, write_timeout=600, read_timeout=120,
+                           media_write_timeout=600)
+    async with Bot(token=token, request=request, **bot_api_server_kwargs()) as bot:
+        results = await asyncio.gather(*[
+            upload_one(bot, chat_id, env_key, video_path, semaphore, force)
+            for env_key, video_path in VIDEOS
+        ])
+
+    total_elapsed = time.monotonic() - started
+    uploaded = [r for r in results if r['status'] == 'uploaded']
+    total_bytes = sum(r['size'] for r in uploaded)
+
+    print('\n' + '=' * 60)
+    for status, title in [('uploaded', 'Загружено'), ('skipped', 'Без изменений'),
+                          ('missing', 'Не найдено'), ('too_large', 'Слишком большие'),
+                          ('error', 'Ошибки')]:
+        count = sum(1 for r in results if r['status'] == status)
+        if count:
+            print(f'{title}: {count}')
+    if uploaded:
+        print(f'Всего: {format_mb(total_bytes)} за {total_elapsed:.1f}с '
+              f'({total_bytes / (1024 * 1024) / max(total_elapsed, 0.001):.2f} МБ/с)')
+    print(f'Реестр: {video_registry.registry_path}')
+    print('=' * 60)
+    print('\nБот подхватит новые file_id автоматически, перезапуск не нужен.')
 
 
 if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print('Использование: python upload_videos.py YOUR_CHAT_ID')
-        print('Ваш chat_id: напишите @userinfobot в Telegram')
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description='Загрузка видео в Telegram и заполнение реестра file_id')
+    parser.add_argument('chat_id', help='Ваш chat_id (напишите @userinfobot в Telegram)')
+    parser.add_argument('--parallel', type=int, default=3, help='Сколько файлов загружать одновременно')
+    parser.add_argument('--force', action='store_true', help='Загрузить заново даже неизмененные файлы')
+    args = parser.parse_args()
 
-    asyncio.run(upload_all(sys.argv[1]))
+    asyncio.run(upload_all(args.chat_id, max(1, args.parallel), args.force))
@@ -3,15 +3,78 @@
 
 Логика:
   1. Если в .env есть file_id — отправляем по file_id (без лимитов размера).
-  2. Иначе — загружаем файл с диска и логируем полученный file_id,
-     чтобы пользователь мог добавить его в .env.
+  2. Иначе ищем file_id в реестре (media/file_ids.json), привязанный к
+     содержимому файла.
+  3. Иначе — загружаем файл с диска один раз и сохраняем полученный file_id
+     в реестр; одновременные первые отправки ждут эту же загрузку.
 
-Telegram ограничивает загрузку файлов через Bot API до 50 МБ.
+Все отправки видео идут через media-полосу (media_transfer.py) с отдельным
+пулом соединений, поэтому загрузки не задерживают текстовые ответы бота.
+
+Облачный Bot API ограничивает загрузку файлов до 50 МБ.
 Для первой загрузки файлов > 50 МБ сожмите видео с помощью ffmpeg:
   ffmpeg -i input.mp4 -vcodec libx264 -crf 28 -preset fast output.mp4
+
+С собственным сервером telegram-bot-api (TELEGRAM_API_BASE_URL, локальный
+режим) файл передается серверу путем без тела запроса, лимит - 2 ГБ.
 """
 import os
+from telegram.error import BadRequest
+from config import TELEGRAM_LOCAL_MODE, TELEGRAM_MAX_UPLOAD_MB
 from logger import bot_logger
+from media_transfer import media_lane
+from telegram_transport import local_media_path
+from video_registry import video_registry
+
+
+async def _send_by_file_id(bot, chat_id: int, file_id: str) -> None:
+    await media_lane.send_video(
+        bot,
+        chat_id=chat_id,
+        video=file_id,
+        supports_streaming=True,
+    )
+
+
+async def _upload_from_disk(bot, chat_id: int, video_path: str) -> str | None:
+    """
+    Загружает видео с диска и отправляет его пользователю
+
+    Returns:
+        file_id загруженного видео или None
+    """
+    video_name = os.path.basename(video_path)
+    size_mb = os.path.getsize(video_path) / (1024 * 1024)
+    if size_mb > TELEGRAM_MAX_UPLOAD_MB:
+        bot_logger.error('VIDEO', f'{video_name} ({size_mb:.1f} МБ) превышает лимит '
+                         f'{TELEGRAM_MAX_UPLOAD_MB} МБ', telegram_id=chat_id)
+        return None
+
+    if TELEGRAM_LOCAL_MODE:
+        # Локальный сервер читает файл сам - передаем только путь
+        bot_logger.info('VIDEO', f'Отправляем {video_name} ({size_mb:.1f} МБ) по локальному пути...',
+                        telegram_id=chat_id)
+        msg = await media_lane.send_video(
+            bot,
+            chat_id=chat_id,
+            video=local_media_path(video_path),
+            supports_streaming=True,
+        )
+    else:
+        bot_logger.info('VIDEO', f'Загружаем {video_name} ({size_mb:.1f} МБ)...', telegram_id=chat_id)
+        with open(video_path, 'rb') as video_file:
+            msg = await media_lane.send_video(
+                bot,
+                chat_id=chat_id,
+                video=video_file,
+                supports_streaming=True,
+            )
+
+    if msg and msg.video:
+        bot_logger.info('VIDEO', f'✅ {video_name} загружено, file_id сохранен в реестр',
+                        telegram_id=chat_id)
+        return msg.video.file_id
+    return None
 
 
 async def send_video_safe(
@@ -30,38 +93,39 @@ async def send_video_safe(
         file_id: Telegram file_id (если уже загружен ранее)
     """
     video_name = os.path.basename(video_path)
-    env_key = 'VIDEO_' + video_name.replace('.mp4', '').upper() + '_FILE_ID'
 
     try:
         if file_id:
-            await bot.send_video(
-                chat_id=chat_id,
-                video=file_id,
-                supports_streaming=True,
-            )
+            await _send_by_file_id(bot, chat_id, file_id)
             return
 
         if not os.path.exists(video_path):
             bot_logger.warning('VIDEO', f'Файл не найден: {video_path}', telegram_id=chat_id)
             return
 
-        size_mb = os.path.getsize(video_path) / (1024 * 1024)
-        bot_logger.info('VIDEO', f'Загружаем {video_name} ({size_mb:.1f} МБ)...', telegram_id=chat_id)
+        cached_file_id = await video_registry.lookup(video_path)
+        if cached_file_id:
+            try:
+                await _send_by_file_id(bot, chat_id, cached_file_id)
+                return
+            except BadRequest as e:
+                # file_id стал недействительным (например, сменился токен бота) - загружаем заново
+                bot_logger.warning('VIDEO', f'file_id для {video_name} отклонен: {str(e)}',
+                                   telegram_id=chat_id)
+                video_registry.invalidate(video_path)
 
-        with open(video_path, 'rb') as video_file:
-            msg = await bot.send_video(
-                chat_id=chat_id,
-                video=video_file,
-                supports_streaming=True,
-            )
+        async def upload() -> str | None:
+            return await _upload_from_disk(bot, chat_id, video_path)
 
-        if msg and msg.video:
-            fid = msg.video.file_id
-            bot_logger.info(
-                'VIDEO',
-                f'✅ {video_name} загружено. Добавьте в .env: {env_key}={fid}',
-                telegram_id=chat_id,
-            )
+        # Вторая попытка нужна, если параллельная загрузка, которую мы ждали, не удалась
+        for _ in range(2):
+            uploaded_file_id, uploaded_here = await video_registry.upload_once(video_path, upload)
+            if uploaded_here:
+                return
+            if uploaded_file_id:
+                # Видео загрузил параллельный запрос - отправляем по его file_id
+                await _send_by_file_id(bot, chat_id, uploaded_file_id)
+                return
 
     except Exception as e:
         bot_logger.error('VIDEO', f'Ошибка при отправке {video_name}: {str(e)}', telegram_id=chat_id)
@@ -0,0 +1,231 @@
+"""
+Реестр Telegram file_id для видео из папки media/
+
+Ключ записи - путь к файлу, запись действительна только пока совпадает
+sha256 содержимого. Первая успешная загрузка сохраняет file_id,
+все последующие отправки используют его без повторной загрузки.
+Одновременные первые отправки одного файла объединяются в одну загрузку.
+
+Формат файла реестра (JSON):
+    {
+      "media/learn1.mp4": {
+        "sha256": "...", "size": 12345, "file_id": "BAACAgIA...", "uploaded_at": "..."
+      }
+    }
+"""
+import asyncio
+import hashlib
+import json
+import os
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from config import VIDEO_REGISTRY_FILE
+from logger import bot_logger
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """
+    Считает sha256 содержимого файла
+
+    Args:
+        path: Путь к файлу
+        chunk_size: Размер блока чтения
+
+    Returns:
+        Hex-строка хеша
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class VideoFileIdRegistry:
+    """Персистентный реестр file_id, привязанных к содержимому файлов"""
+
+    def __init__(self, registry_path: str):
+        """
+        Args:
+            registry_path: Путь к JSON файлу реестра
+        """
+        self.registry_path = registry_path
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._loaded_mtime: Optional[float] = None
+        # Кеш хешей: путь -> (размер, mtime, sha256), чтобы не перечитывать 50 МБ на каждую отправку
+        self._hash_cache: Dict[str, Tuple[int, float, str]] = {}
+        # Загрузки в процессе: ключ -> future с file_id
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    @staticmethod
+    def _key(video_path: str) -> str:
+        return os.path.normpath(video_path)
+
+    def _reload_if_changed(self) -> None:
+        """Перечитывает реестр, если файл изменился (например, его обновил upload_videos.py)"""
+        try:
+            mtime = os.path.getmtime(self.registry_path)
+        except OSError:
+            return
+        if mtime == self._loaded_mtime:
+            return
+        try:
+            with open(self.registry_path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+            self._loaded_mtime = mtime
+        except (OSError, ValueError) as e:
+            bot_logger.error('VIDEO', f'Не удалось прочитать реестр file_id: {str(e)}',
+                             file=self.registry_path)
+
+    def _save(self) -> None:
+        """Атомарно сохраняет реестр на диск"""
+        folder = os.path.dirname(self.registry_path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        tmp_path = f'{self.registry_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._entries, f, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.registry_path)
+        self._loaded_mtime = os.path.getmtime(self.registry_path)
+
+    def fingerprint(self, video_path: str) -> Tuple[int, str]:
+        """
+        Возвращает (размер, sha256) файла; хеш пересчитывается только при изменении файла
+
+        Args:
+            video_path: Путь к видео
+
+        Returns:
+            (size, sha256)
+        """
+        stat = os.stat(video_path)
+        key = self._key(video_path)
+        cached = self._hash_cache.get(key)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime:
+            return cached[0], cached[2]
+
+        sha256 = file_sha256(video_path)
+        self._hash_cache[key] = (stat.st_size, stat.st_mtime, sha256)
+        return stat.st_size, sha256
+
+    def get_entry(self, video_path: str) -> Optional[Dict[str, Any]]:
+        """
+        Возвращает запись реестра без проверки содержимого
+
+        Args:
+            video_path: Путь к видео
+
+        Returns:
+            Словарь записи или None
+        """
+        self._reload_if_changed()
+        return self._entries.get(self._key(video_path))
+
+    async def lookup(self, video_path: str) -> Optional[str]:
+        """
+        Ищет file_id для текущего содержимого файла
+
+        Args:
+            video_path: Путь к видео
+
+        Returns:
+            file_id или None, если файл еще не загружался или изменился
+        """
+        entry = self.get_entry(video_path)
+        if not entry or not entry.get('file_id'):
+            return None
+
+        size, sha256 = await asyncio.to_thread(self.fingerprint, video_path)
+        if entry.get('sha256') != sha256 or entry.get('size') != size:
+            return None
+        return entry['file_id']
+
+    def record(self, video_path: str, file_id: str, size: Optional[int] = None,
+               sha256: Optional[str] = None) -> None:
+        """
+        Сохраняет file_id для текущего содержимого файла
+
+        Args:
+            video_path: Путь к видео
+            file_id: Telegram file_id
+            size: Размер файла (если уже известен)
+            sha256: Хеш файла (если уже известен)
+        """
+        if size is None or sha256 is None:
+            size, sha256 = self.fingerprint(video_path)
+
+        self._reload_if_changed()
+        self._entries[self._key(video_path)] = {
+            'sha256': sha256,
+            'size': size,
+            'file_id': file_id,
+            'uploaded_at': datetime.utcnow().isoformat(),
+        }
+        try:
+            self._save()
+        except OSError as e:
+            bot_logger.error('VIDEO', f'Не удалось сохранить реестр file_id: {str(e)}',
+                             file=self.registry_path)
+
+    def invalidate(self, video_path: str) -> None:
+        """
+        Удаляет запись (например, если Telegram отклонил file_id)
+
+        Args:
+            video_path: Путь к видео
+        """
+        self._reload_if_changed()
+        if self._entries.pop(self._key(video_path), None) is not None:
+            try:
+                self._save()
+            except OSError as e:
+                bot_logger.error('VIDEO', f'Не удалось сохранить реестр file_id: {str(e)}',
+                                 file=self.registry_path)
+
+    async def upload_once(
+        self,
+        video_path: str,
+        upload: Callable[[], Awaitable[Optional[str]]]
+    ) -> Tuple[Optional[str], bool]:
+        """
+        Объединяет одновременные первые загрузки одного файла
+
+        Первый вызов (лидер) выполняет upload и записывает file_id в реестр,
+        остальные ждут его результат. Если file_id для этого содержимого уже
+        в реестре, загрузка не выполняется.
+
+        Args:
+            video_path: Путь к видео
+            upload: Корутина загрузки, возвращающая file_id
+
+        Returns:
+            (file_id, True если загрузку выполнил этот вызов)
+        """
+        size, sha256 = await asyncio.to_thread(self.fingerprint, video_path)
+        key = f'{self._key(video_path)}:{sha256}'
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight), False
+
+        # Пока считался хеш, другой вызов мог закончить загрузку и освободить место лидера
+        entry = self.get_entry(video_path)
+        if entry and entry.get('file_id') and entry.get('sha256') == sha256 and entry.get('size') == size:
+            return entry['file_id'], False
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        file_id = None
+        try:
+            file_id = await upload()
+            if file_id:
+                self.record(video_path, file_id, size, sha256)
+            return file_id, True
+        finally:
+            future.set_result(file_id)
+            del self._inflight[key]
+
+
+# Глобальный реестр
+video_registry = VideoFileIdRegistry(VIDEO_REGISTRY_FILE)
@@ -2,13 +2,20 @@
 Веб-сервер для приема ответов от n8n webhooks
 """
 import asyncio
+import hmac
 from aiohttp import web
 from logger import bot_logger
-from typing import Dict, Any
+from metrics import metrics
+from config import TELEGRAM_API_BASE_URL, ANALYTICS_TOKEN, METRICS_TOKEN
+from analytics import funnel_analytics
+from handoff import handoffs
+from telegram_transport import bot_api_health
+from typing import Dict, Any, Optional
 
 
 # Глобальное хранилище для ожидания ответов
-# Структура: {request_id: {'event': asyncio.Event, 'response': str}}
+# Структура: {request_id: {'event': asyncio.Event, 'response': str | Dict[int, str]}}
+# Для пакетных запросов response - словарь {номер части: текст}
 pending_responses: Dict[str, Dict[str, Any]] = {}
 
 
@@ -37,6 +44,71 @@ async def handle_prodaj_response(request):
     return await handle_n8n_response(request, 'prodaj')
 
 
+def parse_part_number(value: Any) -> Optional[int]:
+    """
+    Номер части пакетного ответа (число или строка с числом больше нуля)
+    
+    Args:
+        value: Номер из ответа n8n
+        
+    Returns:
+        Номер или None, если он некорректен
+    """
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        return None
+    return number if number > 0 else None
+
+
+def parse_batch_parts(payload: Any, request_id: Optional[str] = None) -> Dict[int, str]:
+    """
+    Разбирает пакетный ответ n8n на отдельные результаты
+    
+    Поддерживаемые форматы поля responses:
+      - [{"post_number": 1, "response": "..."}, ...]
+      - ["текст 1", "текст 2", ...] (нумерация по порядку с 1)
+      - {"1": "текст 1", "2": "текст 2", ...}
+    
+    Части с некорректным номером пропускаются (с предупреждением в логе).
+    
+    Args:
+        payload: Значение поля responses из тела запроса
+        request_id: ID запроса (для логов)
+        
+    Returns:
+        Словарь {номер части: текст}
+    """
+    parts: Dict[int, str] = {}
+    
+    if isinstance(payload, dict):
+        for key, value in payload.items():
+            number = parse_part_number(key)
+            if number is None:
+                bot_logger.warning('WEBHOOK', f'Часть пакетного ответа с некорректным номером пропущена: {key!r}',
+                                   request_id=request_id)
+                continue
+            if value:
+                parts[number] = str(value)
+    elif isinstance(payload, list):
+        for index, item in enumerate(payload, start=1):
+            if isinstance(item, dict):
+                raw_number = item.get('post_number') or item.get('index') or index
+                number = parse_part_number(raw_number)
+                text = item.get('response') or item.get('text')
+            else:
+                raw_number = number = index
+                text = item
+            if number is None:
+                bot_logger.warning('WEBHOOK', f'Часть пакетного ответа с некорректным номером пропущена: {raw_number!r}',
+                                   request_id=request_id)
+                continue
+            if text:
+                parts[number] = str(text)
+    
+    return parts
+
+
 async def handle_n8n_response(request, webhook_type: str):
     """
     Общий обработчик ответов от n8n
@@ -58,6 +130,22 @@ async def handle_n8n_response(request, webhook_type: str):
         telegram_id = headers.get('telegram-id') or headers.get('telegram_id')
         request_id = headers.get('request-id') or headers.get('request_id')
         response_text = headers.get('response')
+        batch_parts = None
+        
+        # Пакетный ответ приходит в теле запроса: {"responses": [...]}
+        if not response_text and request.can_read_body:
+            try:
+                body = await request.json()
+            except Exception:
+                body = None
+            if isinstance(body, dict):
+                telegram_id = telegram_id or body.get('telegram_id')
+                request_id = request_id or body.get('request_id')
+                if body.get('responses'):
+                    batch_parts = parse_batch_parts(body['responses'], request_id)
+                    response_text = '\n\n'.join(batch_parts.values())
+                else:
+                    response_text = body.get('response')
         
         # Преобразуем telegram_id в int если это строка
         if telegram_id:
@@ -86,12 +174,18 @@ async def handle_n8n_response(request, webhook_type: str):
         
         # Проверяем, ожидается ли этот ответ
         if request_id in pending_responses:
-            pending_responses[request_id]['response'] = response_text
+            pending_responses[request_id]['response'] = batch_parts if batch_parts else response_text
             pending_responses[request_id]['event'].set()
             bot_logger.info('WEBHOOK', 
                           f'Ответ передан обработчику ({webhook_type})', 
                           telegram_id=telegram_id, 
                           request_id=request_id)
+        elif await handoffs.deliver(request_id, batch_parts if batch_parts else response_text):
+            # Ожидание передано между запусками бота при перезапуске
+            bot_logger.info('WEBHOOK', 
+                          f'Ответ передан продолжению после перезапуска ({webhook_type})', 
+                          telegram_id=telegram_id, 
+                          request_id=request_id)
         else:
             bot_logger.warning('WEBHOOK', 
                              f'Получен ответ для неожидаемого request_id ({webhook_type})', 
@@ -109,7 +203,51 @@ async def handle_n8n_response(request, webhook_type: str):
 
 async def health_check(request):
     """Health check endpoint"""
-    return web.json_response({'status': 'ok', 'service': 'pptbot-webhook-server'})
+    response = {'status': 'ok', 'service': 'pptbot-webhook-server'}
+    
+    # При собственном сервере telegram-bot-api проверяем и его
+    if TELEGRAM_API_BASE_URL:
+        bot_api = await bot_api_health.check()
+        response['bot_api'] = bot_api
+        if bot_api['status'] == 'error':
+            response['status'] = 'degraded'
+            return web.json_response(response, status=503)
+    
+    return web.json_response(response)
+
+
+def has_token(request, expected: str) -> bool:
+    """
+    Проверяет токен служебного endpoint
+    
+    Args:
+        request: Запрос (токен в Authorization: Bearer ... или ?token=)
+        expected: Ожидаемый токен
+        
+    Returns:
+        True, если токен совпадает
+    """
+    token = request.headers.get('Authorization', '').removeprefix('Bearer ').strip() \
+        or request.query.get('token', '')
+    return hmac.compare_digest(token.encode(), expected.encode())
+
+
+async def metrics_handler(request):
+    """Метрики процесса в формате Prometheus"""
+    if not has_token(request, METRICS_TOKEN):
+        return web.json_response({'error': 'unauthorized'}, status=401)
+    return web.Response(text=metrics.render(), content_type='text/plain', charset='utf-8')
+
+
+async def analytics_funnel_handler(request):
+    """Последний снимок аналитики воронки (JSON)"""
+    if not has_token(request, ANALYTICS_TOKEN):
+        return web.json_response({'error': 'unauthorized'}, status=401)
+    
+    snapshot = await funnel_analytics.latest()
+    if not snapshot:
+        return web.json_response({'error': 'snapshot not ready'}, status=503)
+    return web.json_response(snapshot)
 
 
 def create_app():
@@ -125,6 +263,17 @@ def create_app():
     
     # Health check
     app.router.add_get('/health', health_check)
+
+    # Метрики (Prometheus) и аналитика воронки - только с токеном: порт открыт наружу
+    if METRICS_TOKEN:
+        app.router.add_get('/metrics', metrics_handler)
+    else:
+        bot_logger.warning('WEBHOOK', 'METRICS_TOKEN не задан - /metrics выключен')
+    
+    if ANALYTICS_TOKEN:
+        app.router.add_get('/analytics/funnel', analytics_funnel_handler)
+    else:
+        bot_logger.warning('WEBHOOK', 'ANALYTICS_TOKEN не задан - /analytics/funnel выключен')
     
     return app
 
@@ -155,7 +304,7 @@ async def start_webhook_server(port: int = 8080):
     return runner
 
 
-async def wait_for_response(request_id: str, timeout: int = 180) -> str:
+async def wait_for_response(request_id: str, timeout: int = 180) -> Any:
     """
     Ожидает ответ от n8n через webhook
     
@@ -164,7 +313,7 @@ async def wait_for_response(request_id: str, timeout: int = 180) -> str:
         timeout: таймаут в секундах (по умолчанию 180 = 3 минуты)
         
     Returns:
-        Текст ответа или None если таймаут
+        Текст ответа (или словарь частей для пакетного ответа) либо None если таймаут
     """
     # Создаем Event для этого request_id
     event = asyncio.Event()